@@ -115,6 +115,20 @@ THRESHOLD_HEIGHT_DIFFERENCE = 20
 # 用于判断两个字幕文本的矩形框是否相似，如果X轴和Y轴偏差都在指定阈值内，则认为时同一个文本框
 PIXEL_TOLERANCE_Y = 20  # 允许检测框纵向偏差的像素点数
 PIXEL_TOLERANCE_X = 20  # 允许检测框横向偏差的像素点数
+# mask缓存的最大字节数，相同文本框的mask只生成一次，1080p视频单个mask约2MB
+MASK_CACHE_MAX_BYTES = 128 * 1024 * 1024
+# 解码/编码与推理分进程运行时共享内存环形缓冲区的槽位数，0表示在推理进程中直接解码/编码
+# 每个槽位占用一帧大小的共享内存（1080p约6MB，4K约24MB），读、写各一个缓冲区
+FRAME_RING_SLOTS = 0
+# 去字幕后中间视频的格式，合并音频时再转为最终格式
+# - 'mp4v'：cv2直接编码为MPEG-4，开启USE_H264时合并音频需要解码再编码一次，有二次压缩损失
+# - 'ffv1'：FFV1无损编码（mkv），合并音频时只做一次最终编码，文件约为原始帧的一半
+# - 'y4m'：未压缩的YUV4MPEG，编码几乎不占CPU，但1080p每帧约3MB，磁盘读写量最大
+# - 'pipe'：通过管道把帧直接交给ffmpeg编码为最终格式，合并音频时直接复制视频流，编码与推理同时进行
+# - 'auto'：估算的FFV1中间文件不超过INTERMEDIATE_DISK_BUDGET_MB时使用'ffv1'，否则使用'pipe'
+INTERMEDIATE_FORMAT = 'mp4v'
+# 'auto'模式下中间文件可占用的磁盘空间(MB)，0表示使用临时目录剩余空间的80%
+INTERMEDIATE_DISK_BUDGET_MB = 0
 # ×××××××××× 通用设置 end ××××××××××
 
 # ×××××××××× InpaintMode.STTN算法设置 start ××××××××××
@@ -146,6 +160,47 @@ STTN_REFERENCE_LENGTH = 15
 STTN_MAX_LOAD_NUM = 200
 if STTN_MAX_LOAD_NUM < STTN_REFERENCE_LENGTH * STTN_NEIGHBOR_STRIDE:
     STTN_MAX_LOAD_NUM = STTN_REFERENCE_LENGTH * STTN_NEIGHBOR_STRIDE
+# 每次Transformer推理打包的近邻窗口数，1为逐个窗口推理，0为根据空闲显存/内存自动选择，结果与逐个推理相同
+STTN_WINDOW_BATCH = 1
+# 跳过字幕检测时，先用轻量级的笔画判定找出字幕区域内有文字的帧，只补全有文字的连续帧（前后各扩展
+# STTN_TEXT_GATE_PADDING帧），其余帧原样输出；开启后跳过检测模式不使用STTN_STREAMING
+STTN_TEXT_GATE = False
+STTN_TEXT_GATE_PADDING = 5
+# 字幕区域缩放到48像素高后，与周围亮度差超过STTN_TEXT_GATE_CONTRAST的笔画像素占比超过该值时认为有文字，
+# 漏判时调小，背景纹理多导致误判时调大
+STTN_TEXT_GATE_THRESHOLD = 0.01
+STTN_TEXT_GATE_CONTRAST = 60
+# 重叠的近邻窗口对同一帧的预测如何合并：False为与已有结果各占一半（越晚的窗口权重越大），True为所有窗口等权平均
+STTN_EQUAL_WEIGHT_BLEND = False
+# 流式STTN：编码器特征在滑动窗口中复用，每帧只编码一次，参考帧可以跨越STTN_MAX_LOAD_NUM分块边界，
+# 消除分块处的接缝，同时在后台线程中解码后续帧；参考帧取当前帧前后各STTN_MAX_LOAD_NUM/2帧内的帧
+STTN_STREAMING = False
+# STTN注意力的实现方式
+# - 'math'：原始实现，生成完整的注意力矩阵，增大STTN_REFERENCE_LENGTH时显存/内存占用增长最快
+# - 'sdpa'：torch.nn.functional.scaled_dot_product_attention，GPU上可以使用flash/memory-efficient算子
+# - 'chunked'：每次只计算STTN_ATTENTION_CHUNK_SIZE个query的注意力，适合CPU
+# - 'auto'：可用时使用'sdpa'，否则使用'chunked'
+STTN_ATTENTION = 'math'
+STTN_ATTENTION_CHUNK_SIZE = 1024
+# STTN推理后端：'torch'为PyTorch，'onnx'为onnxruntime（需先运行 python -m backend.inpaint.sttn.onnx_sttn export 导出模型）
+STTN_BACKEND = 'torch'
+# onnxruntime后端使用的模型目录与执行提供程序
+STTN_ONNX_MODEL_DIR = os.path.join(BASE_DIR, 'models', 'sttn', 'onnx')
+STTN_ONNX_PROVIDERS = ['CPUExecutionProvider']
+# STTN推理精度，设备不支持时自动回退到fp32
+# - 'fp32'：单精度
+# - 'fp16'：半精度，仅CUDA
+# - 'bf16'：bfloat16自动混合精度，需要CPU支持AVX512-BF16/AMX或CUDA设备支持bf16
+# - 'int8'：卷积静态量化为INT8，仅CPU，首次使用时校准并缓存到STTN_INT8_MODEL_PATH；
+#   与fp32相比的PSNR和CPU加速比尚未实测，使用前请运行 python -m backend.inpaint.sttn.quant_sttn check 测量，
+#   PSNR低于30dB时检查失败，此时建议使用fp32
+# - 'auto'：CUDA使用fp16，其余设备使用fp32
+STTN_PRECISION = 'fp32'
+STTN_INT8_MODEL_PATH = os.path.join(BASE_DIR, 'models', 'sttn', 'infer_model_int8.pth')
+# STTN卷积编码器/解码器使用channels_last内存格式，对支持Tensor Core的GPU更友好
+STTN_CHANNELS_LAST = False
+# 使用torch.compile编译STTN的Transformer推理(model.infer)，首次推理需要额外的编译时间，编译失败时自动使用原始模型
+STTN_COMPILE = False
 # ×××××××××× InpaintMode.STTN算法设置 end ××××××××××
 
 # ×××××××××× InpaintMode.PROPAINTER算法设置 start ××××××××××
@@ -158,5 +213,68 @@ PROPAINTER_MAX_LOAD_NUM = 70
 # ×××××××××× InpaintMode.LAMA算法设置 start ××××××××××
 # 是否开启极速模式，开启后不保证inpaint效果，仅仅对包含文本的区域文本进行去除
 LAMA_SUPER_FAST = False
+# 裁剪模式：只推理mask每个连通区域向四周扩展LAMA_CROP_MARGIN倍区域高度后的裁剪块，而不是整帧，
+# 1080p字幕只需推理整帧的一小部分像素；裁剪块最长边超过LAMA_CROP_MAX_SIDE时缩小后推理，0表示不缩小
+LAMA_CROP = False
+LAMA_CROP_MARGIN = 2.5
+LAMA_CROP_MAX_SIDE = 0
+# 静止画面复用：字幕区域及其上下文与上一个推理过的帧几乎相同且文本框相同时，直接复用其补全结果，适合动画与幻灯片
+# LAMA_REUSE_THRESHOLD为缩略图灰度的平均绝对差阈值，LAMA_REUSE_MAX_RUN为最多连续复用的帧数
+LAMA_REUSE = False
+LAMA_REUSE_THRESHOLD = 2.0
+LAMA_REUSE_MAX_RUN = 25
+# 视频LAMA模式每批推理的字幕帧数，0为根据空闲显存/内存自动选择，显存不足时调小
+LAMA_BATCH_SIZE = 0
+# 字幕帧凑批时，最后一个字幕帧之后最多排队的无字幕帧数，超过时不等批次凑满立即推理并写出
+LAMA_BATCH_MAX_DELAY = 4
+# 批量处理图片时每批LAMA推理的图片数量，只有尺寸相同的图片才会合并为一批，显存不足时调小
+IMAGE_BATCH_SIZE = 4
+# 批量处理图片时负责图片解码、编码的线程数
+IMAGE_IO_WORKERS = 4
 # ×××××××××× InpaintMode.LAMA算法设置 end ××××××××××
+
+# ×××××××××× 分段并行设置 start ××××××××××
+"""
+1. SEGMENT_WORKERS
+含义：分段并行处理的工作进程数量，设置为1时不分段，按原方式串行处理
+效果：多GPU或多核机器上可以同时处理多个分段，每个进程各自加载一份模型，内存/显存占用随进程数增加
+
+2. SEGMENT_TARGET_LENGTH
+含义：每个分段的目标帧数，实际分段会对齐到附近的场景切换帧或关键帧
+
+3. SEGMENT_SPLIT_BY
+含义：分段切点的来源，'scene'为场景切换，'keyframe'为关键帧
+注意：STTN/PROPAINTER算法的切点不会落在字幕区间内部
+
+4. SEGMENT_DEVICES
+含义：工作进程使用的设备列表，例如['cuda:0', 'cuda:1']，按进程顺序轮流分配
+效果：为空时自动分配，有多张GPU时轮流使用各GPU，否则使用默认设备
+"""
+SEGMENT_WORKERS = 1
+SEGMENT_TARGET_LENGTH = 3000
+SEGMENT_SPLIT_BY = 'scene'
+SEGMENT_DEVICES = []
+# ×××××××××× 分段并行设置 end ××××××××××
+
+# ×××××××××× 模型缓存设置 start ××××××××××
+# 模型加载一次后在同一进程的任务间共享，超出以下上限时释放最久未使用且没有任务占用的模型
+# 模型缓存占用内存上限(MB)，0表示不限制
+MODEL_CACHE_HOST_MEMORY_MB = 0
+# 模型缓存占用显存上限(MB)，每个设备单独计算，0表示不限制
+MODEL_CACHE_DEVICE_MEMORY_MB = 0
+# WebUI启动时预加载的模型，可选 'sttn', 'lama', 'propainter'，例如 ['sttn']
+MODEL_WARM_UP = []
+# ×××××××××× 模型缓存设置 end ××××××××××
+
+# ×××××××××× 任务调度设置 start ××××××××××
+# 以下参数仅适用WebUI的任务队列
+# 工作设备列表，例如['cuda:0', 'cuda:1']，为空时每张GPU一个设备，没有GPU时使用默认设备
+SCHEDULER_DEVICES = []
+# 每个设备同时处理的最大任务数，显存足够时可以调大
+SCHEDULER_MAX_JOBS_PER_DEVICE = 1
+# 任务队列文件，保存未完成的任务，重启后继续处理；设置为None不保存
+SCHEDULER_QUEUE_FILE = os.path.join(BASE_DIR, 'job_queue.json')
+# 保留在调度器中的已结束任务数，超过时丢弃最早结束的任务
+SCHEDULER_JOB_RETENTION = 100
+# ×××××××××× 任务调度设置 end ××××××××××
 # ×××××××××××××××××××× [可以改] end ××××××××××××××××××××
@@ -1,22 +1,70 @@
 import os
-from typing import Union
+from typing import List, Union
+import cv2
 import torch
 import numpy as np
 from PIL import Image
-from backend.inpaint.utils.lama_util import prepare_img_and_mask
 from backend import config
+from backend.job_config import JobConfig
+from backend.inpaint.model_registry import model_registry, LAMA, get_free_memory
+from backend.inpaint.utils.lama_util import prepare_img_and_mask, ceil_modulo
+
+# 自动选择时每批推理的帧数上限
+MAX_LAMA_BATCH = 8
+# big-lama推理时每个输入像素的显存/内存占用的粗略估计，全分辨率的64通道fp32特征同时存在数份
+LAMA_BYTES_PER_PIXEL = 1024
 
 
 class LamaInpaint:
-    def __init__(self, device: torch.device = torch.device("cuda" if torch.cuda.is_available() else "cpu"), model_path=None) -> None:
-        if model_path is None:
-            model_path = os.path.join(config.LAMA_MODEL_PATH, 'big-lama.pt')
-        self.model = torch.jit.load(model_path, map_location=device)
-        self.model.eval()
-        self.model.to(device)
+    def __init__(self, device: torch.device = None, model_path=None, job_config: JobConfig = None) -> None:
+        job_config = job_config or JobConfig()
+        if device is None:
+            # LaMa不支持DirectML，仅在任务指定CUDA设备时使用该设备
+            device = job_config.cuda_device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.device = device
+        # 默认模型从模型注册表获取，同一设备上的任务共享同一个模型
+        self.use_registry = model_path is None
+        if self.use_registry:
+            self.model = model_registry.acquire(LAMA, device)
+        else:
+            self.model = torch.jit.load(model_path, map_location=device)
+            self.model.eval()
+            self.model.to(device)
+        # 只推理mask连通区域周围的裁剪块，而不是整帧
+        self.crop = job_config.lama_crop
+        self.crop_margin = job_config.lama_crop_margin
+        self.crop_max_side = job_config.lama_crop_max_side
+        # 每批推理的帧数，0为自动选择
+        self.batch_size = job_config.lama_batch_size
+
+    def release(self):
+        """
+        归还模型到注册表
+        """
+        if self.model is not None:
+            self.model = None
+            if self.use_registry:
+                model_registry.release(LAMA, self.device)
+
+    def get_batch_size(self, frame_shape):
+        """
+        视频每批推理的帧数，batch_size为0时按补齐后的帧大小估算空闲显存/内存能容纳的帧数
+        """
+        if self.batch_size > 0:
+            return self.batch_size
+        height, width = frame_shape[:2]
+        frame_bytes = ceil_modulo(height, 8) * ceil_modulo(width, 8) * LAMA_BYTES_PER_PIXEL
+        free_bytes = get_free_memory(self.device)
+        if free_bytes is None:
+            return 1
+        return max(1, min(MAX_LAMA_BATCH, int(free_bytes * 0.5 // frame_bytes)))
 
     def __call__(self, image: Union[Image.Image, np.ndarray], mask: Union[Image.Image, np.ndarray]):
+        if self.crop and isinstance(image, np.ndarray) and isinstance(mask, np.ndarray):
+            return self.inpaint_crops([image], [mask])[0]
+        return self.inpaint_full(image, mask)
+
+    def inpaint_full(self, image: Union[Image.Image, np.ndarray], mask: Union[Image.Image, np.ndarray]):
         if isinstance(image, np.ndarray):
             orig_height, orig_width = image.shape[:2]
         else:
@@ -29,3 +77,207 @@ class LamaInpaint:
             cur_res = cur_res[:orig_height, :orig_width]
             return cur_res
 
+    def inpaint_batch(self, images: List[np.ndarray], masks: List[np.ndarray]):
+        """
+        对尺寸相同的多张图片做一次批推理
+        """
+        if self.crop:
+            return self.inpaint_crops(images, masks)
+        return self.inpaint_full_batch(images, masks)
+
+    def inpaint_full_batch(self, images: List[np.ndarray], masks: List[np.ndarray]):
+        orig_height, orig_width = images[0].shape[:2]
+        prepared = [prepare_img_and_mask(image, mask, self.device) for image, mask in zip(images, masks)]
+        image_batch = torch.cat([image for image, _ in prepared])
+        mask_batch = torch.cat([mask for _, mask in prepared])
+        with torch.inference_mode():
+            inpainted = self.model(image_batch, mask_batch)
+            cur_res = inpainted.permute(0, 2, 3, 1).detach().cpu().numpy()
+            cur_res = np.clip(cur_res * 255, 0, 255).astype('uint8')
+            return [res[:orig_height, :orig_width] for res in cur_res]
+
+    def get_crop_boxes(self, mask):
+        """
+        mask的每个连通区域向四周扩展crop_margin倍区域高度作为上下文，合并重叠的区域
+        :return [(x1, y1, x2, y2)]
+        """
+        height, width = mask.shape[:2]
+        _, _, stats, _ = cv2.connectedComponentsWithStats((mask > 0).astype(np.uint8), connectivity=8)
+        boxes = []
+        for x, y, w, h, _ in stats[1:]:
+            pad = max(8, int(h * self.crop_margin))
+            boxes.append([max(0, x - pad), max(0, y - pad), min(width, x + w + pad), min(height, y + h + pad)])
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(boxes)):
+                for j in range(i + 1, len(boxes)):
+                    a, b = boxes[i], boxes[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del boxes[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return [tuple(box) for box in boxes]
+
+    def inpaint_crops(self, images: List[np.ndarray], masks: List[np.ndarray]):
+        """
+        只推理mask连通区域及其上下文的裁剪块，尺寸相同的裁剪块（通常来自使用相同mask的相邻帧）合并为一批，
+        结果只在mask内贴回原图，mask以外的像素与原图相同
+        """
+        results = [image.copy() for image in images]
+        # 尺寸 -> [(图片序号, 裁剪框, 裁剪块, 裁剪块mask)]
+        groups = {}
+        for i, (image, mask) in enumerate(zip(images, masks)):
+            mask = mask.reshape(mask.shape[:2])
+            for x1, y1, x2, y2 in self.get_crop_boxes(mask):
+                crop, crop_mask = image[y1:y2, x1:x2], mask[y1:y2, x1:x2]
+                scale = self.crop_max_side / max(crop.shape[:2]) if self.crop_max_side else 1
+                if scale < 1:
+                    # 过大的裁剪块缩小后推理，结果放大后只贴回mask内，对上下文的影响不大
+                    crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                    crop_mask = cv2.resize(crop_mask, (crop.shape[1], crop.shape[0]), interpolation=cv2.INTER_NEAREST)
+                groups.setdefault(crop.shape[:2], []).append((i, (x1, y1, x2, y2), crop, crop_mask))
+        for shape, items in groups.items():
+            batch_size = self.get_batch_size(shape)
+            for start in range(0, len(items), batch_size):
+                batch = items[start:start + batch_size]
+                inpainted = self.inpaint_full_batch([item[2] for item in batch], [item[3] for item in batch])
+                for (i, (x1, y1, x2, y2), _, _), comp in zip(batch, inpainted):
+                    if comp.shape[:2] != (y2 - y1, x2 - x1):
+                        comp = cv2.resize(comp, (x2 - x1, y2 - y1), interpolation=cv2.INTER_LINEAR)
+                    region_mask = masks[i].reshape(masks[i].shape[:2])[y1:y2, x1:x2] > 0
+                    np.copyto(results[i][y1:y2, x1:x2], comp, where=region_mask[:, :, None])
+        return results
+
+
+class TemporalReuse:
+    """
+    静止画面复用LAMA的补全结果：动画、幻灯片中常有连续多帧画面与字幕都不变，
+    字幕区域及其上下文的缩略图签名与上一个参考帧（实际推理过的帧）足够接近且mask相同时，
+    直接把参考帧的补全结果贴到mask内，不再推理；连续复用的帧数有上限，防止缓慢变化累积
+    """
+
+    def __init__(self, threshold=None, max_run=None, thumb_width=64):
+        """
+        :param threshold: 缩略图灰度的平均绝对差不超过该值时认为画面相同
+        :param max_run: 最多连续复用的帧数
+        :param thumb_width: 缩略图宽度
+        """
+        self.threshold = config.LAMA_REUSE_THRESHOLD if threshold is None else threshold
+        self.max_run = config.LAMA_REUSE_MAX_RUN if max_run is None else max_run
+        self.thumb_width = thumb_width
+        # 参考帧(mask key, 签名, 参考帧数据)
+        self.reference = None
+        # 当前连续复用的帧数，以及已结束的各段复用长度
+        self.run = 0
+        self.runs = []
+        self.checked = 0
+
+    def signature(self, frame, mask):
+        """
+        mask外接矩形向四周扩展一个矩形高度作为上下文，缩小为灰度缩略图
+        """
+        x, y, w, h = cv2.boundingRect(mask)
+        region = frame[max(0, y - h):y + h * 2, max(0, x - h):x + w + h]
+        thumb_height = max(8, region.shape[0] * self.thumb_width // max(1, region.shape[1]))
+        gray = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (self.thumb_width, thumb_height), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def lookup(self, key, frame, mask):
+        """
+        :param key: mask key，文本框相同的帧才可能复用
+        :return (可复用的参考帧数据或None, 当前帧的签名)
+        """
+        self.checked += 1
+        signature = self.signature(frame, mask)
+        reference = self.reference
+        if reference is not None and reference[0] == key and self.run < self.max_run and \
+                reference[1].shape == signature.shape and np.abs(signature - reference[1]).mean() <= self.threshold:
+            self.run += 1
+            return reference[2], signature
+        self.finish_run()
+        return None, signature
+
+    def set_reference(self, key, signature, item):
+        self.reference = (key, signature, item)
+
+    def finish_run(self):
+        if self.run:
+            self.runs.append(self.run)
+            self.run = 0
+
+    def report(self):
+        self.finish_run()
+        reused = sum(self.runs)
+        average = reused / len(self.runs) if self.runs else 0
+        return (f'[LamaReuse] reused {reused}/{self.checked} subtitle frames in {len(self.runs)} runs, '
+                f'average run {average:.1f}, longest run {max(self.runs, default=0)}')
+
+
+def benchmark_batch(size=(1280, 720), frame_count=16, batch_size=4):
+    """
+    对比逐帧推理与批推理每帧的耗时，并校验两者结果一致
+    """
+    import time
+    width, height = size
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(frame_count)]
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.rectangle(mask, (width // 4, height - 100), (width * 3 // 4, height - 40), 255, -1)
+    lama_inpaint = LamaInpaint()
+    try:
+        start = time.time()
+        singles = [lama_inpaint(frame, mask) for frame in frames]
+        single_cost = time.time() - start
+        start = time.time()
+        batches = []
+        for i in range(0, frame_count, batch_size):
+            batches += lama_inpaint.inpaint_batch(frames[i:i + batch_size], [mask] * len(frames[i:i + batch_size]))
+        batch_cost = time.time() - start
+    finally:
+        lama_inpaint.release()
+    diff = max(np.abs(a.astype(np.int16) - b.astype(np.int16)).max() for a, b in zip(singles, batches))
+    print(f'{width}x{height} on {lama_inpaint.device}: batch 1 {single_cost / frame_count * 1000:.1f} ms/frame, '
+          f'batch {batch_size} {batch_cost / frame_count * 1000:.1f} ms/frame, max abs diff {diff}')
+
+
+def benchmark_crop(size=(1920, 1080), frame_count=8, box_height=60):
+    """
+    对比整帧推理与裁剪推理的推理像素数与每帧耗时
+    """
+    import time
+    width, height = size
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(frame_count)]
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.rectangle(mask, (width // 4, height - 40 - box_height), (width * 3 // 4, height - 40), 255, -1)
+    masks = [mask] * frame_count
+    lama_inpaint = LamaInpaint()
+    try:
+        crop_pixels = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in lama_inpaint.get_crop_boxes(mask))
+        for crop in [False, True]:
+            start = time.time()
+            if crop:
+                lama_inpaint.inpaint_crops(frames, masks)
+            else:
+                # 整帧推理与inpaint_crops一样按get_batch_size分批，两者的对比才对等
+                batch_size = lama_inpaint.get_batch_size(frames[0].shape)
+                for i in range(0, frame_count, batch_size):
+                    lama_inpaint.inpaint_full_batch(frames[i:i + batch_size], masks[i:i + batch_size])
+            cost = time.time() - start
+            pixels = crop_pixels if crop else width * height
+            print(f'{width}x{height} crop={crop}: {pixels / (width * height):.1%} pixels per frame, '
+                  f'{cost / frame_count * 1000:.1f} ms/frame')
+    finally:
+        lama_inpaint.release()
+
+
+if __name__ == '__main__':
+    import sys
+    if '--crop' in sys.argv:
+        benchmark_crop()
+    else:
+        benchmark_batch()
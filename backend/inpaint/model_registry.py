@@ -0,0 +1,315 @@
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+from backend import config
+
+STTN = 'sttn'
+STTN_ONNX = 'sttn_onnx'
+STTN_INT8 = 'sttn_int8'
+LAMA = 'lama'
+RAFT = 'raft'
+FLOW_COMPLETE = 'flow_complete'
+PROPAINTER = 'propainter'
+
+
+def _load_sttn(device, attention='math', chunk_size=1024, channels_last=False):
+    from backend.inpaint.sttn.auto_sttn import InpaintGenerator, set_attention_backend
+    # 1. 创建InpaintGenerator模型实例并装载到选择的设备上
+    model = InpaintGenerator().to(device)
+    # 2. 载入预训练模型的权重，转载模型的状态字典
+    model.load_state_dict(torch.load(config.STTN_MODEL_PATH, map_location='cpu')['netG'])
+    # 3. 将模型设置为评估模式
+    model.eval()
+    set_attention_backend(model, attention, chunk_size)
+    if channels_last:
+        # 只转换卷积编码器/解码器，Transformer中的view要求连续的默认内存格式
+        model.encoder.to(memory_format=torch.channels_last)
+        model.decoder.to(memory_format=torch.channels_last)
+    return model
+
+
+def _load_sttn_onnx(device):
+    from backend.inpaint.sttn.onnx_sttn import STTNOnnxModel
+    return STTNOnnxModel()
+
+
+def _load_sttn_int8(device, attention='math', chunk_size=1024):
+    from backend.inpaint.sttn.quant_sttn import load_quantized_model
+    return load_quantized_model(attention=attention, chunk_size=chunk_size)
+
+
+def _load_lama(device):
+    model = torch.jit.load(os.path.join(config.LAMA_MODEL_PATH, 'big-lama.pt'), map_location=device)
+    model.eval()
+    model.to(device)
+    return model
+
+
+def _load_raft(device):
+    from backend.inpaint.video.model.modules.flow_comp_raft import RAFT_bi
+    return RAFT_bi(os.path.join(config.VIDEO_INPAINT_MODEL_PATH, 'raft-things.pth'), device)
+
+
+def _load_flow_complete(device):
+    from backend.inpaint.video.model.recurrent_flow_completion import RecurrentFlowCompleteNet
+    model = RecurrentFlowCompleteNet(os.path.join(config.VIDEO_INPAINT_MODEL_PATH, 'recurrent_flow_completion.pth'))
+    for p in model.parameters():
+        p.requires_grad = False
+    model.to(device)
+    model.eval()
+    return model
+
+
+def _load_propainter(device):
+    from backend.inpaint.video.model.propainter import InpaintGenerator
+    return InpaintGenerator(model_path=os.path.join(config.VIDEO_INPAINT_MODEL_PATH, 'ProPainter.pth')).to(
+        device).eval()
+
+
+def get_model_nbytes(model):
+    """
+    统计模型状态字典中张量占用的字节数
+    量化模块的权重打包保存，不在parameters()中，但会以张量或张量元组的形式出现在state_dict()中
+    """
+    if not hasattr(model, 'state_dict'):
+        return 0
+    nbytes = 0
+    seen = set()
+    for value in model.state_dict().values():
+        for tensor in value if isinstance(value, (tuple, list)) else [value]:
+            if not isinstance(tensor, torch.Tensor):
+                continue
+            # state_dict返回的是新的张量对象，按数据地址去重共享的权重
+            key = (tensor.data_ptr(), tensor.numel())
+            if key in seen:
+                continue
+            seen.add(key)
+            nbytes += tensor.numel() * tensor.element_size()
+    return nbytes
+
+
+class ModelRegistry:
+    """
+    进程内共享的inpaint模型注册表
+    每个(模型, 设备, 精度)只加载一次，通过引用计数在任务间共享；
+    超出内存/显存预算时释放最久未使用且没有任务占用的模型
+    """
+
+    def __init__(self, host_memory_budget=0, device_memory_budget=0):
+        # 内存/显存预算(字节)，0表示不限制；显存预算对每个设备单独计算
+        self.host_memory_budget = host_memory_budget
+        self.device_memory_budget = device_memory_budget
+        self.loaders = {
+            STTN: _load_sttn,
+            STTN_ONNX: _load_sttn_onnx,
+            STTN_INT8: _load_sttn_int8,
+            LAMA: _load_lama,
+            RAFT: _load_raft,
+            FLOW_COMPLETE: _load_flow_complete,
+            PROPAINTER: _load_propainter,
+        }
+        # key: (模型名, 设备, 精度, 加载参数) -> {'model', 'refcount', 'nbytes'}，按最近使用排序
+        self.entries = OrderedDict()
+        # 正在加载的模型 key -> threading.Event，加载结束时置位
+        self.loading = {}
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def make_key(name, device, precision, options=None):
+        device = torch.device(device) if isinstance(device, str) else device
+        if device.type == 'cuda' and device.index is None:
+            # "cuda"与"cuda:N"指向同一块GPU时使用同一个key
+            device = torch.device('cuda', torch.cuda.current_device())
+        return name, str(device), precision, tuple(sorted((options or {}).items()))
+
+    @staticmethod
+    def memory_pool(key):
+        """
+        模型所占用的内存池，CPU模型占用内存，其余占用各自设备的显存
+        """
+        device = key[1]
+        return 'cpu' if device.startswith('cpu') else device
+
+    def register_loader(self, name, loader):
+        with self.lock:
+            self.loaders[name] = loader
+
+    def acquire(self, name, device, precision='fp32', **options):
+        """
+        获取模型并增加引用计数，用完后需要调用release
+        :param options: 传给加载函数的参数，加载参数不同的同一模型（如不同的内存格式）分别缓存
+        """
+        key = self.make_key(name, device, precision, options)
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    entry['refcount'] += 1
+                    self.entries.move_to_end(key)
+                    self.evict(self.memory_pool(key))
+                    return entry['model']
+                event = self.loading.get(key)
+                if event is None:
+                    # 由当前线程加载，其他请求同一模型的线程等待加载结束
+                    event = threading.Event()
+                    self.loading[key] = event
+                    loader = self.loaders[name]
+                    break
+            # 其他线程正在加载同一模型，加载结束（成功或失败）后重新查找
+            event.wait()
+        # 加载在锁外进行，耗时的加载不会阻塞其他模型/设备的acquire与release
+        try:
+            print(f'[ModelRegistry] loading {name} on {key[1]} ({precision})')
+            model = loader(device, **options)
+            if precision == 'fp16':
+                model = model.half()
+            nbytes = get_model_nbytes(model)
+            with self.lock:
+                self.entries[key] = {'model': model, 'refcount': 1, 'nbytes': nbytes}
+                self.evict(self.memory_pool(key))
+        finally:
+            with self.lock:
+                del self.loading[key]
+            event.set()
+        return model
+
+    def release(self, name, device, precision='fp32', **options):
+        """
+        减少引用计数，模型继续保留在注册表中供后续任务复用，直到因超出预算被淘汰
+        """
+        key = self.make_key(name, device, precision, options)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['refcount'] > 0:
+                entry['refcount'] -= 1
+            self.evict(self.memory_pool(key))
+
+    def used_bytes(self, pool):
+        return sum(entry['nbytes'] for key, entry in self.entries.items() if self.memory_pool(key) == pool)
+
+    def evict(self, pool):
+        """
+        按最近最少使用顺序释放没有被占用的模型，直到满足预算
+        """
+        budget = self.host_memory_budget if pool == 'cpu' else self.device_memory_budget
+        if not budget:
+            return
+        with self.lock:
+            evicted = False
+            for key in list(self.entries.keys()):
+                if self.used_bytes(pool) <= budget:
+                    break
+                if self.memory_pool(key) != pool or self.entries[key]['refcount'] > 0:
+                    continue
+                print(f'[ModelRegistry] evicting {key[0]} on {key[1]} ({key[2]})')
+                del self.entries[key]
+                evicted = True
+            if evicted and pool.startswith('cuda'):
+                torch.cuda.empty_cache()
+            if self.used_bytes(pool) > budget:
+                print(f'[ModelRegistry] models in use exceed the memory budget of {pool}')
+
+    def clear(self):
+        """
+        释放所有没有被占用的模型
+        """
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if self.entries[key]['refcount'] == 0:
+                    del self.entries[key]
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def warm_up(self, names=None, device=None):
+        """
+        预加载模型（如WebUI启动时），加载后引用计数为0，供之后的任务直接复用
+        :param names 模型名列表，可选 'sttn', 'lama', 'propainter'
+        """
+        for name in names or []:
+            if name == PROPAINTER:
+                model_device = device or get_propainter_device()
+                precision = get_propainter_precision(model_device)
+                for sub_name, sub_precision in [(RAFT, 'fp32'), (FLOW_COMPLETE, precision), (PROPAINTER, precision)]:
+                    self.acquire(sub_name, model_device, sub_precision)
+                    self.release(sub_name, model_device, sub_precision)
+            elif name == STTN:
+                # 按默认任务配置加载，精度与加载参数和之后的任务一致，才能命中缓存
+                from backend.inpaint.sttn_inpaint import STTNInpaint
+                from backend.job_config import JobConfig
+                STTNInpaint(JobConfig(device=device or config.device)).release()
+            else:
+                model_device = device or get_default_device()
+                self.acquire(name, model_device)
+                self.release(name, model_device)
+
+
+def get_default_device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def get_propainter_device():
+    from backend.inpaint.video.model.misc import get_device
+    return get_device()
+
+
+def get_propainter_precision(device, use_fp16=True):
+    """
+    ProPainter在非CPU设备上使用半精度推理
+    """
+    device = torch.device(device) if isinstance(device, str) else device
+    return 'fp16' if use_fp16 and device != torch.device('cpu') else 'fp32'
+
+
+def cpu_supports_bf16():
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+def get_sttn_precision(device, precision='auto'):
+    """
+    确定STTN实际使用的推理精度，设备不支持所选精度时回退到fp32
+    :return 'fp32'、'fp16'、'bf16'或'int8'
+    """
+    device = torch.device(device) if isinstance(device, str) else device
+    device_type = device.type if isinstance(device, torch.device) else None
+    if precision == 'auto':
+        precision = 'fp16' if device_type == 'cuda' else 'fp32'
+    if precision == 'fp16' and device_type != 'cuda':
+        print(f'STTN fp16 is only supported on CUDA, fallback to fp32 on {device}')
+        return 'fp32'
+    if precision == 'int8' and device_type != 'cpu':
+        print(f'STTN int8 is only supported on CPU, fallback to fp32 on {device}')
+        return 'fp32'
+    if precision == 'bf16':
+        if device_type == 'cuda':
+            supported = torch.cuda.is_bf16_supported()
+        else:
+            supported = device_type == 'cpu' and cpu_supports_bf16()
+        if not supported:
+            print(f'STTN bf16 is not supported on {device}, fallback to fp32')
+            return 'fp32'
+    return precision
+
+
+def get_free_memory(device):
+    """
+    获取设备的空闲显存，CPU设备获取可用内存，无法获取时返回None
+    """
+    device_type = device.type if isinstance(device, torch.device) else None
+    if device_type == 'cuda':
+        return torch.cuda.mem_get_info(device)[0]
+    if device_type == 'cpu':
+        try:
+            return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (AttributeError, ValueError, OSError):
+            return None
+    return None
+
+
+model_registry = ModelRegistry(config.MODEL_CACHE_HOST_MEMORY_MB * 1024 * 1024,
+                               config.MODEL_CACHE_DEVICE_MEMORY_MB * 1024 * 1024)
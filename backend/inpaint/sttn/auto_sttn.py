@@ -108,10 +108,11 @@ class InpaintGenerator(BaseNetwork):
         output = torch.tanh(output)
         return output
 
-    def infer(self, feat):
-        t, c, _, _ = feat.size()
+    def infer(self, feat, b=1):
+        # feat为(b*t, c, h, w)，b个序列之间互不做注意力
+        _, c, _, _ = feat.size()
         enc_feat = self.transformer(
-            {'x': feat, 'b': 1, 'c': c})['x']
+            {'x': feat, 'b': b, 'c': c})['x']
         return enc_feat
 
 
@@ -132,17 +133,83 @@ class deconv(nn.Module):
 # #############################################################################
 
 
+def math_attention(query, key, value, chunk_size=None):
+    """
+    Reference implementation, materializes the full scores matrix
+    """
+    scores = torch.matmul(query, key.transpose(-2, -1)
+                          ) / math.sqrt(query.size(-1))
+    p_attn = F.softmax(scores, dim=-1)
+    p_val = torch.matmul(p_attn, value)
+    return p_val, p_attn
+
+
+def sdpa_attention(query, key, value, chunk_size=None):
+    """
+    torch.nn.functional.scaled_dot_product_attention, uses the flash/memory-efficient kernels when available
+    """
+    return F.scaled_dot_product_attention(query, key, value), None
+
+
+def chunked_attention(query, key, value, chunk_size=1024):
+    """
+    Processes chunk_size queries at a time, scores memory is chunk_size x keys instead of queries x keys
+    """
+    scale = math.sqrt(query.size(-1))
+    p_val = torch.empty(query.shape[:-1] + value.shape[-1:], dtype=value.dtype, device=value.device)
+    for start in range(0, query.size(-2), chunk_size):
+        scores = torch.matmul(query[..., start:start + chunk_size, :], key.transpose(-2, -1)) / scale
+        p_val[..., start:start + chunk_size, :] = torch.matmul(F.softmax(scores, dim=-1), value)
+    return p_val, None
+
+
+ATTENTION_BACKENDS = {
+    'math': math_attention,
+    'sdpa': sdpa_attention,
+    'chunked': chunked_attention,
+}
+
+
+def resolve_attention_backend(backend):
+    """
+    'auto' uses sdpa when available, otherwise chunked; falls back to math for unknown backends
+    """
+    has_sdpa = hasattr(F, 'scaled_dot_product_attention')
+    if backend == 'auto':
+        return 'sdpa' if has_sdpa else 'chunked'
+    if backend == 'sdpa' and not has_sdpa:
+        print('scaled_dot_product_attention is not available, fallback to chunked attention')
+        return 'chunked'
+    if backend not in ATTENTION_BACKENDS:
+        print(f'unknown attention backend {backend}, fallback to math attention')
+        return 'math'
+    return backend
+
+
+def set_attention_backend(model, backend, chunk_size=1024):
+    """
+    Switch every Attention module of the model to the given backend
+    """
+    backend = resolve_attention_backend(backend)
+    for module in model.modules():
+        if isinstance(module, Attention):
+            module.backend = backend
+            module.chunk_size = chunk_size
+    return backend
+
+
 class Attention(nn.Module):
     """
     Compute 'Scaled Dot Product Attention
     """
 
+    def __init__(self, backend='math', chunk_size=1024):
+        super().__init__()
+        self.backend = backend
+        self.chunk_size = chunk_size
+
     def forward(self, query, key, value):
-        scores = torch.matmul(query, key.transpose(-2, -1)
-                              ) / math.sqrt(query.size(-1))
-        p_attn = F.softmax(scores, dim=-1)
-        p_val = torch.matmul(p_attn, value)
-        return p_val, p_attn
+        return ATTENTION_BACKENDS[self.backend](query, key, value, self.chunk_size)
 
 
 class MultiHeadedAttention(nn.Module):
@@ -292,3 +359,31 @@ def spectral_norm(module, mode=True):
     if mode:
         return _spectral_norm(module)
     return module
+
+
+def check_attention_backends(shapes=((2, 2880, 240), (1, 7680, 60)), atol=1e-4):
+    """
+    Compare every attention backend against the math implementation on random inputs,
+    raises AssertionError when any backend differs by more than atol
+    """
+    torch.manual_seed(0)
+    mismatches = []
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for device in devices:
+        for b, n, d in shapes:
+            query, key, value = (torch.randn(b, n, d, device=device) for _ in range(3))
+            expected, _ = math_attention(query, key, value)
+            for name, backend in ATTENTION_BACKENDS.items():
+                if name == 'sdpa' and not hasattr(F, 'scaled_dot_product_attention'):
+                    continue
+                result, _ = backend(query, key, value, 1000)
+                diff = (result - expected).abs().max().item()
+                status = 'ok' if diff <= atol else 'MISMATCH'
+                print(f'{device} {name} b={b} n={n} d={d}: max abs diff {diff:.2e} {status}')
+                if diff > atol:
+                    mismatches.append(f'{device} {name} b={b} n={n} d={d}')
+    assert not mismatches, f'attention backends exceed atol={atol}: {", ".join(mismatches)}'
+
+
+if __name__ == '__main__':
+    check_attention_backends()
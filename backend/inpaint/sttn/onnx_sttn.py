@@ -0,0 +1,138 @@
+"""
+STTN的ONNX导出与onnxruntime推理
+
+导出编码器、Transformer推理(model.infer)和解码器三个模型，帧数与batch均为动态维度：
+    python -m backend.inpaint.sttn.onnx_sttn export
+校验onnxruntime与PyTorch的结果并对比CPU吞吐：
+    python -m backend.inpaint.sttn.onnx_sttn check
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from backend import config
+
+ENCODER_FILE = 'encoder.onnx'
+INFER_FILE = 'infer.onnx'
+DECODER_FILE = 'decoder.onnx'
+
+
+class _InferWrapper(nn.Module):
+    """
+    把model.infer的(b*t, c, h, w)输入与python整数b改为(b, t, c, h, w)的五维输入，b和t都可以是动态维度
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, feat):
+        b, t, c, h, w = feat.size()
+        return self.model.transformer({'x': feat.reshape(b * t, c, h, w), 'b': b, 'c': c})['x']
+
+
+def export_onnx(output_dir=None, opset_version=17):
+    """
+    导出STTN的三个ONNX模型
+    """
+    from backend.inpaint.sttn.auto_sttn import InpaintGenerator, set_attention_backend
+    output_dir = output_dir or config.STTN_ONNX_MODEL_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    model = InpaintGenerator()
+    model.load_state_dict(torch.load(config.STTN_MODEL_PATH, map_location='cpu')['netG'])
+    model.eval()
+    # 导出使用原始的注意力实现
+    set_attention_backend(model, 'math')
+    frames = torch.randn(4, 3, 120, 640)
+    with torch.no_grad():
+        feats = model.encoder(frames)
+        torch.onnx.export(model.encoder, frames, os.path.join(output_dir, ENCODER_FILE),
+                          input_names=['frames'], output_names=['feats'], opset_version=opset_version,
+                          dynamic_axes={'frames': {0: 'n'}, 'feats': {0: 'n'}})
+        window_feats = torch.cat([feats, feats]).view(2, 4, *feats.shape[1:])
+        torch.onnx.export(_InferWrapper(model), window_feats, os.path.join(output_dir, INFER_FILE),
+                          input_names=['feats'], output_names=['pred_feats'], opset_version=opset_version,
+                          dynamic_axes={'feats': {0: 'b', 1: 't'}, 'pred_feats': {0: 'bt'}})
+        torch.onnx.export(model.decoder, feats, os.path.join(output_dir, DECODER_FILE),
+                          input_names=['feats'], output_names=['frames'], opset_version=opset_version,
+                          dynamic_axes={'feats': {0: 'n'}, 'frames': {0: 'n'}})
+    print(f'STTN ONNX models exported to {output_dir}')
+    return output_dir
+
+
+class STTNOnnxModel:
+    """
+    通过onnxruntime运行STTN，提供与InpaintGenerator相同的encoder/infer/decoder接口，输入输出均为CPU张量
+    """
+
+    def __init__(self, model_dir=None, providers=None):
+        import onnxruntime as ort
+        model_dir = model_dir or config.STTN_ONNX_MODEL_DIR
+        for file_name in [ENCODER_FILE, INFER_FILE, DECODER_FILE]:
+            if not os.path.exists(os.path.join(model_dir, file_name)):
+                raise FileNotFoundError(f'{os.path.join(model_dir, file_name)} not found, '
+                                        f'please run "python -m backend.inpaint.sttn.onnx_sttn export" first')
+        providers = providers or config.STTN_ONNX_PROVIDERS
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.sessions = {name: ort.InferenceSession(os.path.join(model_dir, name), options, providers=providers)
+                         for name in [ENCODER_FILE, INFER_FILE, DECODER_FILE]}
+
+    def run(self, name, x):
+        session = self.sessions[name]
+        x = np.ascontiguousarray(x.detach().cpu().float().numpy())
+        return torch.from_numpy(session.run(None, {session.get_inputs()[0].name: x})[0])
+
+    def encoder(self, frames):
+        return self.run(ENCODER_FILE, frames)
+
+    def infer(self, feat, b=1):
+        bt, c, h, w = feat.size()
+        return self.run(INFER_FILE, feat.reshape(b, bt // b, c, h, w))
+
+    def decoder(self, feats):
+        return self.run(DECODER_FILE, feats)
+
+
+def check_onnx(frame_count=30, repeat=3, min_psnr=40.0):
+    """
+    在固定的合成片段上对比onnxruntime与PyTorch eager（CPU）的结果与耗时，PSNR低于min_psnr时抛出AssertionError
+    """
+    from backend.job_config import JobConfig
+    from backend.inpaint.sttn_inpaint import STTNInpaint, make_synthetic_clip
+    clip = make_synthetic_clip(frame_count)
+    regions = [clip, clip[::-1]]
+    results = {}
+    for backend in ['torch', 'onnx']:
+        sttn_inpaint = STTNInpaint(JobConfig(device=torch.device('cpu'), sttn_precision='fp32', sttn_backend=backend))
+        try:
+            if sttn_inpaint.backend != backend:
+                # 加载失败回退到PyTorch时对比没有意义
+                raise RuntimeError(f'STTN {backend} backend failed to load, got {sttn_inpaint.backend} instead')
+            costs = []
+            for _ in range(repeat):
+                start = time.time()
+                results[backend] = sttn_inpaint.predict_regions(regions)
+                costs.append(time.time() - start)
+        finally:
+            sttn_inpaint.release()
+        print(f'{backend} on cpu: {len(regions) * frame_count / min(costs):.1f} strips/s')
+    diff = (results['torch'] - results['onnx']).abs()
+    mse = torch.mean(diff.float() ** 2).item()
+    psnr = float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+    print(f'max abs diff: {diff.max().item():.2f}, mean abs diff: {diff.mean().item():.4f}, PSNR {psnr:.2f}dB')
+    assert psnr >= min_psnr, f'onnxruntime PSNR {psnr:.2f}dB against PyTorch is lower than {min_psnr}dB'
+    return psnr
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'export':
+        export_onnx(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'check':
+        check_onnx()
+    else:
+        print(__doc__)
@@ -0,0 +1,165 @@
+"""
+STTN的CPU INT8静态量化
+
+编码器/解码器的卷积（解码器输出RGB的最后一层除外）、Transformer中的1x1嵌入卷积、输出卷积与前馈卷积量化为INT8，注意力的矩阵乘法与残差相加保持fp32；
+首次加载时用合成字幕片段校准激活范围，量化后的权重缓存到STTN_INT8_MODEL_PATH，之后直接加载：
+    python -m backend.inpaint.sttn.quant_sttn calibrate
+对比INT8与fp32的PSNR和CPU吞吐：
+    python -m backend.inpaint.sttn.quant_sttn check
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao import quantization
+
+from backend import config
+
+# 缓存文件格式版本，量化的模块范围变化时需要重新校准
+CACHE_VERSION = 1
+
+
+def get_quantized_engine():
+    """
+    x86/fbgemm用于x86 CPU，qnnpack用于ARM CPU
+    """
+    supported = torch.backends.quantized.supported_engines
+    for engine in ['x86', 'fbgemm', 'qnnpack']:
+        if engine in supported:
+            return engine
+    raise RuntimeError('no quantized engine is available in this PyTorch build')
+
+
+def wrap_quantized_modules(model, qconfig):
+    """
+    给需要量化的子模块套上QuantStub/DeQuantStub，模块的输入输出仍为fp32张量，其余模块不受影响
+    """
+    model.encoder = quantization.QuantWrapper(model.encoder)
+    # 解码器最后输出RGB的卷积计算量很小，保持fp32，避免输出再经过一次8bit量化
+    decoder_layers = list(model.decoder)
+    model.decoder = nn.Sequential(quantization.QuantWrapper(nn.Sequential(*decoder_layers[:-1])), decoder_layers[-1])
+    wrappers = [model.encoder, model.decoder[0]]
+    for block in model.transformer:
+        attention = block.attention
+        for name in ['query_embedding', 'key_embedding', 'value_embedding', 'output_linear']:
+            setattr(attention, name, quantization.QuantWrapper(getattr(attention, name)))
+            wrappers.append(getattr(attention, name))
+        block.feed_forward.conv = quantization.QuantWrapper(block.feed_forward.conv)
+        wrappers.append(block.feed_forward.conv)
+    for wrapper in wrappers:
+        wrapper.qconfig = qconfig
+    return model
+
+
+def calibrate(model, frame_count=40, neighbor_stride=5, ref_length=10):
+    """
+    用合成字幕片段按推理时的窗口方式运行插入了观察器的模型，统计各层激活的范围
+    """
+    from backend.inpaint.sttn_inpaint import make_synthetic_clip
+    clip = make_synthetic_clip(frame_count)
+    with torch.no_grad():
+        for frames in [clip, clip[::-1]]:
+            # 与STTNInpaint.to_model_input相同的预处理：BGR转RGB并归一化到[-1, 1]
+            x = torch.from_numpy(np.stack(frames)).flip(-1)
+            x = x.permute(0, 3, 1, 2).float().div(255) * 2 - 1
+            feats = model.encoder(x.contiguous())
+            for f in range(0, frame_count, neighbor_stride):
+                neighbor_ids = list(range(max(0, f - neighbor_stride), min(frame_count, f + neighbor_stride + 1)))
+                ref_ids = [i for i in range(0, frame_count, ref_length) if i not in neighbor_ids]
+                pred_feat = model.infer(feats[neighbor_ids + ref_ids])
+                model.decoder(pred_feat[:len(neighbor_ids)])
+    return model
+
+
+def build_quantized_model(engine, state_dict=None, attention='math', chunk_size=1024):
+    """
+    创建量化后的InpaintGenerator
+    :param state_dict: 缓存的量化权重，为None时载入fp32权重并校准
+    :param attention: 推理时使用的注意力实现
+    """
+    from backend.inpaint.sttn.auto_sttn import InpaintGenerator, set_attention_backend
+    torch.backends.quantized.engine = engine
+    model = InpaintGenerator(init_weights=False)
+    if state_dict is None:
+        model.load_state_dict(torch.load(config.STTN_MODEL_PATH, map_location='cpu')['netG'])
+    model.eval()
+    wrap_quantized_modules(model, quantization.get_default_qconfig(engine))
+    quantization.prepare(model, inplace=True)
+    if state_dict is None:
+        # 校准时使用分块注意力，避免生成完整的注意力矩阵
+        set_attention_backend(model, 'chunked', chunk_size)
+        calibrate(model)
+    quantization.convert(model, inplace=True)
+    if state_dict is not None:
+        model.load_state_dict(state_dict)
+    set_attention_backend(model, attention, chunk_size)
+    return model
+
+
+def load_quantized_model(model_path=None, attention='math', chunk_size=1024):
+    """
+    加载缓存的量化模型；缓存不存在、由其他量化引擎生成或早于fp32权重时重新校准并保存
+    注意力实现不影响量化权重，缓存对所有注意力实现通用
+    """
+    model_path = model_path or config.STTN_INT8_MODEL_PATH
+    engine = get_quantized_engine()
+    if os.path.exists(model_path) and os.path.getmtime(model_path) >= os.path.getmtime(config.STTN_MODEL_PATH):
+        try:
+            cache = torch.load(model_path, map_location='cpu')
+            if cache.get('version') == CACHE_VERSION and cache.get('engine') == engine:
+                return build_quantized_model(engine, cache['state_dict'], attention, chunk_size)
+            print(f'STTN int8 cache {model_path} is outdated, recalibrating')
+        except Exception as e:
+            print(f'fail to load STTN int8 cache {model_path} ({e}), recalibrating')
+    start = time.time()
+    model = build_quantized_model(engine, attention=attention, chunk_size=chunk_size)
+    print(f'STTN int8 calibration finished in {time.time() - start:.1f}s')
+    try:
+        os.makedirs(os.path.dirname(model_path), exist_ok=True)
+        torch.save({'version': CACHE_VERSION, 'engine': engine, 'state_dict': model.state_dict()}, model_path)
+        print(f'STTN int8 model saved to {model_path}')
+    except OSError as e:
+        print(f'fail to save STTN int8 model to {model_path}: {e}')
+    return model
+
+
+def check_int8(frame_count=30, repeat=3, min_psnr=30.0):
+    """
+    在固定的合成片段上对比INT8与fp32（CPU）的PSNR和吞吐，量化模型没有加载或PSNR低于min_psnr时抛出AssertionError
+    """
+    from backend.job_config import JobConfig
+    from backend.inpaint.sttn_inpaint import STTNInpaint, make_synthetic_clip, check_precision_parity
+    device = torch.device('cpu')
+    used_precision, psnr = check_precision_parity('int8', device, frame_count, min_psnr=min_psnr)
+    # 量化模型加载失败时回退到fp32，与fp32对比没有意义
+    assert used_precision == 'int8', f'STTN int8 model failed to load, got {used_precision} instead'
+    costs = {}
+    clip = make_synthetic_clip(frame_count)
+    for precision in ['fp32', 'int8']:
+        sttn_inpaint = STTNInpaint(JobConfig(device=device, sttn_precision=precision))
+        try:
+            precision_costs = []
+            for _ in range(repeat):
+                start = time.time()
+                sttn_inpaint.predict_regions([clip])
+                precision_costs.append(time.time() - start)
+        finally:
+            sttn_inpaint.release()
+        costs[precision] = min(precision_costs)
+        print(f'{precision} on cpu: {frame_count / costs[precision]:.1f} strips/s')
+    print(f'int8 vs fp32 on cpu: PSNR {psnr:.2f}dB, {costs["fp32"] / costs["int8"]:.2f}x speed')
+    return psnr, costs['fp32'] / costs['int8']
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'calibrate':
+        if os.path.exists(config.STTN_INT8_MODEL_PATH):
+            os.remove(config.STTN_INT8_MODEL_PATH)
+        load_quantized_model()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'check':
+        check_int8()
+    else:
+        print(__doc__)
@@ -1,9 +1,11 @@
-import copy
+import contextlib
+import threading
 import time
 
 import cv2
 import numpy as np
 import torch
+import torch.nn.functional as F
 from torchvision import transforms
 from typing import List
 import sys
@@ -11,84 +13,200 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 from backend import config
-from backend.inpaint.sttn.auto_sttn import InpaintGenerator
+from backend.job_config import JobConfig
+from backend.inpaint.sttn.auto_sttn import resolve_attention_backend
+from backend.inpaint.model_registry import model_registry, STTN, STTN_ONNX, STTN_INT8, get_sttn_precision, \
+    get_free_memory
 from backend.inpaint.utils.sttn_utils import Stack, ToTorchFormatTensor
+from backend.tools.text_gate import TextPresenceGate, split_text_runs
+from backend.tools.video_tools import open_video_capture, prefetch_frames
 
-# 定义图像预处理方式
+# 原先基于PIL的图像预处理方式，仅用于校验to_model_input的结果
 _to_tensors = transforms.Compose([
     Stack(),  # 将图像堆叠为序列
     ToTorchFormatTensor()  # 将堆叠的图像转化为PyTorch张量
 ])
+# 在设备上融合时每次缩放的帧数，1080p条带每帧缩放后约占8MB显存
+COMPOSITE_CHUNK_SIZE = 32
+# 自动选择时每次打包的近邻窗口数上限
+MAX_WINDOW_BATCH = 16
 
 
 class STTNInpaint:
-    def __init__(self):
-        self.device = config.device
-        # 1. 创建InpaintGenerator模型实例并装载到选择的设备上
-        self.model = InpaintGenerator().to(self.device)
-        # 2. 载入预训练模型的权重，转载模型的状态字典
-        self.model.load_state_dict(torch.load(config.STTN_MODEL_PATH, map_location='cpu')['netG'])
-        # 3. # 将模型设置为评估模式
-        self.model.eval()
+    def __init__(self, job_config=None):
+        job_config = job_config or JobConfig()
+        self.device = job_config.device
+        # 推理精度，fp16使用半精度权重，bf16使用fp32权重加自动混合精度，int8使用量化后的模型
+        self.precision = get_sttn_precision(self.device, job_config.sttn_precision)
+        self.use_compile = job_config.sttn_compile and hasattr(torch, 'compile')
+        # 卷积编码器/解码器是否使用channels_last内存格式
+        self.channels_last = job_config.sttn_channels_last
+        # 注意力实现，'auto'等在这里解析为实际使用的实现，相同实现的任务共享模型
+        self.attention = resolve_attention_backend(job_config.sttn_attention)
+        self.attention_chunk_size = job_config.sttn_attention_chunk_size
+        self.backend = job_config.sttn_backend
+        self.model = None
+        if self.backend == 'onnx':
+            try:
+                # onnxruntime会话的输入输出都是CPU张量，前后处理也在CPU上进行
+                self.model = model_registry.acquire(STTN_ONNX, torch.device('cpu'))
+                self.device = torch.device('cpu')
+                self.precision = 'fp32'
+                self.use_compile = False
+            except Exception as e:
+                print(f'fail to load STTN ONNX models, fallback to PyTorch: {e}')
+                self.backend = 'torch'
+        if self.backend == 'torch' and self.precision == 'int8':
+            try:
+                # 量化模型只能在CPU上运行，不编译
+                self.model = model_registry.acquire(STTN_INT8, self.device, **self.model_options)
+                self.use_compile = False
+            except Exception as e:
+                print(f'fail to load STTN int8 model, fallback to fp32: {e}')
+                self.precision = 'fp32'
+        if self.model is None:
+            # 从模型注册表获取已加载的InpaintGenerator，同一设备上的任务共享同一个模型
+            self.model = model_registry.acquire(STTN, self.device, self.weight_precision, **self.model_options)
         # 模型输入用的宽和高
         self.model_input_width, self.model_input_height = 640, 120
         # 2. 设置相连帧数
-        self.neighbor_stride = config.STTN_NEIGHBOR_STRIDE
-        self.ref_length = config.STTN_REFERENCE_LENGTH
+        self.neighbor_stride = job_config.sttn_neighbor_stride
+        self.ref_length = job_config.sttn_reference_length
+        # 每次Transformer推理打包的近邻窗口数，0为自动选择
+        self.window_batch = job_config.sttn_window_batch
+        # 重叠窗口的预测是否等权平均
+        self.equal_weight_blend = job_config.sttn_equal_weight_blend
+        # 复用的锁页内存上传缓冲区，以及上一次从该缓冲区异步上传结束的CUDA事件
+        self.upload_buffer = None
+        self.upload_event = None
+
+    def release(self):
+        """
+        归还模型到注册表
+        """
+        if self.model is not None:
+            self.model = None
+            model_registry.release(self.model_name, self.device, self.weight_precision, **self.model_options)
+        if self.upload_event is not None:
+            self.upload_event.synchronize()
+            self.upload_event = None
+        self.upload_buffer = None
+
+    @property
+    def model_name(self):
+        if self.backend == 'onnx':
+            return STTN_ONNX
+        return STTN_INT8 if self.precision == 'int8' else STTN
+
+    @property
+    def model_options(self):
+        """
+        模型注册表中区分同一模型不同加载方式的参数，参数不同的任务不共享模型
+        """
+        if self.model_name == STTN:
+            return {'attention': self.attention, 'chunk_size': self.attention_chunk_size,
+                    'channels_last': self.channels_last}
+        if self.model_name == STTN_INT8:
+            return {'attention': self.attention, 'chunk_size': self.attention_chunk_size}
+        return {}
+
+    @property
+    def weight_precision(self):
+        return 'fp16' if self.precision == 'fp16' else 'fp32'
+
+    def fallback_to_fp32(self):
+        """
+        所选精度或编译后的模型推理失败时，改用fp32的原始模型
+        """
+        self.release()
+        self.precision = 'fp32'
+        self.use_compile = False
+        self.model = model_registry.acquire(self.model_name, self.device, self.weight_precision, **self.model_options)
+
+    def autocast(self):
+        if self.precision != 'bf16':
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16)
+
+    def get_infer(self):
+        """
+        获取Transformer推理函数，开启sttn_compile时返回编译后的model.infer，编译结果保存在共享的模型上
+        """
+        if not self.use_compile:
+            return self.model.infer
+        compiled_infer = getattr(self.model, 'compiled_infer', None)
+        if compiled_infer is None:
+            compiled_infer = torch.compile(self.model.infer, dynamic=True)
+            self.model.compiled_infer = compiled_infer
+        return compiled_infer
 
     def __call__(self, input_frames: List[np.ndarray], input_mask: np.ndarray):
         """
-        :param input_frames: 原视频帧
+        :param input_frames: 原视频帧，不会被修改
         :param mask: 字幕区域mask
         """
+        mask, inpaint_area = self.get_mask_and_inpaint_area(input_mask)
+        return self.inpaint_in_place([frame.copy() for frame in input_frames], mask, inpaint_area)
+
+    def get_mask_and_inpaint_area(self, input_mask: np.ndarray):
+        """
+        二值化mask并确定需要去字幕的水平条带
+        :return (mask, inpaint_area)
+        """
         _, mask = cv2.threshold(input_mask, 127, 1, cv2.THRESH_BINARY)
         mask = mask[:, :, None]
         H_ori, W_ori = mask.shape[:2]
-        H_ori = int(H_ori + 0.5)
-        W_ori = int(W_ori + 0.5)
         # 确定去字幕的垂直高度部分
         split_h = int(W_ori * 3 / 16)
-        inpaint_area = self.get_inpaint_area_by_mask(H_ori, split_h, mask)
-        # 初始化帧存储变量
-        # 高分辨率帧存储列表
-        frames_hr = copy.deepcopy(input_frames)
-        frames_scaled = {}  # 存放缩放后帧的字典
-        comps = {}  # 存放补全后帧的字典
-        # 存储最终的视频帧
-        inpainted_frames = []
-        for k in range(len(inpaint_area)):
-            frames_scaled[k] = []  # 为每个去除部分初始化一个列表
-
-        # 读取并缩放帧
-        for j in range(len(frames_hr)):
-            image = frames_hr[j]
-            # 对每个去除部分进行切割和缩放
-            for k in range(len(inpaint_area)):
-                image_crop = image[inpaint_area[k][0]:inpaint_area[k][1], :, :]  # 切割
-                image_resize = cv2.resize(image_crop, (self.model_input_width, self.model_input_height))  # 缩放
-                frames_scaled[k].append(image_resize)  # 将缩放后的帧添加到对应列表
-
-        # 处理每一个去除部分
-        for k in range(len(inpaint_area)):
-            # 调用inpaint函数进行处理
-            comps[k] = self.inpaint(frames_scaled[k])
-
-        # 如果存在去除部分
+        return mask, self.get_inpaint_area_by_mask(H_ori, split_h, mask)
+
+    def inpaint_in_place(self, frames: List[np.ndarray], mask: np.ndarray, inpaint_area):
+        """
+        只裁剪、推理、融合字幕条带，结果直接写回frames中的条带行，条带以外的像素不做任何拷贝
+        """
         if inpaint_area:
-            for j in range(len(frames_hr)):
-                frame = frames_hr[j]  # 取出原始帧
-                # 对于模式中的每一个段落
-                for k in range(len(inpaint_area)):
-                    comp = cv2.resize(comps[k][j], (W_ori, split_h))  # 将补全帧缩放回原大小
-                    comp = cv2.cvtColor(np.array(comp).astype(np.uint8), cv2.COLOR_BGR2RGB)  # 转换颜色空间
-                    # 获取遮罩区域并进行图像合成
-                    mask_area = mask[inpaint_area[k][0]:inpaint_area[k][1], :]  # 取出遮罩区域
-                    # 实现遮罩区域内的图像融合
-                    frame[inpaint_area[k][0]:inpaint_area[k][1], :, :] = mask_area * comp + (1 - mask_area) * frame[inpaint_area[k][0]:inpaint_area[k][1], :, :]
-                # 将最终帧添加到列表
-                inpainted_frames.append(frame)
-                print(f'processing frame, {len(frames_hr) - j} left')
-        return inpainted_frames
+            # 所有去除部分一起推理，模型只接收缩放后的条带，结果留在设备上直接融合
+            comps = self.predict_regions([[cv2.resize(frame[from_H:to_H], (self.model_input_width,
+                                                                           self.model_input_height))
+                                           for frame in frames] for from_H, to_H in inpaint_area])
+            self.composite_regions(frames, mask, inpaint_area, comps)
+        return frames
+
+    @staticmethod
+    def composite_regions(frames, mask, inpaint_area, comps, chunk_size=COMPOSITE_CHUNK_SIZE):
+        """
+        在设备上把一批帧的补全结果一次缩放回条带大小并转换颜色，只把uint8条带拷回CPU，
+        再按遮罩原地写回原帧，不生成整条带的浮点临时数组
+        :param comps: predict_regions的输出，形状为(条带, 帧, 3, h, w)
+        """
+        H_ori, W_ori = mask.shape[:2]
+        with torch.no_grad():
+            for k, (from_H, to_H) in enumerate(inpaint_area):
+                band_mask = mask[from_H:to_H] > 0
+                band_h = min(to_H, H_ori) - from_H
+                for start in range(0, len(frames), chunk_size):
+                    comp = F.interpolate(comps[k, start:start + chunk_size], size=(band_h, W_ori), mode='bilinear',
+                                         align_corners=False)
+                    # 模型输出为RGB，翻转为BGR后截断为uint8，与原先astype(np.uint8)的取整方式一致
+                    comp = comp.flip(1).clamp_(0, 255).to(torch.uint8).permute(0, 2, 3, 1).cpu().numpy()
+                    for j, band_comp in enumerate(comp):
+                        np.copyto(frames[start + j][from_H:to_H], band_comp, where=band_mask)
+        return frames
+
+    @staticmethod
+    def composite_bands(frame, mask, inpaint_area, band_comps):
+        """
+        将各条带的补全结果缩放回原大小，在遮罩区域内融合回原帧
+        """
+        W_ori = mask.shape[1]
+        split_h = int(W_ori * 3 / 16)
+        for (from_H, to_H), comp in zip(inpaint_area, band_comps):
+            comp = cv2.resize(comp, (W_ori, split_h))  # 将补全帧缩放回原大小
+            comp = cv2.cvtColor(np.array(comp).astype(np.uint8), cv2.COLOR_BGR2RGB)  # 转换颜色空间
+            # 遮罩为0/1，遮罩区域内取补全结果，其余保持原像素
+            band = frame[from_H:to_H]
+            np.copyto(band, comp, where=mask[from_H:to_H] > 0)
+        return frame
 
     @staticmethod
     def read_mask(path):
@@ -117,52 +235,202 @@ class STTNInpaint:
         """
         使用STTN完成空洞填充（空洞即被遮罩的区域）
         """
-        frame_length = len(frames)
-        # 对帧进行预处理转换为张量，并进行归一化
-        feats = _to_tensors(frames).unsqueeze(0) * 2 - 1
-        # 把特征张量转移到指定的设备（CPU或GPU）
-        feats = feats.to(self.device)
-        # 初始化一个与视频长度相同的列表，用于存储处理完成的帧
-        comp_frames = [None] * frame_length
-        # 关闭梯度计算，用于推理阶段节省内存并加速
-        with torch.no_grad():
-            # 将处理好的帧通过编码器，产生特征表示
-            feats = self.model.encoder(feats.view(frame_length, 3, self.model_input_height, self.model_input_width))
-            # 获取特征维度信息
-            _, c, feat_h, feat_w = feats.size()
-            # 调整特征形状以匹配模型的期望输入
-            feats = feats.view(1, frame_length, c, feat_h, feat_w)
-        # 获取重绘区域
-        # 在设定的邻居帧步幅内循环处理视频
+        return self.inpaint_regions([frames])[0]
+
+    def inpaint_regions(self, regions: List[List[np.ndarray]]):
+        """
+        同时补全多个条带，返回每个条带补全后的帧序列（RGB，0~255的float32数组）
+        :param regions: 每个条带缩放后的帧序列
+        """
+        comps = self.predict_regions(regions).permute(0, 1, 3, 4, 2).cpu().numpy()
+        return [list(region_comps) for region_comps in comps]
+
+    def get_upload_buffer(self, shape):
+        """
+        获取至少能容纳shape的uint8上传缓冲区，CUDA设备使用锁页内存以便异步上传
+        返回前等待上一次从缓冲区发起的异步拷贝结束，避免改写仍在上传的数据
+        """
+        if self.upload_event is not None:
+            self.upload_event.synchronize()
+            self.upload_event = None
+        size = int(np.prod(shape))
+        if self.upload_buffer is None or self.upload_buffer.numel() < size:
+            pin_memory = isinstance(self.device, torch.device) and self.device.type == 'cuda'
+            self.upload_buffer = torch.empty(size, dtype=torch.uint8, pin_memory=pin_memory)
+        return self.upload_buffer[:size].view(shape)
+
+    def to_model_input(self, regions: List[List[np.ndarray]]):
+        """
+        将各条带的uint8 BGR帧一次拷贝进上传缓冲区并上传，在设备上完成BGR转RGB、转浮点与归一化到[-1, 1]
+        结果与_to_tensors(frames) * 2 - 1逐元素相同
+        :return 形状为(条带*帧, 3, h, w)的张量
+        """
+        frames = [frame for region in regions for frame in region]
+        buffer = self.get_upload_buffer((len(frames),) + frames[0].shape)
+        np.stack(frames, out=buffer.numpy())
+        feats = buffer.to(self.device, non_blocking=True)
+        if buffer.is_pinned():
+            # 拷贝在当前流上异步执行，下次写入缓冲区前需要等待该事件
+            self.upload_event = torch.cuda.Event()
+            self.upload_event.record()
+        feats = feats.flip(-1).permute(0, 3, 1, 2).float().div(255) * 2 - 1
+        if self.precision == 'fp16':
+            feats = feats.half()
+        if self.channels_last:
+            feats = feats.contiguous(memory_format=torch.channels_last)
+        else:
+            feats = feats.contiguous()
+        return feats
+
+    def predict_regions(self, regions: List[List[np.ndarray]]):
+        """
+        同时补全多个条带：所有条带的帧数相同、输入尺寸都是模型输入大小，沿batch维度堆叠后
+        编码器、Transformer与解码器只运行一次，结果保留在设备上
+        :param regions: 每个条带缩放后的帧序列
+        :return 形状为(条带, 帧, 3, h, w)的张量，RGB，像素值0~255
+        """
+        try:
+            return self.predict_regions_with_precision(regions)
+        except RuntimeError as e:
+            if 'out of memory' in str(e) or (self.precision == 'fp32' and not self.use_compile):
+                raise
+            print(f'STTN {self.precision} inference failed ({e}), fallback to fp32')
+            self.fallback_to_fp32()
+            return self.predict_regions_with_precision(regions)
+
+    def predict_regions_with_precision(self, regions: List[List[np.ndarray]]):
+        region_num = len(regions)
+        frame_length = len(regions[0])
+        # 设备上的累加缓冲区与每帧已累加的窗口数，所有窗口处理完后只归一化一次
+        comp_frames = None
+        counts = None
+        infer = self.get_infer()
+        # 将所有条带的帧一起通过编码器，产生(条带, 帧, c, h, w)的特征
+        feats = self.encode(regions)
+        # 在设定的邻居帧步幅内确定每个窗口的近邻帧与参考帧
+        windows = []
         for f in range(0, frame_length, self.neighbor_stride):
             # 计算邻近帧的ID
             neighbor_ids = [i for i in range(max(0, f - self.neighbor_stride), min(frame_length, f + self.neighbor_stride + 1))]
             # 获取参考帧的索引
-            ref_ids = self.get_ref_index(neighbor_ids, frame_length)
-            # 同样关闭梯度计算
-            with torch.no_grad():
-                # 通过模型推断特征并传递给解码器以生成完成的帧
-                pred_feat = self.model.infer(feats[0, neighbor_ids + ref_ids, :, :, :])
-                # 将预测的特征通过解码器生成图片，并应用激活函数tanh，然后分离出张量
-                pred_img = torch.tanh(self.model.decoder(pred_feat[:len(neighbor_ids), :, :, :])).detach()
-                # 将结果张量重新缩放到0到255的范围内（图像像素值）
-                pred_img = (pred_img + 1) / 2
-                # 将张量移动回CPU并转为NumPy数组
-                pred_img = pred_img.cpu().permute(0, 2, 3, 1).numpy() * 255
-                # 遍历邻近帧
-                for i in range(len(neighbor_ids)):
-                    idx = neighbor_ids[i]
-                    # 将预测的图片转换为无符号8位整数格式
-                    img = np.array(pred_img[i]).astype(np.uint8)
-                    if comp_frames[idx] is None:
-                        # 如果该位置为空，则赋值为新计算出的图片
-                        comp_frames[idx] = img
-                    else:
-                        # 如果此位置之前已有图片，则将新旧图片混合以提高质量
-                        comp_frames[idx] = comp_frames[idx].astype(np.float32) * 0.5 + img.astype(np.float32) * 0.5
+            windows.append((neighbor_ids, self.get_ref_index(neighbor_ids, frame_length)))
+        window_batch = self.get_window_batch(region_num, max(len(n + r) for n, r in windows), feats.shape[2:])
+        for batch_start in range(0, len(windows), window_batch):
+            batch_windows = windows[batch_start:batch_start + window_batch]
+            # 按原来的窗口顺序合并，结果与逐个窗口推理相同
+            for (neighbor_ids, _), pred_img in zip(batch_windows, self.predict_windows(feats, batch_windows, infer)):
+                if comp_frames is None:
+                    comp_frames = torch.zeros((region_num, frame_length) + pred_img.shape[2:],
+                                              dtype=torch.float32, device=pred_img.device)
+                    counts = torch.zeros(frame_length, dtype=torch.float32, device=pred_img.device)
+                # 近邻帧是连续的一段
+                self.accumulate(comp_frames, counts, neighbor_ids[0], pred_img)
+        self.normalize(comp_frames, counts)
         # 返回处理完成的帧序列
         return comp_frames
 
+    def predict_windows(self, feats, windows, infer):
+        """
+        把多个近邻窗口打包成一次batch推理，帧数相同的窗口才能放在同一个batch中
+        :param feats: 形状为(条带, 帧, c, h, w)的特征
+        :param windows: [(近邻帧ID, 参考帧ID)]
+        :return 每个窗口的预测，形状为(条带, 近邻帧, 3, h, w)
+        """
+        region_num = feats.shape[0]
+        groups = {}
+        for j, (neighbor_ids, ref_ids) in enumerate(windows):
+            groups.setdefault((len(neighbor_ids), len(ref_ids)), []).append(j)
+        preds = [None] * len(windows)
+        for (neighbor_num, _), window_indexes in groups.items():
+            # 每个窗口的每个条带都是batch中的一个独立序列
+            window_feats = torch.cat([feats[:, windows[j][0] + windows[j][1]] for j in window_indexes])
+            pred_img = self.predict_window(window_feats, neighbor_num, infer)
+            pred_img = pred_img.view((len(window_indexes), region_num) + pred_img.shape[1:])
+            for m, j in enumerate(window_indexes):
+                preds[j] = pred_img[m]
+        return preds
+
+    def get_window_batch(self, region_num, window_len, feat_shape):
+        """
+        每次推理打包的窗口数，window_batch为0时按注意力矩阵与特征的大小估算空闲显存/内存能容纳的窗口数
+        """
+        if self.window_batch > 0:
+            return self.window_batch
+        c, feat_h, feat_w = feat_shape
+        try:
+            attention = self.model.transformer[0].attention
+            patchsize = attention.patchsize
+            backend, chunk_size = attention.attention.backend, attention.attention.chunk_size
+        except (AttributeError, IndexError, TypeError):
+            patchsize, backend, chunk_size = [(5, 3)], 'math', None
+        # 最细的patch划分产生的token最多，注意力矩阵与softmax结果各一份
+        tokens = max(window_len * (feat_h // height) * (feat_w // width) for width, height in patchsize)
+        # 分块/sdpa注意力不生成完整的注意力矩阵
+        score_rows = tokens if backend == 'math' else min(tokens, chunk_size or 1024)
+        element_size = 2 if self.precision == 'fp16' else 4
+        window_bytes = (tokens * score_rows * 2 + window_len * c * feat_h * feat_w * 8) * element_size * region_num
+        free_bytes = get_free_memory(self.device)
+        if free_bytes is None:
+            return 1
+        return max(1, min(MAX_WINDOW_BATCH, int(free_bytes * 0.5 // window_bytes)))
+
+    def accumulate(self, comp_sum, counts, start, pred_img):
+        """
+        将一个窗口的近邻帧预测合并到设备上的缓冲区comp_sum[:, start:start+n]
+        :param counts: 每帧已合并的窗口数
+        """
+        end = start + pred_img.shape[1]
+        with torch.no_grad():
+            if self.equal_weight_blend:
+                comp_sum[:, start:end] += pred_img
+            else:
+                # 与已有结果各占一半，还没有结果的帧直接取新的预测
+                filled = (counts[start:end] > 0).view(1, -1, 1, 1, 1)
+                comp_sum[:, start:end] = torch.where(filled, comp_sum[:, start:end] * 0.5 + pred_img * 0.5, pred_img)
+            counts[start:end] += 1
+
+    def normalize(self, comp_sum, counts):
+        """
+        等权平均时用累加次数归一化，原地修改comp_sum
+        """
+        if self.equal_weight_blend and comp_sum is not None:
+            with torch.no_grad():
+                comp_sum /= counts.clamp(min=1).view(1, -1, 1, 1, 1)
+        return comp_sum
+
+    def encode(self, regions: List[List[np.ndarray]]):
+        """
+        编码各条带的帧
+        :return 形状为(条带, 帧, c, h, w)的特征
+        """
+        with torch.no_grad(), self.autocast():
+            feats = self.model.encoder(self.to_model_input(regions))
+            _, c, feat_h, feat_w = feats.size()
+            # channels_last的输出需要先转为连续内存
+            return feats.contiguous().view(len(regions), len(regions[0]), c, feat_h, feat_w)
+
+    def predict_window(self, window_feats, neighbor_num, infer):
+        """
+        对一个近邻+参考帧窗口做Transformer推理并解码近邻帧
+        :param window_feats: 形状为(条带, 窗口帧, c, h, w)的特征，前neighbor_num帧为近邻帧
+        :return 形状为(条带, 近邻帧, 3, h, w)的张量，RGB，像素值0~255的整数
+        """
+        region_num, window, c, feat_h, feat_w = window_feats.size()
+        # 同样关闭梯度计算
+        with torch.no_grad(), self.autocast():
+            # 各条带的窗口作为batch中的独立序列一起推理
+            pred_feat = infer(window_feats.reshape(region_num * window, c, feat_h, feat_w), region_num)
+            # 只解码近邻帧
+            pred_feat = pred_feat.view(region_num, window, c, feat_h, feat_w)[:, :neighbor_num]
+            pred_feat = pred_feat.reshape(region_num * neighbor_num, c, feat_h, feat_w)
+            if self.channels_last:
+                pred_feat = pred_feat.contiguous(memory_format=torch.channels_last)
+            pred_img = torch.tanh(self.model.decoder(pred_feat)).float()
+        with torch.no_grad():
+            # 将结果张量重新缩放到0到255的范围内，并截断为整数（与转换为uint8一致）
+            pred_img = ((pred_img + 1) / 2 * 255).trunc()
+            return pred_img.view((region_num, neighbor_num) + pred_img.shape[1:])
+
     @staticmethod
     def get_inpaint_area_by_mask(H, h, mask):
         """
@@ -220,20 +488,116 @@ class STTNInpaint:
         return inpaint_area  # 返回绘画区域列表
 
 
-class STTNVideoInpaint:
-    def __init__(self, video_path, abort_event=None):
-        self.abort_event = abort_event or threading.Event()
+class STTNStreamInpaint:
+    """
+    流式STTN：编码器特征保存在按帧号索引的滑动窗口中，每帧只编码一次；
+    参考帧从当前帧前后ref_window帧内按STTN_REFERENCE_LENGTH的整数倍采样，不受分块边界限制，分块处不会出现接缝；
+    一帧被所有覆盖它的近邻窗口处理后立即融合输出
+    """
 
-    def inpaint(self, mask, sub_remover, tbar):
-        # 在处理循环中添加检查
-        for batch in batches:
-            if self.abort_event.is_set():
-                print("STTN处理已中止")
-                return
+    def __init__(self, sttn_inpaint, mask, inpaint_area, ref_window=None):
+        """
+        :param sttn_inpaint: 提供模型的STTNInpaint
+        :param mask: get_mask_and_inpaint_area返回的二值mask
+        :param inpaint_area: 需要去字幕的条带
+        :param ref_window: 参考帧的采样范围（当前帧前后各ref_window帧），默认为STTN_MAX_LOAD_NUM的一半
+        """
+        self.sttn_inpaint = sttn_inpaint
+        self.mask = mask
+        self.inpaint_area = inpaint_area
+        self.stride = sttn_inpaint.neighbor_stride
+        self.ref_length = sttn_inpaint.ref_length
+        self.ref_window = max(self.stride, ref_window or config.STTN_MAX_LOAD_NUM // 2)
+
+    def crop_strips(self, frame):
+        size = (self.sttn_inpaint.model_input_width, self.sttn_inpaint.model_input_height)
+        return [cv2.resize(frame[from_H:to_H], size) for from_H, to_H in self.inpaint_area]
+
+    def __call__(self, frames):
+        """
+        :param frames: 按顺序产出原视频帧的可迭代对象，帧会被原地修改
+        :return 按顺序产出去字幕后帧的生成器
+        """
+        source = iter(frames)
+        # 已读取但还未输出的原帧、缩放后的条带、编码器特征、补全结果与合并的窗口数，均以帧号为key
+        hr_frames, strips, feats, comps, counts = {}, {}, {}, {}, {}
+        read_count = 0
+        exhausted = False
+        emitted = 0
+        infer = self.sttn_inpaint.get_infer()
+        f = 0
+        while True:
+            # 读取到当前窗口会用到的最后一帧
+            while not exhausted and read_count < f + self.ref_window + 1:
+                frame = next(source, None)
+                if frame is None:
+                    exhausted = True
+                    break
+                hr_frames[read_count] = frame
+                strips[read_count] = self.crop_strips(frame)
+                read_count += 1
+            if f >= read_count:
+                break
+            neighbor_ids = list(range(max(0, f - self.stride), min(read_count, f + self.stride + 1)))
+            # 参考帧取全局帧号为ref_length整数倍的帧，相邻窗口之间的参考帧大多相同，特征可以复用
+            ref_start = -(-max(0, f - self.ref_window) // self.ref_length) * self.ref_length
+            ref_ids = [i for i in range(ref_start, min(read_count, f + self.ref_window + 1), self.ref_length)
+                       if i not in neighbor_ids]
+            # 只编码窗口中还没有特征的帧
+            new_ids = [i for i in neighbor_ids + ref_ids if i not in feats]
+            if new_ids:
+                new_feats = self.sttn_inpaint.encode([[strips[i][k] for i in new_ids]
+                                                      for k in range(len(self.inpaint_area))])
+                for j, i in enumerate(new_ids):
+                    feats[i] = new_feats[:, j]
+            window_feats = torch.stack([feats[i] for i in neighbor_ids + ref_ids], dim=1)
+            pred_img = self.sttn_inpaint.predict_window(window_feats, len(neighbor_ids), infer)
+            # 取出窗口内各帧已合并的结果，按与分块模式相同的方式合并新的预测
+            with torch.no_grad():
+                zeros = torch.zeros_like(pred_img[:, 0])
+                comp_sum = torch.stack([comps.get(i, zeros) for i in neighbor_ids], dim=1)
+            window_counts = torch.tensor([counts.get(i, 0) for i in neighbor_ids], dtype=torch.float32,
+                                         device=pred_img.device)
+            self.sttn_inpaint.accumulate(comp_sum, window_counts, 0, pred_img)
+            for j, i in enumerate(neighbor_ids):
+                comps[i] = comp_sum[:, j]
+                counts[i] = counts.get(i, 0) + 1
+            # 之后的窗口只覆盖f及之后的帧，最后一个窗口处理完后所有帧都已完成
+            last_window = exhausted and f + self.stride >= read_count
+            done = read_count if last_window else f
+            if done > emitted:
+                yield from self.emit(hr_frames, comps, counts, emitted, done)
+                for i in range(emitted, done):
+                    del strips[i]
+                emitted = done
+            # 释放之后的窗口不会再用到的特征
+            next_f = f + self.stride
+            for i in [i for i in feats if i < next_f - self.stride and
+                      (i % self.ref_length != 0 or i < next_f - self.ref_window)]:
+                del feats[i]
+            if last_window:
+                break
+            f = next_f
+
+    def emit(self, hr_frames, comps, counts, start, end):
+        """
+        融合并按顺序输出[start, end)的帧
+        """
+        for chunk_start in range(start, end, COMPOSITE_CHUNK_SIZE):
+            ids = range(chunk_start, min(end, chunk_start + COMPOSITE_CHUNK_SIZE))
+            frames = [hr_frames.pop(i) for i in ids]
+            chunk_comps = torch.stack([comps.pop(i) for i in ids], dim=1)
+            chunk_counts = torch.tensor([counts.pop(i) for i in ids], dtype=torch.float32, device=chunk_comps.device)
+            self.sttn_inpaint.normalize(chunk_comps, chunk_counts)
+            self.sttn_inpaint.composite_regions(frames, self.mask, self.inpaint_area, chunk_comps)
+            yield from frames
+
+
+class STTNVideoInpaint:
 
     def read_frame_info_from_video(self):
         # 使用opencv读取视频
-        reader = cv2.VideoCapture(self.video_path)
+        reader = open_video_capture(self.video_path, self.frame_range)
         # 获取视频的宽度, 高度, 帧率和帧数信息并存储在frame_info字典中
         frame_info = {
             'W_ori': int(reader.get(cv2.CAP_PROP_FRAME_WIDTH) + 0.5),  # 视频的原始宽度
@@ -244,26 +608,37 @@ class STTNVideoInpaint:
         # 返回视频读取对象、帧信息和视频写入对象
         return reader, frame_info
 
-    def __init__(self, video_path, mask_path=None, clip_gap=None):
+    def __init__(self, video_path, mask_path=None, clip_gap=None, abort_event=None, frame_range=None,
+                 job_config=None):
+        job_config = job_config or JobConfig()
+        self.job_config = job_config
         # STTNInpaint视频修复实例初始化
-        self.sttn_inpaint = STTNInpaint()
+        self.sttn_inpaint = STTNInpaint(job_config)
         # 视频和掩码路径
         self.video_path = video_path
         self.mask_path = mask_path
+        # 中止事件
+        self.abort_event = abort_event or threading.Event()
+        # 只处理指定帧区间(起始帧号, 结束帧号)，为None时处理整个视频
+        self.frame_range = frame_range
         # 设置输出视频文件的路径
         self.video_out_path = os.path.join(
             os.path.dirname(os.path.abspath(self.video_path)),
             f"{os.path.basename(self.video_path).rsplit('.', 1)[0]}_no_sub.mp4"
         )
+        # 是否只补全判定为有文字的帧
+        self.text_gate = job_config.sttn_text_gate
         # 配置可在一次处理中加载的最大帧数
         if clip_gap is None:
-            self.clip_gap = config.STTN_MAX_LOAD_NUM
+            self.clip_gap = job_config.sttn_max_load_num
         else:
             self.clip_gap = clip_gap
 
     def __call__(self, input_mask=None, input_sub_remover=None, tbar=None):
         reader = None
         writer = None
+        # 流式/文字判定处理中途出错时重新抛出，避免把截断的视频当作成功的输出
+        reraise = False
         try:
             # 读取视频帧信息
             reader, frame_info = self.read_frame_info_from_video()
@@ -287,16 +662,27 @@ class STTNVideoInpaint:
                 
             # 得到修复区域位置
             inpaint_area = self.sttn_inpaint.get_inpaint_area_by_mask(frame_info['H_ori'], split_h, mask)
+
+            if self.text_gate and inpaint_area:
+                reraise = True
+                self.gated(reader, writer, mask, inpaint_area, input_sub_remover, tbar)
+                return
+            if self.job_config.sttn_streaming and inpaint_area:
+                reraise = True
+                self.stream(reader, writer, mask, inpaint_area, input_sub_remover, tbar)
+                return
             
             # 遍历每一次的迭代次数
             for i in range(rec_time):
+                if self.abort_event.is_set():
+                    print("STTN处理已中止")
+                    break
                 start_f = i * self.clip_gap  # 起始帧位置
                 end_f = min((i + 1) * self.clip_gap, frame_info['len'])  # 结束帧位置
                 print('Processing:', start_f + 1, '-', end_f, ' / Total:', frame_info['len'])
                 
                 frames_hr = []  # 高分辨率帧列表
                 frames = {}  # 帧字典，用于存储裁剪后的图像
-                comps = {}  # 组合字典，用于存储修复后的图像
                 
                 # 初始化帧字典
                 for k in range(len(inpaint_area)):
@@ -324,47 +710,208 @@ class STTNVideoInpaint:
                     print(f"Warning: No valid frames found in range {start_f+1}-{end_f}. Skipping this segment.")
                     continue
                     
-                # 对每个修复区域运行修复
-                for k in range(len(inpaint_area)):
-                    if len(frames[k]) > 0:  # 确保有帧可以处理
-                        comps[k] = self.sttn_inpaint.inpaint(frames[k])
+                # 所有修复区域一起推理
+                if inpaint_area:
+                    # 预览只需要最后一帧的原图
+                    if input_sub_remover is not None and input_sub_remover.gui_mode:
+                        original_frame = frames_hr[-1].copy()
                     else:
-                        comps[k] = []
-                
-                # 如果有要修复的区域
-                if inpaint_area and valid_frames_count > 0:
-                    for j in range(valid_frames_count):
-                        if input_sub_remover is not None and input_sub_remover.gui_mode:
-                            original_frame = copy.deepcopy(frames_hr[j])
-                        else:
-                            original_frame = None
-                            
-                        frame = frames_hr[j]
-                        
-                        for k in range(len(inpaint_area)):
-                            if j < len(comps[k]):  # 确保索引有效
-                                # 将修复的图像重新扩展到原始分辨率，并融合到原始帧
-                                comp = cv2.resize(comps[k][j], (frame_info['W_ori'], split_h))
-                                comp = cv2.cvtColor(np.array(comp).astype(np.uint8), cv2.COLOR_BGR2RGB)
-                                mask_area = mask[inpaint_area[k][0]:inpaint_area[k][1], :]
-                                frame[inpaint_area[k][0]:inpaint_area[k][1], :, :] = mask_area * comp + (1 - mask_area) * frame[inpaint_area[k][0]:inpaint_area[k][1], :, :]
-                        
-                        writer.write(frame)
-                        
-                        if input_sub_remover is not None:
-                            if tbar is not None:
-                                input_sub_remover.update_progress(tbar, increment=1)
-                            if original_frame is not None and input_sub_remover.gui_mode:
-                                input_sub_remover.preview_frame = cv2.hconcat([original_frame, frame])
+                        original_frame = None
+                    comps = self.sttn_inpaint.predict_regions([frames[k] for k in range(len(inpaint_area))])
+                    # 将修复的条带重新扩展到原始分辨率，直接融合到原始帧
+                    self.sttn_inpaint.composite_regions(frames_hr, mask, inpaint_area, comps)
+                    del comps
+                    if original_frame is not None:
+                        input_sub_remover.preview_frame = cv2.hconcat([original_frame, frames_hr[-1]])
+
+                # 没有要修复的区域时原样写出
+                for frame in frames_hr:
+                    writer.write(frame)
+                    if input_sub_remover is not None and tbar is not None:
+                        input_sub_remover.update_progress(tbar, increment=1)
         except Exception as e:
             print(f"Error during video processing: {str(e)}")
+            if reraise:
+                raise
             # 不抛出异常，允许程序继续执行
         finally:
             if writer:
                 writer.release()
 
+    def gated(self, reader, writer, mask, inpaint_area, input_sub_remover=None, tbar=None):
+        """
+        逐帧判定字幕区域内是否有文字，只补全有文字的连续帧，其余帧原样写出
+        """
+        gui_mode = input_sub_remover is not None and input_sub_remover.gui_mode
+        # 在mask的外接矩形内判定
+        x, y, w, h = cv2.boundingRect(mask[:, :, 0])
+        gate = TextPresenceGate((y, y + h, x, x + w), self.job_config.sttn_text_gate_threshold,
+                                self.job_config.sttn_text_gate_contrast)
+
+        def read_frames():
+            for frame in prefetch_frames(reader):
+                if self.abort_event.is_set():
+                    print("STTN处理已中止")
+                    return
+                yield frame
+
+        padding = self.job_config.sttn_text_gate_padding
+        for has_text, frames in split_text_runs(read_frames(), gate, padding, self.clip_gap):
+            if has_text:
+                original_frame = frames[-1].copy() if gui_mode else None
+                self.sttn_inpaint.inpaint_in_place(frames, mask, inpaint_area)
+                if original_frame is not None:
+                    input_sub_remover.preview_frame = cv2.hconcat([original_frame, frames[-1]])
+            for frame in frames:
+                writer.write(frame)
+                if input_sub_remover is not None and tbar is not None:
+                    input_sub_remover.update_progress(tbar, increment=1)
+        print(gate.report())
+
+    def stream(self, reader, writer, mask, inpaint_area, input_sub_remover=None, tbar=None):
+        """
+        使用流式STTN处理整个视频，后台线程解码的同时推理，完成的帧立即写出
+        """
+        gui_mode = input_sub_remover is not None and input_sub_remover.gui_mode
+        # 预览用的原帧，每隔COMPOSITE_CHUNK_SIZE帧保留一份副本
+        originals = {}
+
+        def read_frames():
+            for frame_no, frame in enumerate(prefetch_frames(reader)):
+                if self.abort_event.is_set():
+                    print("STTN处理已中止")
+                    return
+                if gui_mode and frame_no % COMPOSITE_CHUNK_SIZE == 0:
+                    originals[frame_no] = frame.copy()
+                yield frame
+
+        stream_inpaint = STTNStreamInpaint(self.sttn_inpaint, mask, inpaint_area, self.clip_gap // 2)
+        for frame_no, frame in enumerate(stream_inpaint(read_frames())):
+            writer.write(frame)
+            if input_sub_remover is not None:
+                if tbar is not None:
+                    input_sub_remover.update_progress(tbar, increment=1)
+                if frame_no in originals:
+                    input_sub_remover.preview_frame = cv2.hconcat([originals.pop(frame_no), frame])
+
+    def release(self):
+        """
+        归还模型到注册表
+        """
+        self.sttn_inpaint.release()
+
+
+def make_synthetic_clip(frame_count, height=120, width=640):
+    """
+    固定的合成片段：平滑渐变背景加缓慢移动的色块和字幕文字
+    """
+    yy, xx = np.mgrid[0:height, 0:width]
+    clip = []
+    for i in range(frame_count):
+        frame = np.stack([(xx + i * 3) % 256, (yy * 2 + i) % 256, (xx + yy) // 3 % 256], axis=-1).astype(np.uint8)
+        cv2.rectangle(frame, (40 + i * 8, 20), (120 + i * 8, 100), (30, 200, 90), -1)
+        cv2.putText(frame, 'SUBTITLE', (200, 80), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 3)
+        clip.append(frame)
+    return clip
+
+
+def check_window_batch_parity(device=None, frame_count=60, region_num=2, max_diff=1.0):
+    """
+    对比逐个窗口推理与打包推理的结果，两者应当一致（只可能有卷积算法选择带来的浮点误差）
+    :param max_diff: 允许的最大绝对差，结果为截断后的0~255整数，浮点误差最多使个别像素相差1，超过时抛出AssertionError
+    """
+    clip = make_synthetic_clip(frame_count)
+    regions = [clip[k:] + clip[:k] for k in range(region_num)]
+    job_config = JobConfig(device=device or config.device, sttn_precision='fp32')
+    results = {}
+    for batch in [1, 0]:
+        sttn_inpaint = STTNInpaint(job_config.replace(sttn_window_batch=batch))
+        try:
+            start = time.time()
+            results[batch] = sttn_inpaint.predict_regions(regions).cpu()
+            print(f'sttn_window_batch={batch}: {time.time() - start:.2f}s')
+        finally:
+            sttn_inpaint.release()
+    diff = (results[1] - results[0]).abs().max().item()
+    print('max abs diff:', diff)
+    assert diff <= max_diff, f'packed windows differ from sequential windows by {diff} (> {max_diff})'
+    return diff
+
+
+def check_precision_parity(precision='auto', device=None, frame_count=30, min_psnr=35.0):
+    """
+    在固定的合成片段上对比所选精度与fp32的补全结果，PSNR低于min_psnr时认为精度漂移过大，抛出AssertionError
+    :return (实际使用的精度, PSNR)
+    """
+    device = device or config.device
+    clip = make_synthetic_clip(frame_count)
+    results = {}
+    for name in ['fp32', precision]:
+        sttn_inpaint = STTNInpaint(JobConfig(device=device, sttn_precision=name))
+        try:
+            results[name] = (sttn_inpaint.precision, sttn_inpaint.predict_regions([clip]).float().cpu())
+        finally:
+            sttn_inpaint.release()
+    used_precision, prediction = results[precision]
+    mse = torch.mean((prediction - results['fp32'][1]) ** 2).item()
+    psnr = float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+    print(f'STTN {used_precision} vs fp32 on {device}: PSNR {psnr:.2f}dB')
+    assert psnr >= min_psnr, \
+        f'STTN {used_precision} PSNR {psnr:.2f}dB is lower than {min_psnr}dB, please use STTN_PRECISION = \'fp32\''
+    return used_precision, psnr
+
+
+def benchmark_composite(size=(1920, 1080), frame_count=100, region_num=2, device=None, repeat=3):
+    """
+    对比逐帧CPU融合（composite_bands）与设备上整批融合（composite_regions）每帧的耗时
+    """
+    device = device or config.device
+    width, height = size
+    split_h = int(width * 3 / 16)
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(frame_count)]
+    mask = np.zeros((height, width, 1), dtype=np.uint8)
+    mask[height - split_h * region_num + 20:height - 20, width // 8:width - width // 8] = 1
+    inpaint_area = [(height - split_h * (k + 1), height - split_h * k) for k in range(region_num)]
+    comps = torch.rand((region_num, frame_count, 3, 120, 640), device=device) * 255
+    comps_cpu = list(comps.permute(0, 1, 3, 4, 2).cpu().numpy())
+    for name in ['composite_bands', 'composite_regions']:
+        costs = []
+        for _ in range(repeat):
+            start = time.time()
+            if name == 'composite_bands':
+                # 原先的流程：结果先拷回CPU，再逐帧逐条带缩放、转换颜色与融合
+                comps_cpu = list(comps.permute(0, 1, 3, 4, 2).cpu().numpy())
+                for j, frame in enumerate(frames):
+                    STTNInpaint.composite_bands(frame, mask, inpaint_area, [comps_cpu[k][j] for k in range(region_num)])
+            else:
+                STTNInpaint.composite_regions(frames, mask, inpaint_area, comps)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            costs.append(time.time() - start)
+        print(f'{width}x{height} x{region_num} regions {name} on {device}: '
+              f'{min(costs) / frame_count * 1000:.2f} ms/frame')
+
 
 if __name__ == '__main__':
+    if '--check-window-batch' in sys.argv:
+        check_window_batch_parity()
+        sys.exit(0)
+    if '--check-precision' in sys.argv:
+        check_precision_parity(config.STTN_PRECISION if config.STTN_PRECISION != 'fp32' else 'auto')
+        sys.exit(0)
+    if '--check-preprocess' in sys.argv:
+        # 校验to_model_input与原先PIL预处理的结果完全一致
+        _rng = np.random.default_rng(0)
+        _regions = [[_rng.integers(0, 255, (120, 640, 3), dtype=np.uint8) for _ in range(10)] for _ in range(2)]
+        _inpaint = STTNInpaint()
+        _expected = torch.cat([_to_tensors([f.copy() for f in frames]) for frames in _regions]) * 2 - 1
+        print('max abs diff:', (_inpaint.to_model_input(_regions).cpu() - _expected).abs().max().item())
+        _inpaint.release()
+        sys.exit(0)
+    if '--benchmark-composite' in sys.argv:
+        benchmark_composite()
+        sys.exit(0)
     mask_path = '../../test/test.png'
     video_path = '../../test/test.mp4'
     # 记录开始时间
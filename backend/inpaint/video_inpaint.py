@@ -8,10 +8,8 @@ from PIL import Image
 import torch
 import torchvision
 
-from backend import config
-from backend.inpaint.video.model.modules.flow_comp_raft import RAFT_bi
-from backend.inpaint.video.model.recurrent_flow_completion import RecurrentFlowCompleteNet
-from backend.inpaint.video.model.propainter import InpaintGenerator
+from backend.job_config import JobConfig
+from backend.inpaint.model_registry import model_registry, get_propainter_precision, RAFT, FLOW_COMPLETE, PROPAINTER
 from backend.inpaint.video.core.utils import to_tensors
 from backend.inpaint.video.model.misc import get_device
 
@@ -130,12 +128,15 @@ def get_ref_index(mid_neighbor_id, neighbor_ids, length, ref_stride=10, ref_num=
 
 
 class VideoInpaint:
-    def __init__(self, sub_video_length=config.PROPAINTER_MAX_LOAD_NUM, use_fp16=True):
-        self.device = get_device()
+    def __init__(self, sub_video_length=None, use_fp16=True, job_config=None):
+        job_config = job_config or JobConfig()
+        if sub_video_length is None:
+            sub_video_length = job_config.propainter_max_load_num
+        # ProPainter不支持DirectML，仅在任务指定CUDA设备时使用该设备
+        self.device = job_config.cuda_device or get_device()
         self.use_fp16 = use_fp16
-        self.use_half = True if self.use_fp16 else False
-        if self.device == torch.device('cpu'):
-            self.use_half = False
+        self.precision = get_propainter_precision(self.device, self.use_fp16)
+        self.use_half = self.precision == 'fp16'
         # Length of sub-video for long video inference.
         self.sub_video_length = sub_video_length
         # Length of local neighboring frames.'
@@ -156,22 +157,25 @@ class VideoInpaint:
         self.model = self.init_inpaint_model()
 
     def init_raft_model(self):
-        # set up RAFT and flow competition model
-        return RAFT_bi(os.path.join(config.VIDEO_INPAINT_MODEL_PATH, 'raft-things.pth'), self.device)
+        # set up RAFT and flow competition model, RAFT always runs in fp32
+        return model_registry.acquire(RAFT, self.device)
 
     def init_fix_flow_model(self):
-        fix_flow_complete_model = RecurrentFlowCompleteNet(
-            os.path.join(config.VIDEO_INPAINT_MODEL_PATH, 'recurrent_flow_completion.pth'))
-        for p in fix_flow_complete_model.parameters():
-            p.requires_grad = False
-        fix_flow_complete_model.to(self.device)
-        fix_flow_complete_model.eval()
-        return fix_flow_complete_model
+        return model_registry.acquire(FLOW_COMPLETE, self.device, self.precision)
 
     def init_inpaint_model(self):
         # set up ProPainter model
-        return InpaintGenerator(model_path=os.path.join(config.VIDEO_INPAINT_MODEL_PATH, 'ProPainter.pth')).to(
-            self.device).eval()
+        return model_registry.acquire(PROPAINTER, self.device, self.precision)
+
+    def release(self):
+        """
+        归还模型到注册表
+        """
+        if self.model is not None:
+            self.fix_raft = self.fix_flow_complete = self.model = None
+            model_registry.release(RAFT, self.device)
+            model_registry.release(FLOW_COMPLETE, self.device, self.precision)
+            model_registry.release(PROPAINTER, self.device, self.precision)
 
     def inpaint(self, frames, mask):
         if isinstance(frames[0], np.ndarray):
@@ -232,11 +236,11 @@ class VideoInpaint:
                 gt_flows_bi = self.fix_raft(frames, iters=self.raft_iter)
                 torch.cuda.empty_cache()
 
+            # flow completion and ProPainter models are already loaded in the chosen precision
+            fix_flow_complete = self.fix_flow_complete
             if self.use_half:
                 frames, flow_masks, masks_dilated = frames.half(), flow_masks.half(), masks_dilated.half()
                 gt_flows_bi = (gt_flows_bi[0].half(), gt_flows_bi[1].half())
-                fix_flow_complete = self.fix_flow_complete.half()
-                self.model = self.model.half()
 
             # ---- complete flow ----
             flow_length = gt_flows_bi[0].size(1)
@@ -0,0 +1,161 @@
+from dataclasses import dataclass, fields, replace
+
+import torch
+
+from backend import config
+from backend.tools.video_tools import INTERMEDIATE_FORMATS
+
+
+@dataclass(frozen=True)
+class JobConfig:
+    """
+    单个去字幕任务的不可变配置，由config.py中的默认值和任务的自定义参数生成
+    取代原先reload config模块再setattr的方式，多个任务可以在同一进程中并发运行
+    """
+    mode: config.InpaintMode = config.MODE
+    use_h264: bool = config.USE_H264
+    intermediate_format: str = config.INTERMEDIATE_FORMAT
+    device: torch.device = config.device
+    threshold_height_width_difference: int = config.THRESHOLD_HEIGHT_WIDTH_DIFFERENCE
+    subtitle_area_deviation_pixel: int = config.SUBTITLE_AREA_DEVIATION_PIXEL
+    threshold_height_difference: int = config.THRESHOLD_HEIGHT_DIFFERENCE
+    pixel_tolerance_y: int = config.PIXEL_TOLERANCE_Y
+    pixel_tolerance_x: int = config.PIXEL_TOLERANCE_X
+    sttn_skip_detection: bool = config.STTN_SKIP_DETECTION
+    sttn_neighbor_stride: int = config.STTN_NEIGHBOR_STRIDE
+    sttn_reference_length: int = config.STTN_REFERENCE_LENGTH
+    sttn_max_load_num: int = config.STTN_MAX_LOAD_NUM
+    sttn_window_batch: int = config.STTN_WINDOW_BATCH
+    sttn_attention: str = config.STTN_ATTENTION
+    sttn_attention_chunk_size: int = config.STTN_ATTENTION_CHUNK_SIZE
+    sttn_precision: str = config.STTN_PRECISION
+    sttn_backend: str = config.STTN_BACKEND
+    sttn_equal_weight_blend: bool = config.STTN_EQUAL_WEIGHT_BLEND
+    sttn_text_gate: bool = config.STTN_TEXT_GATE
+    sttn_text_gate_padding: int = config.STTN_TEXT_GATE_PADDING
+    sttn_text_gate_threshold: float = config.STTN_TEXT_GATE_THRESHOLD
+    sttn_text_gate_contrast: int = config.STTN_TEXT_GATE_CONTRAST
+    sttn_streaming: bool = config.STTN_STREAMING
+    sttn_channels_last: bool = config.STTN_CHANNELS_LAST
+    sttn_compile: bool = config.STTN_COMPILE
+    propainter_max_load_num: int = config.PROPAINTER_MAX_LOAD_NUM
+    lama_super_fast: bool = config.LAMA_SUPER_FAST
+    lama_crop: bool = config.LAMA_CROP
+    lama_crop_margin: float = config.LAMA_CROP_MARGIN
+    lama_crop_max_side: int = config.LAMA_CROP_MAX_SIDE
+    lama_reuse: bool = config.LAMA_REUSE
+    lama_reuse_threshold: float = config.LAMA_REUSE_THRESHOLD
+    lama_reuse_max_run: int = config.LAMA_REUSE_MAX_RUN
+    lama_batch_size: int = config.LAMA_BATCH_SIZE
+    lama_batch_max_delay: int = config.LAMA_BATCH_MAX_DELAY
+
+    def __post_init__(self):
+        # 与config.py一致，保证STTN_MAX_LOAD_NUM不小于STTN_REFERENCE_LENGTH * STTN_NEIGHBOR_STRIDE
+        min_load_num = self.sttn_reference_length * self.sttn_neighbor_stride
+        if self.sttn_max_load_num < min_load_num:
+            object.__setattr__(self, 'sttn_max_load_num', min_load_num)
+
+    @classmethod
+    def from_overrides(cls, custom_config=None):
+        """
+        根据自定义参数字典生成任务配置，与命令行一致，未知的配置项或无法解析的值直接抛出ValueError，
+        而不是在任务中静默使用默认值
+        """
+        if isinstance(custom_config, JobConfig):
+            return custom_config
+        field_names = {f.name for f in fields(cls)}
+        overrides = {}
+        for key, value in (custom_config or {}).items():
+            # 打印每个配置项的键值
+            print(f"Setting config: {key} = {value} (type: {type(value).__name__})")
+            key = key.lower()
+            if value is None:
+                continue
+            if key not in field_names:
+                raise ValueError(f"未知的配置项: {key}")
+            try:
+                overrides[key] = cls.parse_value(key, value)
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"配置设置错误 ({key}={value}): {e}")
+        return cls(**overrides)
+
+    @staticmethod
+    def parse_value(key, value):
+        if key == "mode":
+            # 处理模式：从字符串转换为枚举
+            if isinstance(value, config.InpaintMode):
+                return value
+            # 确保使用大写字符串
+            return config.InpaintMode[str(value).strip().upper()]
+        if key == "intermediate_format":
+            value = str(value).strip().lower()
+            if value != 'auto' and value not in INTERMEDIATE_FORMATS:
+                raise ValueError(f"未知的中间视频格式: {value}")
+            return value
+        if key == "sttn_backend":
+            value = str(value).strip().lower()
+            if value not in ('torch', 'onnx'):
+                raise ValueError(f"未知的STTN推理后端: {value}")
+            return value
+        if key == "sttn_attention":
+            value = str(value).strip().lower()
+            if value not in ('auto', 'math', 'sdpa', 'chunked'):
+                raise ValueError(f"未知的STTN注意力实现: {value}")
+            return value
+        if key == "sttn_precision":
+            value = str(value).strip().lower()
+            if value not in ('auto', 'fp32', 'fp16', 'bf16', 'int8'):
+                raise ValueError(f"未知的STTN推理精度: {value}")
+            return value
+        if key == "device":
+            return value if isinstance(value, torch.device) else torch.device(value)
+        if key in ["sttn_skip_detection", "lama_super_fast", "lama_crop", "lama_reuse", "use_h264",
+                   "sttn_equal_weight_blend", "sttn_text_gate", "sttn_streaming", "sttn_channels_last",
+                   "sttn_compile"]:
+            # 处理布尔值，命令行等传入的字符串按字面含义解析，避免bool('0')为True
+            if isinstance(value, str):
+                value = value.strip().lower()
+                if value not in ('1', '0', 'true', 'false', 'yes', 'no', 'on', 'off'):
+                    raise ValueError(f"无法解析的布尔值: {value}")
+                return value in ('1', 'true', 'yes', 'on')
+            return bool(value)
+        if key in ["sttn_text_gate_threshold", "lama_crop_margin", "lama_reuse_threshold"]:
+            # 处理浮点数值
+            config_value = float(value)
+            if config_value < 0:
+                raise ValueError(f"{key}不能为负数: {value}")
+            return config_value
+        # 处理整数值
+        config_value = int(value)
+        # 应用额外范围限制
+        if key == "sttn_neighbor_stride":
+            config_value = max(1, min(config_value, 800))
+        elif key == "sttn_reference_length":
+            config_value = max(1, min(config_value, 400))
+        elif key == "sttn_max_load_num":
+            config_value = max(50, min(config_value, 2000))
+        elif key == "sttn_window_batch":
+            config_value = max(0, config_value)
+        elif key == "sttn_attention_chunk_size":
+            config_value = max(1, config_value)
+        elif key in ("sttn_text_gate_padding", "sttn_text_gate_contrast", "lama_batch_size", "lama_batch_max_delay",
+                     "lama_crop_max_side", "lama_reuse_max_run"):
+            config_value = max(0, config_value)
+        elif key == "propainter_max_load_num":
+            config_value = max(20, min(config_value, 4000))
+        return config_value
+
+    def replace(self, **changes):
+        """
+        返回修改了部分配置项的新配置
+        """
+        return replace(self, **changes)
+
+    @property
+    def cuda_device(self):
+        """
+        任务设备为CUDA时返回该设备，否则返回None（DirectML等设备只用于STTN）
+        """
+        if isinstance(self.device, torch.device) and self.device.type == 'cuda':
+            return self.device
+        return None
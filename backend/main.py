@@ -5,25 +5,32 @@ import os
 from pathlib import Path
 import threading
 import cv2
+import numpy as np
 import sys
-from functools import cached_property
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-import config
+from backend import config
+from backend.job_config import JobConfig
 from backend.tools.common_tools import is_video_or_image, is_image_file
 from backend.scenedetect import scene_detect
 from backend.scenedetect.detectors import ContentDetector
-from backend.inpaint.sttn_inpaint import STTNInpaint, STTNVideoInpaint
-from backend.inpaint.lama_inpaint import LamaInpaint
+from backend.inpaint.sttn_inpaint import STTNInpaint, STTNVideoInpaint, STTNStreamInpaint, COMPOSITE_CHUNK_SIZE
+from backend.inpaint.lama_inpaint import LamaInpaint, TemporalReuse
 from backend.inpaint.video_inpaint import VideoInpaint
-from backend.tools.inpaint_tools import create_mask, batch_generator
-import importlib
+from backend.tools.inpaint_tools import create_mask, batch_generator, read_frame_batches
+from backend.tools.video_tools import open_video_capture, get_keyframe_frame_no, open_video_writer, \
+    resolve_intermediate_format, get_merge_video_args, INTERMEDIATE_FORMATS
+from backend.tools.frame_ring import RingVideoCapture, RingVideoWriter
+from backend.tools.segment_tools import split_uniform, plan_segments, slice_sub_list, slice_points, longest_first
 import platform
 import tempfile
+import functools
+import itertools
 import multiprocessing
 from shapely.geometry import Polygon
 import time
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
 
@@ -31,19 +38,33 @@ class SubtitleDetect:
     """
     文本框检测类，用于检测视频帧中是否存在文本框
     """
+    # 每个线程复用同一个文本检测器，同一线程依次处理的多个任务不再重复加载检测模型
+    _thread_local = threading.local()
 
-    def __init__(self, video_path, sub_area=None):
+    def __init__(self, video_path, sub_area=None, frame_range=None, job_config=None):
         self.video_path = video_path
         self.sub_area = sub_area
-
-    @cached_property
+        # 任务配置
+        self.job_config = job_config or JobConfig()
+        # 只处理指定帧区间(起始帧号, 结束帧号)，为None时处理整个视频
+        self.frame_range = frame_range
+        # 预先计算好的字幕帧号字典与场景切换帧号（分段并行时由主进程传入），为None时自行检测
+        self.sub_list = None
+        self.scene_div_points = None
+
+    @property
     def text_detector(self):
+        text_detector = getattr(self._thread_local, 'text_detector', None)
+        if text_detector is None:
+            text_detector = self._thread_local.text_detector = self.create_text_detector()
+        return text_detector
+
+    def create_text_detector(self):
         import paddle
         paddle.disable_signal_handler()
         from paddleocr.tools.infer import utility
         from paddleocr.tools.infer.predict_det import TextDetector
         # 获取参数对象
-        importlib.reload(config)
         args = utility.parse_args()
         args.det_algorithm = 'DB'
         args.det_model_dir = self.convertToOnnxModelIfNeeded(config.DET_MODEL_PATH)
@@ -77,8 +98,30 @@ class SubtitleDetect:
                 coordinate_list.append((xmin, xmax, ymin, ymax))
         return coordinate_list
 
+    def detect_subtitle_boxes(self, frame):
+        """
+        检测单帧中的文本框，只保留位于字幕区域内的文本框
+        :return list 文本框坐标列表[(xmin, xmax, ymin, ymax)]
+        """
+        dt_boxes, elapse = self.detect_subtitle(frame)
+        coordinate_list = self.get_coordinates(dt_boxes.tolist())
+        temp_list = []
+        for coordinate in coordinate_list:
+            xmin, xmax, ymin, ymax = coordinate
+            if self.sub_area is not None:
+                s_ymin, s_ymax, s_xmin, s_xmax = self.sub_area
+                if (s_xmin <= xmin and xmax <= s_xmax
+                        and s_ymin <= ymin
+                        and ymax <= s_ymax):
+                    temp_list.append((xmin, xmax, ymin, ymax))
+            else:
+                temp_list.append((xmin, xmax, ymin, ymax))
+        return temp_list
+
     def find_subtitle_frame_no(self, sub_remover=None):
-        video_cap = cv2.VideoCapture(self.video_path)
+        if self.sub_list is not None:
+            return self.sub_list
+        video_cap = open_video_capture(self.video_path, self.frame_range)
         frame_count = video_cap.get(cv2.CAP_PROP_FRAME_COUNT)
         tbar = tqdm(total=int(frame_count), unit='frame', position=0, file=sys.__stdout__, desc='Subtitle Finding')
         current_frame_no = 0
@@ -98,22 +141,9 @@ class SubtitleDetect:
                 break
             # 读取视频帧成功
             current_frame_no += 1
-            dt_boxes, elapse = self.detect_subtitle(frame)
-            coordinate_list = self.get_coordinates(dt_boxes.tolist())
-            if coordinate_list:
-                temp_list = []
-                for coordinate in coordinate_list:
-                    xmin, xmax, ymin, ymax = coordinate
-                    if self.sub_area is not None:
-                        s_ymin, s_ymax, s_xmin, s_xmax = self.sub_area
-                        if (s_xmin <= xmin and xmax <= s_xmax
-                                and s_ymin <= ymin
-                                and ymax <= s_ymax):
-                            temp_list.append((xmin, xmax, ymin, ymax))
-                    else:
-                        temp_list.append((xmin, xmax, ymin, ymax))
-                if len(temp_list) > 0:
-                    subtitle_frame_no_box_dict[current_frame_no] = temp_list
+            temp_list = self.detect_subtitle_boxes(frame)
+            if len(temp_list) > 0:
+                subtitle_frame_no_box_dict[current_frame_no] = temp_list
             tbar.update(1)
             if sub_remover:
                 sub_remover.progress_total = (100 * float(current_frame_no) / float(frame_count)) // 2
@@ -205,6 +235,17 @@ class SubtitleDetect:
         # 输出结果
         return result_intervals
 
+    def find_scene_div_frame_no(self):
+        """
+        获取当前处理区间内发生场景切换的帧号
+        """
+        if self.scene_div_points is not None:
+            return list(self.scene_div_points)
+        scene_div_frame_no_list = self.get_scene_div_frame_no(self.video_path)
+        if self.frame_range is not None:
+            scene_div_frame_no_list = slice_points(scene_div_frame_no_list, self.frame_range)
+        return scene_div_frame_no_list
+
     @staticmethod
     def get_scene_div_frame_no(v_path):
         """
@@ -220,14 +261,14 @@ class SubtitleDetect:
                 scene_div_frame_no_list.append(start.frame_num + 1)
         return scene_div_frame_no_list
 
-    @staticmethod
-    def are_similar(region1, region2):
+    def are_similar(self, region1, region2):
         """判断两个区域是否相似。"""
         xmin1, xmax1, ymin1, ymax1 = region1
         xmin2, xmax2, ymin2, ymax2 = region2
+        tolerance_x, tolerance_y = self.job_config.pixel_tolerance_x, self.job_config.pixel_tolerance_y
 
-        return abs(xmin1 - xmin2) <= config.PIXEL_TOLERANCE_X and abs(xmax1 - xmax2) <= config.PIXEL_TOLERANCE_X and \
-            abs(ymin1 - ymin2) <= config.PIXEL_TOLERANCE_Y and abs(ymax1 - ymax2) <= config.PIXEL_TOLERANCE_Y
+        return abs(xmin1 - xmin2) <= tolerance_x and abs(xmax1 - xmax2) <= tolerance_x and \
+            abs(ymin1 - ymin2) <= tolerance_y and abs(ymax1 - ymax2) <= tolerance_y
 
     def unify_regions(self, raw_regions):
         """将连续相似的区域统一，保持列表结构。"""
@@ -445,14 +486,14 @@ class SubtitleDetect:
                         has_same_position = False
                         # 遍历每个区间最大文本框，判断当前文本框位置是否与区间最大文本框列表的某个文本框位于同一行且交叉
                         for area_max_box in area_max_box_list:
-                            if (area_max_box['ymin'] - config.THRESHOLD_HEIGHT_DIFFERENCE <= ymin
-                                    and ymax <= area_max_box['ymax'] + config.THRESHOLD_HEIGHT_DIFFERENCE):
+                            if (area_max_box['ymin'] - self.job_config.threshold_height_difference <= ymin
+                                    and ymax <= area_max_box['ymax'] + self.job_config.threshold_height_difference):
                                 if self.compute_iou((xmin, xmax, ymin, ymax), (
                                         area_max_box['xmin'], area_max_box['xmax'], area_max_box['ymin'],
                                         area_max_box['ymax'])) != -1:
                                     # 如果高度差异不一样
                                     if abs(abs(area_max_box['ymax'] - area_max_box['ymin']) - abs(
-                                            ymax - ymin)) < config.THRESHOLD_HEIGHT_DIFFERENCE:
+                                            ymax - ymin)) < self.job_config.threshold_height_difference:
                                         has_same_position = True
                                     # 如果在同一行，则计算当前面积是不是最大
                                     # 判断面积大小，若当前面积更大，则将当前行的最大区域坐标点更新
@@ -574,67 +615,14 @@ class SubtitleDetect:
 
 
 class SubtitleRemover:
-    def __init__(self, vd_path, sub_area=None, gui_mode=False, custom_config=None, abort_event=None):  # 添加 abort_event 参数
-        importlib.reload(config)
+    def __init__(self, vd_path, sub_area=None, gui_mode=False, custom_config=None, abort_event=None,
+                 frame_range=None, sub_list=None, scene_div_points=None, intermediate_only=False,
+                 output_dir=None):  # 添加 abort_event 参数
         print(f"Initializing SubtitleRemover with config: {custom_config}")
-        # 新增：中止事件
-        self.abort_event = None  # 将在运行时由WebUI设置
-
         # 存储中止事件
         self.abort_event = abort_event or threading.Event()
-
-        # 应用自定义配置
-        if custom_config:
-            for key, value in custom_config.items():
-                try:
-                    # 打印每个配置项的键值
-                    print(f"Setting config: {key} = {value} (type: {type(value).__name__})")
-
-                    if key == "mode":
-                        # 处理模式：从字符串转换为枚举
-                        if isinstance(value, config.InpaintMode):
-                            current_mode = value
-                        else:
-                            # 确保使用大写字符串
-                            mode_str = str(value).strip().upper()
-                            current_mode = config.InpaintMode[mode_str]
-
-                        # 检查是否支持该模式
-                        if current_mode not in list(config.InpaintMode):
-                            raise ValueError(f"不支持的模式: {current_mode}")
-
-                        print(f"Setting MODE to {current_mode.name}")
-                        config.MODE = current_mode
-
-                    elif key == "sttn_skip_detection" or key == "lama_super_fast":
-                        # 处理布尔值
-                        config_value = bool(value)
-                        print(f"Setting {key.upper()} to {config_value}")
-                        setattr(config, key.upper(), config_value)
-
-                    elif key in ["sttn_neighbor_stride", "sttn_reference_length",
-                                 "sttn_max_load_num", "propainter_max_load_num"]:
-                        # 处理整数值
-                        config_value = max(1, int(value))  # 确保至少为1
-                        # 应用额外范围限制
-                        if key == "sttn_neighbor_stride":
-                            config_value = min(config_value, 800)
-                        elif key == "sttn_reference_length":
-                            config_value = min(config_value, 400)
-                        elif key == "sttn_max_load_num":
-                            config_value = max(50, min(config_value, 2000))
-                        elif key == "propainter_max_load_num":
-                            config_value = max(20, min(config_value, 4000))
-
-                        print(f"Setting {key.upper()} to {config_value}")
-                        setattr(config, key.upper(), config_value)
-                    else:
-                        # 其他配置项直接设置
-                        setattr(config, key.upper(), value)
-
-                except Exception as e:
-                    print(f"配置设置错误 ({key}={value}): {str(e)}")
-                    print("使用该配置项的默认值")
+        # 应用自定义配置，生成本任务独立的不可变配置，不修改全局config模块
+        self.job_config = JobConfig.from_overrides(custom_config)
         # 线程锁
         self.lock = threading.RLock()
         # 用户指定的字幕区域位置
@@ -648,7 +636,19 @@ class SubtitleRemover:
             self.is_picture = True
         # 视频路径
         self.video_path = vd_path
-        self.video_cap = cv2.VideoCapture(vd_path)
+        # 只处理指定帧区间(起始帧号, 结束帧号)，用于分段并行处理
+        self.frame_range = frame_range
+        # 只生成无音频的中间视频，不合并音频（分段并行时由主进程拼接后统一合并）
+        self.intermediate_only = intermediate_only
+        # 解码/编码是否放到独立进程，通过共享内存环形缓冲区传递帧（进程池的工作进程不能再创建子进程）
+        self.use_frame_ring = config.FRAME_RING_SLOTS > 0 and not self.is_picture and \
+            not multiprocessing.current_process().daemon
+        # STTN跳过字幕检测时由STTNVideoInpaint自行读取视频，不启动用不到的解码进程
+        sttn_reads_video = self.job_config.mode == config.InpaintMode.STTN and self.job_config.sttn_skip_detection
+        if self.use_frame_ring and not sttn_reads_video:
+            self.video_cap = RingVideoCapture(vd_path, frame_range, config.FRAME_RING_SLOTS)
+        else:
+            self.video_cap = open_video_capture(vd_path, frame_range)
         # 通过视频路径获取视频名称
         self.vd_name = Path(self.video_path).stem
         # 视频帧总数
@@ -663,26 +663,41 @@ class SubtitleRemover:
         self.frame_height = int(self.video_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         self.frame_width = int(self.video_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         # 创建字幕检测对象
-        self.sub_detector = SubtitleDetect(self.video_path, self.sub_area)
+        self.sub_detector = SubtitleDetect(self.video_path, self.sub_area, frame_range, self.job_config)
+        self.sub_detector.sub_list = sub_list
+        self.sub_detector.scene_div_points = scene_div_points
+        # 中间视频格式，图片不写视频，使用默认的mp4v
+        if self.is_picture:
+            self.intermediate_format = 'mp4v'
+        else:
+            self.intermediate_format = resolve_intermediate_format(self.job_config.intermediate_format,
+                                                                   self.frame_count, self.size)
         # 创建视频临时对象，windows下delete=True会有permission denied的报错
-        self.video_temp_file = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
+        self.video_temp_file = tempfile.NamedTemporaryFile(suffix=INTERMEDIATE_FORMATS[self.intermediate_format][0],
+                                                           delete=False)
         # 创建视频写对象
-        self.video_writer = cv2.VideoWriter(self.video_temp_file.name, cv2.VideoWriter_fourcc(*'mp4v'), self.fps,
-                                            self.size)
-        self.video_out_name = os.path.join(os.path.dirname(self.video_path), f'{self.vd_name}_no_sub.mp4')
+        open_writer = functools.partial(open_video_writer, use_h264=self.job_config.use_h264)
+        if self.use_frame_ring:
+            self.video_writer = RingVideoWriter(self.video_temp_file.name, self.intermediate_format, self.fps,
+                                                self.size, config.FRAME_RING_SLOTS, open_writer=open_writer)
+        else:
+            self.video_writer = open_writer(self.video_temp_file.name, self.intermediate_format, self.fps, self.size)
+        # 输出目录，默认与输入文件相同
+        self.output_dir = output_dir or os.path.dirname(self.video_path)
+        self.video_out_name = self.get_output_path(self.video_path, self.output_dir)
         self.video_inpaint = None
         self.lama_inpaint = None
+        self.sttn_inpaint = None
         self.ext = os.path.splitext(vd_path)[-1]
         if self.is_picture:
-            pic_dir = os.path.join(os.path.dirname(self.video_path), 'no_sub')
+            pic_dir = os.path.dirname(self.video_out_name)
             if not os.path.exists(pic_dir):
                 os.makedirs(pic_dir)
-            self.video_out_name = os.path.join(pic_dir, f'{self.vd_name}{self.ext}')
         if torch.cuda.is_available():
             print('use GPU for acceleration')
         if config.USE_DML:
             print('use DirectML for acceleration')
-            if config.MODE != config.InpaintMode.STTN:
+            if self.job_config.mode != config.InpaintMode.STTN:
                 print(
                     'Warning: DirectML acceleration is only available for STTN model. Falling back to CPU for other models.')
         for provider in config.ONNX_PROVIDERS:
@@ -739,6 +754,17 @@ class SubtitleRemover:
                 return end_no
         return -1
 
+    @staticmethod
+    def get_output_path(video_path, output_dir=None):
+        """
+        获取去除字幕后的输出路径，视频为<名称>_no_sub.mp4，图片保存在no_sub目录下
+        """
+        output_dir = output_dir or os.path.dirname(video_path)
+        name, ext = os.path.splitext(os.path.basename(video_path))
+        if is_image_file(str(video_path)):
+            return os.path.join(output_dir, 'no_sub', f'{name}{ext}')
+        return os.path.join(output_dir, f'{name}_no_sub.mp4')
+
     def update_progress(self, tbar, increment):
         tbar.update(increment)
         current_percentage = (tbar.n / tbar.total) * 100
@@ -748,11 +774,14 @@ class SubtitleRemover:
     def propainter_mode(self, tbar):
         print('use propainter mode')
         sub_list = self.sub_detector.find_subtitle_frame_no(sub_remover=self)
-        continuous_frame_no_list = self.sub_detector.find_continuous_ranges_with_same_mask(sub_list)
-        scene_div_points = self.sub_detector.get_scene_div_frame_no(self.video_path)
-        continuous_frame_no_list = self.sub_detector.split_range_by_scene(continuous_frame_no_list,
-                                                                          scene_div_points)
-        self.video_inpaint = VideoInpaint(config.PROPAINTER_MAX_LOAD_NUM)
+        if sub_list:
+            continuous_frame_no_list = self.sub_detector.find_continuous_ranges_with_same_mask(sub_list)
+            scene_div_points = self.sub_detector.find_scene_div_frame_no()
+            continuous_frame_no_list = self.sub_detector.split_range_by_scene(continuous_frame_no_list,
+                                                                              scene_div_points)
+        else:
+            continuous_frame_no_list = []
+        self.video_inpaint = VideoInpaint(self.job_config.propainter_max_load_num, job_config=self.job_config)
         print('[Processing] start removing subtitles...')
         index = 0
         while True:
@@ -783,58 +812,27 @@ class SubtitleRemover:
                     # 如果获取的结束帧号不为-1则说明
                     if end_frame_no != -1:
                         print(f'find end: {end_frame_no}')
-                        # ************ 读取该区间所有帧 start ************
-                        temp_frames = list()
-                        # 将头帧加入处理列表
-                        temp_frames.append(frame)
                         inner_index = 0
-                        # 一直读取到尾帧
-                        while index < end_frame_no:
-                            ret, frame = self.video_cap.read()
-                            if not ret:
-                                break
-                            index += 1
-                            temp_frames.append(frame)
-                        # ************ 读取该区间所有帧 end ************
-                        if len(temp_frames) < 1:
-                            # 没有待处理，直接跳过
-                            continue
-                        elif len(temp_frames) == 1:
-                            inner_index += 1
-                            single_mask = create_mask(self.mask_size, sub_list[index])
-                            if self.lama_inpaint is None:
-                                self.lama_inpaint = LamaInpaint()
-                            inpainted_frame = self.lama_inpaint(frame, single_mask)
-                            self.video_writer.write(inpainted_frame)
-                            print(f'write frame: {start_frame_no + inner_index} with mask {sub_list[start_frame_no]}')
-                            self.update_progress(tbar, increment=1)
-                            continue
-                        else:
-                            # 将读取的视频帧分批处理
-                            # 1. 获取当前批次使用的mask
-                            mask = create_mask(self.mask_size, sub_list[start_frame_no])
-                            for batch in batch_generator(temp_frames, config.PROPAINTER_MAX_LOAD_NUM):
-                                # 2. 调用批推理
-                                if len(batch) == 1:
-                                    single_mask = create_mask(self.mask_size, sub_list[start_frame_no])
-                                    if self.lama_inpaint is None:
-                                        self.lama_inpaint = LamaInpaint()
-                                    inpainted_frame = self.lama_inpaint(frame, single_mask)
-                                    self.video_writer.write(inpainted_frame)
-                                    print(
-                                        f'write frame: {start_frame_no + inner_index} with mask {sub_list[start_frame_no]}')
-                                    inner_index += 1
-                                    self.update_progress(tbar, increment=1)
-                                elif len(batch) > 1:
-                                    inpainted_frames = self.video_inpaint.inpaint(batch, mask)
-                                    for i, inpainted_frame in enumerate(inpainted_frames):
-                                        self.video_writer.write(inpainted_frame)
-                                        print(
-                                            f'write frame: {start_frame_no + inner_index} with mask {sub_list[index]}')
-                                        inner_index += 1
-                                        if self.gui_mode:
-                                            self.preview_frame = cv2.hconcat([batch[i], inpainted_frame])
-                                self.update_progress(tbar, increment=len(batch))
+                        # 1. 获取当前区间使用的mask
+                        mask = create_mask(self.mask_size, sub_list[start_frame_no], self.job_config)
+                        # 2. 边读取边分批推理，内存中最多只保留一批帧
+                        for batch in read_frame_batches(self.video_cap, frame, end_frame_no - start_frame_no + 1,
+                                                        self.job_config.propainter_max_load_num):
+                            if len(batch) == 1:
+                                # 单帧无法做时序推理，使用LAMA
+                                if self.lama_inpaint is None:
+                                    self.lama_inpaint = LamaInpaint(job_config=self.job_config)
+                                inpainted_frames = [self.lama_inpaint(batch[0], mask)]
+                            else:
+                                inpainted_frames = self.video_inpaint.inpaint(batch, mask)
+                            for i, inpainted_frame in enumerate(inpainted_frames):
+                                self.video_writer.write(inpainted_frame)
+                                print(f'write frame: {start_frame_no + inner_index} with mask {sub_list[start_frame_no]}')
+                                inner_index += 1
+                                if self.gui_mode:
+                                    self.preview_frame = cv2.hconcat([batch[i], inpainted_frame])
+                            self.update_progress(tbar, increment=len(batch))
+                        index = start_frame_no + inner_index - 1
 
     def sttn_mode_with_no_detection(self, tbar):
         """
@@ -849,24 +847,30 @@ class SubtitleRemover:
                 '[Info] No subtitle area has been set. Video will be processed in full screen. As a result, the final outcome might be suboptimal.')
             ymin, ymax, xmin, xmax = 0, self.frame_height, 0, self.frame_width
         mask_area_coordinates = [(xmin, xmax, ymin, ymax)]
-        mask = create_mask(self.mask_size, mask_area_coordinates)
-        sttn_video_inpaint = STTNVideoInpaint(self.video_path, self.abort_event) #传递中止事件
-        sttn_video_inpaint(input_mask=mask, input_sub_remover=self, tbar=tbar)
+        mask = create_mask(self.mask_size, mask_area_coordinates, self.job_config)
+        self.sttn_inpaint = STTNVideoInpaint(self.video_path, abort_event=self.abort_event,
+                                             frame_range=self.frame_range,
+                                             job_config=self.job_config)  # 传递中止事件
+        self.sttn_inpaint(input_mask=mask, input_sub_remover=self, tbar=tbar)
 
 
     def sttn_mode(self, tbar):
         # 是否跳过字幕帧寻找
-        if config.STTN_SKIP_DETECTION:
+        if self.job_config.sttn_skip_detection:
             # 若跳过则世界使用sttn模式
             self.sttn_mode_with_no_detection(tbar)
         else:
             print('use sttn mode')
-            sttn_inpaint = STTNInpaint()
+            self.sttn_inpaint = sttn_inpaint = STTNInpaint(job_config=self.job_config)
             sub_list = self.sub_detector.find_subtitle_frame_no(sub_remover=self)
-            continuous_frame_no_list = self.sub_detector.find_continuous_ranges_with_same_mask(sub_list)
-            print(continuous_frame_no_list)
-            continuous_frame_no_list = self.sub_detector.filter_and_merge_intervals(continuous_frame_no_list)
-            print(continuous_frame_no_list)
+            if sub_list:
+                continuous_frame_no_list = self.sub_detector.find_continuous_ranges_with_same_mask(sub_list)
+                print(continuous_frame_no_list)
+                continuous_frame_no_list = self.sub_detector.filter_and_merge_intervals(
+                    continuous_frame_no_list, self.job_config.sttn_reference_length)
+                print(continuous_frame_no_list)
+            else:
+                continuous_frame_no_list = []
             start_end_map = dict()
             for interval in continuous_frame_no_list:
                 start, end = interval
@@ -891,50 +895,89 @@ class SubtitleRemover:
                     start_frame_index = current_frame_index
                     end_frame_index = start_end_map[current_frame_index]
                     print(f'processing frame {start_frame_index} to {end_frame_index}')
-                    # 用于存储需要去字幕的视频帧
-                    frames_need_inpaint = list()
-                    frames_need_inpaint.append(frame)
                     inner_index = 0
-                    # 接着往下读，直到读取到尾巴
-                    for j in range(end_frame_index - start_frame_index):
-                        ret, frame = self.video_cap.read()
-                        if not ret:
-                            break
-                        current_frame_index += 1
-                        frames_need_inpaint.append(frame)
                     mask_area_coordinates = []
-                    # 1. 获取当前批次的mask坐标全集
+                    seen_areas = set()
+                    last_areas = None
+                    # 1. 增量获取当前批次的mask坐标全集，unify_regions后相邻帧的文本框通常相同，直接跳过
                     for mask_index in range(start_frame_index, end_frame_index):
-                        if mask_index in sub_list.keys():
-                            for area in sub_list[mask_index]:
-                                xmin, xmax, ymin, ymax = area
-                                # 判断是不是非字幕区域(如果宽大于长，则认为是错误检测)
-                                if (ymax - ymin) - (xmax - xmin) > config.THRESHOLD_HEIGHT_WIDTH_DIFFERENCE:
-                                    continue
-                                if area not in mask_area_coordinates:
-                                    mask_area_coordinates.append(area)
+                        areas = sub_list.get(mask_index)
+                        if not areas or areas == last_areas:
+                            continue
+                        last_areas = areas
+                        for area in areas:
+                            if area in seen_areas:
+                                continue
+                            seen_areas.add(area)
+                            xmin, xmax, ymin, ymax = area
+                            # 判断是不是非字幕区域(如果宽大于长，则认为是错误检测)
+                            if (ymax - ymin) - (xmax - xmin) > self.job_config.threshold_height_width_difference:
+                                continue
+                            mask_area_coordinates.append(area)
                     # 1. 获取当前批次使用的mask
-                    mask = create_mask(self.mask_size, mask_area_coordinates)
+                    mask = create_mask(self.mask_size, mask_area_coordinates, self.job_config)
                     print(f'inpaint with mask: {mask_area_coordinates}')
-                    for batch in batch_generator(frames_need_inpaint, config.STTN_MAX_LOAD_NUM):
-                        # 2. 调用批推理
-                        if len(batch) >= 1:
-                            inpainted_frames = sttn_inpaint(batch, mask)
-                            for i, inpainted_frame in enumerate(inpainted_frames):
-                                self.video_writer.write(inpainted_frame)
-                                print(f'write frame: {start_frame_index + inner_index} with mask')
-                                inner_index += 1
-                                if self.gui_mode:
-                                    self.preview_frame = cv2.hconcat([batch[i], inpainted_frame])
+                    mask, inpaint_area = sttn_inpaint.get_mask_and_inpaint_area(mask)
+                    interval_length = end_frame_index - start_frame_index + 1
+                    if self.job_config.sttn_streaming and inpaint_area:
+                        # 2. 流式推理，参考帧可以跨越批次边界
+                        self.sttn_stream_interval(sttn_inpaint, frame, interval_length, mask, inpaint_area, tbar)
+                        current_frame_index = end_frame_index
+                        continue
+                    # 2. 边读取边分批推理，内存占用只与批大小有关，与字幕区间长度无关
+                    for batch in read_frame_batches(self.video_cap, frame, interval_length,
+                                                    self.job_config.sttn_max_load_num):
+                        # 预览需要原帧，只在gui模式下保留最后一帧的副本
+                        original_frame = batch[-1].copy() if self.gui_mode else None
+                        # 只处理字幕条带，结果直接融合回读取的帧，条带以外的部分原样写出
+                        inpainted_frames = sttn_inpaint.inpaint_in_place(batch, mask, inpaint_area)
+                        for inpainted_frame in inpainted_frames:
+                            self.video_writer.write(inpainted_frame)
+                            print(f'write frame: {start_frame_index + inner_index} with mask')
+                            inner_index += 1
+                        if self.gui_mode:
+                            self.preview_frame = cv2.hconcat([original_frame, inpainted_frames[-1]])
                         self.update_progress(tbar, increment=len(batch))
+                    current_frame_index = start_frame_index + inner_index - 1
+
+    def sttn_stream_interval(self, sttn_inpaint, first_frame, n_frames, mask, inpaint_area, tbar):
+        """
+        使用流式STTN处理一个字幕区间，从first_frame开始共n_frames帧
+        """
+        originals = {}
+
+        def read_frames():
+            # 逐帧读取区间内的帧，gui模式下每批保留一帧原图用于预览
+            frames = itertools.chain.from_iterable(read_frame_batches(self.video_cap, first_frame, n_frames, 1))
+            for frame_no, frame in enumerate(frames):
+                if self.gui_mode and frame_no % COMPOSITE_CHUNK_SIZE == 0:
+                    originals[frame_no] = frame.copy()
+                yield frame
+
+        stream_inpaint = STTNStreamInpaint(sttn_inpaint, mask, inpaint_area, self.job_config.sttn_max_load_num // 2)
+        for frame_no, inpainted_frame in enumerate(stream_inpaint(read_frames())):
+            self.video_writer.write(inpainted_frame)
+            self.update_progress(tbar, increment=1)
+            if frame_no in originals:
+                self.preview_frame = cv2.hconcat([originals.pop(frame_no), inpainted_frame])
 
     def lama_mode(self, tbar):
         print('use lama mode')
         sub_list = self.sub_detector.find_subtitle_frame_no(sub_remover=self)
         if self.lama_inpaint is None:
-            self.lama_inpaint = LamaInpaint()
+            self.lama_inpaint = LamaInpaint(job_config=self.job_config)
+        # 连续的字幕帧凑成一批推理，极速模式逐帧处理
+        batch_size = 1 if self.job_config.lama_super_fast else self.lama_inpaint.get_batch_size(self.mask_size)
+        # 静止画面复用参考帧的结果，极速模式不需要
+        reuse = None
+        if self.job_config.lama_reuse and not self.job_config.lama_super_fast:
+            reuse = TemporalReuse(self.job_config.lama_reuse_threshold, self.job_config.lama_reuse_max_run)
+        # 按顺序等待写出的帧[帧号, 原帧, 结果, mask, 复用的参考帧]，结果为None且没有参考帧的帧等待批推理
+        pending = []
+        # 等待推理的字幕帧数，以及最后一个字幕帧之后排队的无字幕帧数
+        waiting = idle = 0
         index = 0
-        print('[Processing] start removing subtitles...')
+        print(f'[Processing] start removing subtitles... (LAMA batch size: {batch_size})')
         while True:
             if self.abort_event.is_set():
                 print("LAMA模式处理已中止")
@@ -942,14 +985,69 @@ class SubtitleRemover:
             ret, frame = self.video_cap.read()
             if not ret:
                 break
-            original_frame = frame
             index += 1
             if index in sub_list.keys():
-                mask = create_mask(self.mask_size, sub_list[index])
-                if config.LAMA_SUPER_FAST:
-                    frame = cv2.inpaint(frame, mask, 3, cv2.INPAINT_TELEA)
+                mask = create_mask(self.mask_size, sub_list[index], self.job_config)
+                if self.job_config.lama_super_fast:
+                    pending.append([index, frame, cv2.inpaint(frame, mask, 3, cv2.INPAINT_TELEA), None, None])
                 else:
-                    frame = self.lama_inpaint(frame, mask)
+                    item = [index, frame, None, mask, None]
+                    source = None
+                    if reuse is not None:
+                        key = frozenset(tuple(box) for box in sub_list[index])
+                        source, signature = reuse.lookup(key, frame, mask)
+                        if source is None:
+                            reuse.set_reference(key, signature, item)
+                    pending.append(item)
+                    if source is None:
+                        waiting += 1
+                        idle = 0
+                    else:
+                        # 参考帧的结果可用后直接贴回，不需要推理
+                        item[4] = source
+                        idle += 1
+            else:
+                pending.append([index, frame, frame, None, None])
+                idle += 1
+            # 没有等待推理的帧时立即写出；字幕帧凑满一批，或字幕帧之后排队的帧超过延迟上限时推理并写出
+            if waiting == 0 or waiting >= batch_size or idle > self.job_config.lama_batch_max_delay:
+                batch_size = self.write_lama_frames(pending, tbar, batch_size)
+                pending = []
+                waiting = idle = 0
+        if pending and not self.abort_event.is_set():
+            self.write_lama_frames(pending, tbar, batch_size)
+        if reuse is not None:
+            print(reuse.report())
+
+    def write_lama_frames(self, pending, tbar, batch_size):
+        """
+        对等待中的字幕帧做一次批推理，再按顺序写出所有帧
+        :param pending: 按帧号排列的[帧号, 原帧, 结果, mask, 复用的参考帧]，结果为None且没有参考帧的帧需要推理
+        :return 之后使用的批大小，显存不足时改为逐帧推理
+        """
+        items = [item for item in pending if item[2] is None and item[4] is None]
+        if len(items) == 1:
+            items[0][2] = self.lama_inpaint(items[0][1], items[0][3])
+        elif items:
+            try:
+                results = self.lama_inpaint.inpaint_batch([item[1] for item in items], [item[3] for item in items])
+            except RuntimeError as e:
+                if 'out of memory' not in str(e):
+                    raise
+                print('LAMA batch inference out of memory, fallback to batch size 1')
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                batch_size = 1
+                results = [self.lama_inpaint(item[1], item[3]) for item in items]
+            for item, result in zip(items, results):
+                item[2] = result
+        for item in pending:
+            if item[4] is not None:
+                # 参考帧在当前帧之前，结果已经推理完成，只替换mask内的像素
+                item[2] = item[1].copy()
+                np.copyto(item[2], item[4][2], where=(item[3] > 0)[:, :, None])
+                item[4] = None
+        for index, original_frame, frame, _, _ in pending:
             if self.gui_mode:
                 self.preview_frame = cv2.hconcat([original_frame, frame])
             if self.is_picture:
@@ -959,6 +1057,7 @@ class SubtitleRemover:
             tbar.update(1)
             self.progress_remover = 100 * float(index) / float(self.frame_count) // 2
             self.progress_total = 50 + self.progress_remover
+        return batch_size
 
     def run(self):
         # 记录开始时间
@@ -980,11 +1079,12 @@ class SubtitleRemover:
                 return
 
             if self.is_picture:
-                sub_list = self.sub_detector.find_subtitle_frame_no(sub_remover=self)
-                self.lama_inpaint = LamaInpaint()
-                original_frame = cv2.imread(self.video_path)
-                if len(sub_list):
-                    mask = create_mask(original_frame.shape[0:2], sub_list[1])
+                # 图片直接解码后检测，不再通过VideoCapture读取
+                original_frame = ImageBatchRemover.read_image(self.video_path)
+                sub_boxes = self.sub_detector.detect_subtitle_boxes(original_frame)
+                self.lama_inpaint = LamaInpaint(job_config=self.job_config)
+                if len(sub_boxes):
+                    mask = create_mask(original_frame.shape[0:2], sub_boxes, self.job_config)
                     inpainted_frame = self.lama_inpaint(original_frame, mask)
                 else:
                     inpainted_frame = original_frame
@@ -998,9 +1098,9 @@ class SubtitleRemover:
                     print("处理已中止")
                     return
             else:
-                if config.MODE == config.InpaintMode.PROPAINTER:
+                if self.job_config.mode == config.InpaintMode.PROPAINTER:
                     self.propainter_mode(tbar)
-                elif config.MODE == config.InpaintMode.STTN:
+                elif self.job_config.mode == config.InpaintMode.STTN:
                     self.sttn_mode(tbar)
                 else:
                     self.lama_mode(tbar)
@@ -1013,6 +1113,13 @@ class SubtitleRemover:
                 print("处理已中止")
                 return
 
+            if self.intermediate_only:
+                # 中间视频由调用方负责拼接、合并音频与删除
+                self.video_out_name = self.video_temp_file.name
+                self.video_temp_file.close()
+                self.isFinished = True
+                self.progress_total = 100
+                return
             if not self.is_picture:
                 # 将原音频合并到新生成的视频文件中
                 self.merge_audio_to_video()
@@ -1037,50 +1144,488 @@ class SubtitleRemover:
                 print("处理已中止")
             else:
                 raise e
+        finally:
+            # 中止或出错时也要结束解码/编码进程
+            self.video_cap.release()
+            self.video_writer.release()
+            self.release_models()
+
+    def release_models(self):
+        """
+        任务结束后归还模型，模型保留在注册表中供后续任务复用
+        """
+        for inpaint in [self.lama_inpaint, self.video_inpaint, self.sttn_inpaint]:
+            if inpaint is not None:
+                inpaint.release()
+        self.lama_inpaint = self.video_inpaint = self.sttn_inpaint = None
 
     def merge_audio_to_video(self):
-        # 创建音频临时对象，windows下delete=True会有permission denied的报错
-        temp = tempfile.NamedTemporaryFile(suffix='.aac', delete=False)
-        audio_extract_command = [config.FFMPEG_PATH,
-                                 "-y", "-i", self.video_path,
-                                 "-acodec", "copy",
-                                 "-vn", "-loglevel", "error", temp.name]
+        self.is_successful_merged = merge_audio_to_video(self.video_path, self.video_temp_file.name,
+                                                         self.video_out_name, self.job_config.use_h264,
+                                                         self.intermediate_format)
+        self.video_temp_file.close()
+
+
+def merge_audio_to_video(video_path, video_temp_path, video_out_name, use_h264=config.USE_H264,
+                         video_format='mp4v'):
+    """
+    将原视频的音频合并到去除字幕后的中间视频，合并失败时只转换视频流（mp4v/pipe直接复制）到输出路径
+    :param video_format 中间视频格式，决定视频流是直接复制还是编码为最终格式
+    :return bool 是否成功合并音频
+    """
+    is_successful_merged = False
+    # 创建音频临时对象，windows下delete=True会有permission denied的报错
+    temp = tempfile.NamedTemporaryFile(suffix='.aac', delete=False)
+    audio_extract_command = [config.FFMPEG_PATH,
+                             "-y", "-i", video_path,
+                             "-acodec", "copy",
+                             "-vn", "-loglevel", "error", temp.name]
+    use_shell = True if os.name == "nt" else False
+    try:
+        subprocess.check_output(audio_extract_command, stdin=open(os.devnull), shell=use_shell)
+    except Exception:
+        print('fail to extract audio')
+        return False
+    else:
+        if os.path.exists(video_temp_path):
+            audio_merge_command = [config.FFMPEG_PATH,
+                                   "-y", "-i", video_temp_path,
+                                   "-i", temp.name,
+                                   *get_merge_video_args(video_format, use_h264),
+                                   "-acodec", "copy",
+                                   "-loglevel", "error", video_out_name]
+            try:
+                subprocess.check_output(audio_merge_command, stdin=open(os.devnull), shell=use_shell)
+            except Exception:
+                print('fail to merge audio')
+                return False
+        if os.path.exists(temp.name):
+            try:
+                os.remove(temp.name)
+            except Exception:
+                if platform.system() in ['Windows']:
+                    pass
+                else:
+                    print(f'failed to delete temp file {temp.name}')
+        is_successful_merged = True
+    finally:
+        temp.close()
+        if not is_successful_merged:
+            if INTERMEDIATE_FORMATS[video_format][1]:
+                # 无损中间格式不能直接作为mp4输出，没有音频时也要编码一次
+                try:
+                    subprocess.check_output([config.FFMPEG_PATH, "-y", "-i", video_temp_path,
+                                             *get_merge_video_args(video_format, use_h264),
+                                             "-loglevel", "error", video_out_name],
+                                            stdin=open(os.devnull), shell=use_shell)
+                except Exception as e:
+                    print(f'fail to encode video: {e}')
+            else:
+                try:
+                    shutil.copy2(video_temp_path, video_out_name)
+                except IOError as e:
+                    print("Unable to copy file. %s" % e)
+    return is_successful_merged
+
+
+def concat_videos(video_paths, video_out_path):
+    """
+    使用ffmpeg concat demuxer无损拼接编码参数一致的视频分段
+    """
+    list_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8')
+    try:
+        for path in video_paths:
+            escaped_path = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped_path}'\n")
+        list_file.close()
+        concat_command = [config.FFMPEG_PATH,
+                          "-y", "-f", "concat", "-safe", "0", "-i", list_file.name,
+                          "-c", "copy", "-loglevel", "error", video_out_path]
         use_shell = True if os.name == "nt" else False
+        subprocess.check_output(concat_command, stdin=open(os.devnull), shell=use_shell)
+    finally:
+        list_file.close()
         try:
-            subprocess.check_output(audio_extract_command, stdin=open(os.devnull), shell=use_shell)
+            os.remove(list_file.name)
         except Exception:
-            print('fail to extract audio')
+            pass
+
+
+# 分段并行工作进程内的状态（设备、字幕检测器），每个进程只初始化一次
+_segment_worker_context = {}
+
+
+def _init_segment_worker(device_queue):
+    device = device_queue.get()
+    _segment_worker_context['device'] = device
+    if device and device.startswith('cuda') and ':' in device:
+        # 让未显式指定序号的"cuda"设备也落在分配的GPU上
+        torch.cuda.set_device(int(device.split(':')[1]))
+
+
+def _segment_detect_task(task):
+    video_path, sub_area, job_config, frame_range = task
+    sub_detector = _segment_worker_context.get('sub_detector')
+    if sub_detector is None:
+        sub_detector = SubtitleDetect(video_path, sub_area, job_config=job_config)
+        _segment_worker_context['sub_detector'] = sub_detector
+    sub_detector.job_config = job_config
+    sub_detector.video_path = video_path
+    sub_detector.sub_area = sub_area
+    sub_detector.frame_range = frame_range
+    sub_list = sub_detector.find_subtitle_frame_no()
+    # 将分段内帧号转换为全局帧号
+    offset = frame_range[0] - 1
+    return frame_range, {frame_no + offset: boxes for frame_no, boxes in sub_list.items()}
+
+
+def _segment_inpaint_task(task):
+    video_path, sub_area, job_config, frame_range, sub_list, scene_div_points = task
+    if _segment_worker_context.get('device'):
+        job_config = job_config.replace(device=torch.device(_segment_worker_context['device']))
+    start_time = time.time()
+    sr = SubtitleRemover(video_path, sub_area=sub_area, custom_config=job_config, frame_range=frame_range,
+                         sub_list=sub_list, scene_div_points=scene_div_points, intermediate_only=True)
+    sr.run()
+    return frame_range, sr.video_out_name, time.time() - start_time
+
+
+class SegmentedSubtitleRemover:
+    """
+    分段并行去字幕：在场景切换帧或关键帧处把视频切成若干分段，由多个工作进程（各自持有模型与设备）并行处理，
+    最后用ffmpeg concat demuxer拼接分段并合并音频
+    """
+
+    def __init__(self, vd_path, sub_area=None, custom_config=None, abort_event=None, workers=None,
+                 target_length=None, split_by=None, devices=None, output_dir=None):
+        self.video_path = vd_path
+        self.sub_area = sub_area
+        self.job_config = JobConfig.from_overrides(custom_config)
+        self.abort_event = abort_event or threading.Event()
+        self.workers = max(1, int(workers or config.SEGMENT_WORKERS))
+        self.target_length = target_length or config.SEGMENT_TARGET_LENGTH
+        self.split_by = split_by or config.SEGMENT_SPLIT_BY
+        self.devices = self.assign_devices(devices or config.SEGMENT_DEVICES, self.workers)
+        video_cap = cv2.VideoCapture(vd_path)
+        self.frame_count = int(video_cap.get(cv2.CAP_PROP_FRAME_COUNT) + 0.5)
+        self.fps = video_cap.get(cv2.CAP_PROP_FPS)
+        self.size = (int(video_cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video_cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        video_cap.release()
+        # 所有分段使用同一种中间格式，才能无损拼接
+        self.intermediate_format = resolve_intermediate_format(self.job_config.intermediate_format,
+                                                               self.frame_count, self.size)
+        self.job_config = self.job_config.replace(intermediate_format=self.intermediate_format)
+        self.vd_name = Path(self.video_path).stem
+        self.output_dir = output_dir or os.path.dirname(self.video_path)
+        self.video_out_name = SubtitleRemover.get_output_path(self.video_path, self.output_dir)
+        # 与SubtitleRemover保持一致的进度属性，便于界面复用
+        self.progress_total = 0
+        self.isFinished = False
+        self.preview_frame = None
+        self.is_successful_merged = False
+        # 每个分段的处理耗时
+        self.segment_timings = {}
+
+    @staticmethod
+    def assign_devices(devices, workers):
+        """
+        为每个工作进程分配设备
+        """
+        if not devices:
+            if not config.USE_DML and torch.cuda.is_available() and torch.cuda.device_count() > 1:
+                devices = [f'cuda:{i}' for i in range(torch.cuda.device_count())]
+            else:
+                # 单GPU/CPU/DirectML使用默认设备
+                devices = [None]
+        return [devices[i % len(devices)] for i in range(workers)]
+
+    def need_detection(self):
+        return not (self.job_config.mode == config.InpaintMode.STTN and self.job_config.sttn_skip_detection)
+
+    def get_cut_points(self):
+        """
+        :return (分段切点, 场景切换帧号)；按关键帧分段时关键帧只用于规划分段，
+        场景切换帧号仍由场景检测得到，只有ProPainter模式需要，其余模式为None
+        """
+        if self.split_by == 'keyframe':
+            try:
+                keyframes = get_keyframe_frame_no(self.video_path)
+            except Exception as e:
+                print(f'fail to read keyframes, fallback to scene detection: {e}')
+            else:
+                if self.job_config.mode != config.InpaintMode.PROPAINTER:
+                    return keyframes, None
+                return keyframes, SubtitleDetect.get_scene_div_frame_no(self.video_path)
+        scene_div_points = SubtitleDetect.get_scene_div_frame_no(self.video_path)
+        return scene_div_points, scene_div_points
+
+    def get_protected_intervals(self, sub_list):
+        """
+        获取不能被分段切开的区间，STTN/ProPainter需要区间内的帧在同一分段中做时序推理
+        """
+        if not sub_list or self.job_config.mode == config.InpaintMode.LAMA:
+            return []
+        intervals = SubtitleDetect.find_continuous_ranges(sub_list)
+        if self.job_config.mode == config.InpaintMode.STTN:
+            intervals = SubtitleDetect.filter_and_merge_intervals(intervals, self.job_config.sttn_reference_length)
+        return intervals
+
+    def run_pool(self, pool, task_func, tasks, weights, progress_base, progress_span):
+        results = []
+        done = 0
+        total = max(1, sum(weights))
+        iterator = pool.imap_unordered(task_func, tasks, chunksize=1)
+        while len(results) < len(tasks):
+            if self.abort_event.is_set():
+                pool.terminate()
+                return None
+            try:
+                result = iterator.next(timeout=0.5)
+            except multiprocessing.TimeoutError:
+                continue
+            results.append(result)
+            frame_range = result[0]
+            done += frame_range[1] - frame_range[0] + 1
+            self.progress_total = progress_base + int(progress_span * done / total)
+        return results
+
+    def run(self):
+        start_time = time.time()
+        self.progress_total = 0
+        if self.abort_event.is_set():
+            print("处理已中止")
             return
-        else:
-            if os.path.exists(self.video_temp_file.name):
-                audio_merge_command = [config.FFMPEG_PATH,
-                                       "-y", "-i", self.video_temp_file.name,
-                                       "-i", temp.name,
-                                       "-vcodec", "libx264" if config.USE_H264 else "copy",
-                                       "-acodec", "copy",
-                                       "-loglevel", "error", self.video_out_name]
-                try:
-                    subprocess.check_output(audio_merge_command, stdin=open(os.devnull), shell=use_shell)
-                except Exception:
-                    print('fail to merge audio')
+        ctx = multiprocessing.get_context('spawn')
+        device_queue = ctx.Queue()
+        for device in self.devices:
+            device_queue.put(device)
+        segment_paths = []
+        with ctx.Pool(processes=self.workers, initializer=_init_segment_worker, initargs=(device_queue,)) as pool:
+            # 1. 并行检测字幕，检测结果汇总后再决定分段，保证切点不落在字幕区间内
+            sub_list = None
+            if self.need_detection():
+                print('[Processing] start finding subtitles in parallel...')
+                chunks = split_uniform(self.frame_count, self.target_length)
+                tasks = [(self.video_path, self.sub_area, self.job_config, chunk) for chunk in longest_first(chunks)]
+                results = self.run_pool(pool, _segment_detect_task, tasks,
+                                        [end - start + 1 for start, end in chunks], 0, 50)
+                if results is None:
+                    print("处理已中止")
                     return
-            if os.path.exists(temp.name):
-                try:
-                    os.remove(temp.name)
-                except Exception:
-                    if platform.system() in ['Windows']:
-                        pass
-                    else:
-                        print(f'failed to delete temp file {temp.name}')
-            self.is_successful_merged = True
+                sub_list = {}
+                for _, chunk_sub_list in results:
+                    sub_list.update(chunk_sub_list)
+                sub_list = SubtitleDetect(self.video_path, self.sub_area,
+                                          job_config=self.job_config).unify_regions(sub_list)
+                sub_list = {k: v for k, v in sub_list.items() if len(v) > 0}
+            # 2. 规划分段
+            cut_points, scene_div_points = self.get_cut_points()
+            segments = plan_segments(self.frame_count, self.target_length, cut_points,
+                                     self.get_protected_intervals(sub_list))
+            print(f'[Processing] {len(segments)} segments: {segments}')
+            # 3. 按分段长度从长到短调度，去除字幕
+            tasks = []
+            for segment in longest_first(segments):
+                segment_sub_list = slice_sub_list(sub_list, segment) if sub_list is not None else None
+                segment_scene_div_points = slice_points(scene_div_points, segment) \
+                    if scene_div_points is not None else None
+                tasks.append((self.video_path, self.sub_area, self.job_config, segment,
+                              segment_sub_list, segment_scene_div_points))
+            progress_base = 50 if sub_list is not None else 0
+            results = self.run_pool(pool, _segment_inpaint_task, tasks,
+                                    [end - start + 1 for start, end in segments],
+                                    progress_base, 100 - progress_base)
+            if results is None:
+                print("处理已中止")
+                return
+        results.sort(key=lambda r: r[0][0])
+        for frame_range, path, cost in results:
+            self.segment_timings[frame_range] = round(cost, 2)
+            segment_paths.append(path)
+        # 4. 拼接分段并合并音频
+        joined_temp_file = tempfile.NamedTemporaryFile(suffix=INTERMEDIATE_FORMATS[self.intermediate_format][0],
+                                                       delete=False)
+        joined_temp_file.close()
+        try:
+            concat_videos(segment_paths, joined_temp_file.name)
+            self.is_successful_merged = merge_audio_to_video(self.video_path, joined_temp_file.name,
+                                                             self.video_out_name, self.job_config.use_h264,
+                                                             self.intermediate_format)
         finally:
-            temp.close()
-            if not self.is_successful_merged:
+            for path in segment_paths + [joined_temp_file.name]:
+                if os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except Exception:
+                        print(f'failed to delete temp file {path}')
+        print(f"[Finished]Subtitle successfully removed, video generated at：{self.video_out_name}")
+        print(f'segment time cost: {self.segment_timings}')
+        print(f'time cost: {round(time.time() - start_time, 2)}s')
+        self.isFinished = True
+        self.progress_total = 100
+
+
+class ImageBatchRemover:
+    """
+    批量图片去字幕：线程池负责图片解码与编码，检测模型与LAMA模型只加载一次，
+    相同尺寸的图片合并为一批做LAMA推理，单张图片失败只记录错误，不影响其余图片
+    """
+
+    def __init__(self, image_paths, sub_area=None, gui_mode=False, custom_config=None, abort_event=None,
+                 output_dir=None, batch_size=None, io_workers=None):
+        self.image_paths = list(image_paths)
+        self.sub_area = sub_area
+        self.gui_mode = gui_mode
+        self.job_config = JobConfig.from_overrides(custom_config)
+        self.abort_event = abort_event or threading.Event()
+        self.output_dir = output_dir
+        self.batch_size = max(1, int(batch_size or config.IMAGE_BATCH_SIZE))
+        self.io_workers = max(1, int(io_workers or config.IMAGE_IO_WORKERS))
+        self.sub_detector = SubtitleDetect(None, sub_area, job_config=self.job_config)
+        self.lama_inpaint = None
+        # 与SubtitleRemover保持一致的进度属性，便于界面复用
+        self.progress_total = 0
+        self.isFinished = False
+        self.preview_frame = None
+        self.done_count = 0
+        # 成功处理的图片 {图片路径: 输出路径}
+        self.outputs = {}
+        # 处理失败的图片 {图片路径: 错误信息}
+        self.failures = {}
+
+    @staticmethod
+    def read_image(path):
+        # imdecode + fromfile 支持中文路径
+        image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f'fail to decode image: {path}')
+        return image
+
+    def write_image(self, path, image):
+        output_path = SubtitleRemover.get_output_path(path, self.output_dir)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        ret, buffer = cv2.imencode(os.path.splitext(path)[-1], image)
+        if not ret:
+            raise ValueError(f'fail to encode image: {output_path}')
+        buffer.tofile(output_path)
+        return output_path
+
+    def inpaint_batch(self, items):
+        """
+        :param items 尺寸相同的[(图片路径, 图片, mask)]
+        """
+        if self.job_config.lama_super_fast:
+            return [cv2.inpaint(image, mask, 3, cv2.INPAINT_TELEA) for _, image, mask in items]
+        if self.lama_inpaint is None:
+            self.lama_inpaint = LamaInpaint(job_config=self.job_config)
+        if len(items) == 1:
+            return [self.lama_inpaint(items[0][1], items[0][2])]
+        return self.lama_inpaint.inpaint_batch([image for _, image, _ in items], [mask for _, _, mask in items])
+
+    def on_done(self, path, tbar, output_path=None, error=None):
+        if error is None:
+            self.outputs[path] = output_path
+        else:
+            self.failures[path] = str(error)
+            print(f'[Failed] {path}: {error}')
+        self.done_count += 1
+        tbar.update(1)
+        self.progress_total = 100 * self.done_count // max(1, len(self.image_paths))
+
+    def collect_writes(self, write_futures, tbar):
+        for path, future in write_futures:
+            try:
+                self.on_done(path, tbar, output_path=future.result())
+            except Exception as e:
+                self.on_done(path, tbar, error=e)
+
+    def process_chunk(self, paths, read_futures, pool, tbar):
+        """
+        检测一组已提交解码的图片，按尺寸分组批推理，并提交编码任务
+        :return list 编码任务[(图片路径, future)]
+        """
+        write_futures = []
+        groups = {}
+        for path, future in zip(paths, read_futures):
+            if self.abort_event.is_set():
+                return write_futures
+            try:
+                image = future.result()
+                boxes = self.sub_detector.detect_subtitle_boxes(image)
+            except Exception as e:
+                self.on_done(path, tbar, error=e)
+                continue
+            if not boxes:
+                # 没有字幕的图片原样输出
+                write_futures.append((path, pool.submit(self.write_image, path, image)))
+                continue
+            mask = create_mask(image.shape[:2], boxes, self.job_config)
+            groups.setdefault(image.shape[:2], []).append((path, image, mask))
+        for items in groups.values():
+            for batch in batch_generator(items, self.batch_size):
+                if self.abort_event.is_set():
+                    return write_futures
                 try:
-                    shutil.copy2(self.video_temp_file.name, self.video_out_name)
-                except IOError as e:
-                    print("Unable to copy file. %s" % e)
-            self.video_temp_file.close()
+                    results = self.inpaint_batch(batch)
+                except Exception as e:
+                    if len(batch) == 1:
+                        self.on_done(batch[0][0], tbar, error=e)
+                        continue
+                    # 批推理失败时逐张重试，只让出错的图片失败
+                    results = []
+                    for item in batch:
+                        try:
+                            results.append(self.inpaint_batch([item])[0])
+                        except Exception as single_error:
+                            self.on_done(item[0], tbar, error=single_error)
+                            results.append(None)
+                for (path, image, _), result in zip(batch, results):
+                    if result is None:
+                        continue
+                    if self.gui_mode:
+                        self.preview_frame = cv2.hconcat([image, result])
+                    write_futures.append((path, pool.submit(self.write_image, path, result)))
+        return write_futures
+
+    def run(self):
+        start_time = time.time()
+        self.progress_total = 0
+        tbar = tqdm(total=len(self.image_paths), unit='image', position=0, file=sys.__stdout__,
+                    desc='Subtitle Removing')
+        # 每组图片数量，解码预读与编码等待都以组为单位，内存占用与组大小有关
+        chunk_size = self.batch_size * 8
+        chunks = [self.image_paths[i:i + chunk_size] for i in range(0, len(self.image_paths), chunk_size)]
+        try:
+            with ThreadPoolExecutor(max_workers=self.io_workers) as pool:
+                read_futures = [pool.submit(self.read_image, path) for path in chunks[0]] if chunks else []
+                pending_writes = []
+                for chunk_no, paths in enumerate(chunks):
+                    if self.abort_event.is_set():
+                        print("图片批处理已中止")
+                        break
+                    # 预读下一组图片，与当前组的检测、推理重叠
+                    next_read_futures = [pool.submit(self.read_image, path) for path in chunks[chunk_no + 1]] \
+                        if chunk_no + 1 < len(chunks) else []
+                    write_futures = self.process_chunk(paths, read_futures, pool, tbar)
+                    # 等待上一组的编码完成，当前组的编码在后台继续
+                    self.collect_writes(pending_writes, tbar)
+                    pending_writes, read_futures = write_futures, next_read_futures
+                if self.abort_event.is_set():
+                    for future in read_futures:
+                        future.cancel()
+                self.collect_writes(pending_writes, tbar)
+        finally:
+            tbar.close()
+            if self.lama_inpaint is not None:
+                self.lama_inpaint.release()
+                self.lama_inpaint = None
+        if self.abort_event.is_set():
+            print("处理已中止")
+            return
+        print(f"[Finished] {len(self.outputs)} images processed, {len(self.failures)} failed, "
+              f"time cost: {round(time.time() - start_time, 2)}s")
+        self.isFinished = True
+        self.progress_total = 100
 
 
 if __name__ == '__main__':
@@ -1092,7 +1637,10 @@ if __name__ == '__main__':
     # sub_area = (ymin, ymax, xmin, xmax)
     # 3. 新建字幕提取对象
     if is_video_or_image(video_path):
-        sd = SubtitleRemover(video_path, sub_area=None)
+        if config.SEGMENT_WORKERS > 1 and not is_image_file(video_path):
+            sd = SegmentedSubtitleRemover(video_path, sub_area=None)
+        else:
+            sd = SubtitleRemover(video_path, sub_area=None)
         sd.run()
     else:
         print(f'Invalid video path: {video_path}')
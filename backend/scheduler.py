@@ -0,0 +1,290 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+
+import torch
+
+from backend import config
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+@dataclass
+class JobSpec:
+    """
+    去字幕任务描述，可序列化保存到队列文件中，重启后恢复未完成的任务
+    """
+    video_path: str
+    # 字幕区域(ymin, ymax, xmin, xmax)
+    sub_area: tuple = None
+    # 传给SubtitleRemover的自定义参数
+    custom_config: dict = field(default_factory=dict)
+    # 优先级，数值越大越先处理，相同优先级按提交顺序处理
+    priority: int = 0
+    output_dir: str = None
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    submit_time: float = field(default_factory=time.time)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        if data.get('sub_area') is not None:
+            data['sub_area'] = tuple(data['sub_area'])
+        return cls(**data)
+
+
+class JobProgress:
+    """
+    单个任务的状态与进度，由工作线程更新，界面只读取
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.state = QUEUED
+        # 执行该任务的设备
+        self.device = None
+        # 中止事件，传递给SubtitleRemover
+        self.abort_event = threading.Event()
+        # 是否因调度器停止而被中止，这类任务重新排队并保存到队列文件中
+        self.interrupted = False
+        self.remover = None
+        self.output_path = None
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def job_id(self):
+        return self.spec.job_id
+
+    @property
+    def progress(self):
+        if self.state == FINISHED:
+            return 100
+        remover = self.remover
+        return remover.progress_total if remover is not None else 0
+
+    @property
+    def preview_frame(self):
+        remover = self.remover
+        return remover.preview_frame if remover is not None else None
+
+    @property
+    def is_done(self):
+        return self.state in (FINISHED, FAILED, CANCELLED)
+
+    @property
+    def elapsed(self):
+        if self.start_time is None:
+            return 0
+        return (self.end_time or time.time()) - self.start_time
+
+
+class JobScheduler:
+    """
+    去字幕任务调度器：按优先级排队，每个设备启动若干工作线程执行任务
+    同一进程内的任务通过模型注册表共享模型，每个任务拥有独立的JobConfig与进度对象
+    """
+
+    def __init__(self, devices=None, max_jobs_per_device=None, queue_file=None, gui_mode=True):
+        self.devices = self.get_devices(devices or config.SCHEDULER_DEVICES)
+        self.max_jobs_per_device = max(1, int(max_jobs_per_device or config.SCHEDULER_MAX_JOBS_PER_DEVICE))
+        self.queue_file = queue_file if queue_file is not None else config.SCHEDULER_QUEUE_FILE
+        # 是否生成预览图，命令行批处理不需要预览
+        self.gui_mode = gui_mode
+        # 优先队列，元素为(-优先级, 提交序号, 任务id)
+        self.heap = []
+        self.counter = itertools.count()
+        self.jobs = {}
+        # 保留的已结束任务数
+        self.job_retention = max(0, int(config.SCHEDULER_JOB_RETENTION))
+        self.condition = threading.Condition()
+        self.workers = []
+        self.stopped = False
+
+    @staticmethod
+    def get_devices(devices):
+        """
+        获取工作设备列表，未指定时每张GPU一个设备，没有GPU或使用DirectML时使用默认设备
+        """
+        if devices:
+            return list(devices)
+        if not config.USE_DML and torch.cuda.is_available():
+            return [f'cuda:{i}' for i in range(torch.cuda.device_count())]
+        return [config.device]
+
+    def start(self):
+        """
+        恢复队列文件中未完成的任务并启动工作线程
+        """
+        self.load_queue()
+        for device in self.devices:
+            for i in range(self.max_jobs_per_device):
+                worker = threading.Thread(target=self.worker_loop, args=(device,), daemon=True,
+                                          name=f'JobWorker-{device}-{i}')
+                worker.start()
+                self.workers.append(worker)
+        print(f'[JobScheduler] {len(self.workers)} workers on {[str(d) for d in self.devices]}')
+
+    def shutdown(self):
+        """
+        停止接收新任务并中止正在运行的任务，未完成的任务保留在队列文件中
+        """
+        with self.condition:
+            self.stopped = True
+            for job in self.jobs.values():
+                if job.state == RUNNING and not job.abort_event.is_set():
+                    job.interrupted = True
+                    job.abort_event.set()
+            self.condition.notify_all()
+
+    def submit(self, spec):
+        """
+        提交任务，返回任务进度对象
+        """
+        job = JobProgress(spec)
+        with self.condition:
+            self.jobs[spec.job_id] = job
+            heapq.heappush(self.heap, (-spec.priority, next(self.counter), spec.job_id))
+            self.save_queue()
+            self.condition.notify()
+        print(f'[JobScheduler] job {spec.job_id} queued: {spec.video_path}')
+        return job
+
+    def cancel(self, job_id):
+        """
+        取消任务：排队中的任务直接移出队列，运行中的任务通过abort_event中止
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.is_done:
+                return False
+            job.abort_event.set()
+            if job.state == QUEUED:
+                # 队列中的条目在出队时跳过
+                job.state = CANCELLED
+                job.end_time = time.time()
+                self.save_queue()
+                self.prune_jobs()
+            return True
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def queue_position(self, job_id):
+        """
+        任务在队列中的位置，从1开始；不在排队中时返回0
+        """
+        with self.condition:
+            queued = [item[2] for item in sorted(self.heap)
+                      if item[2] in self.jobs and self.jobs[item[2]].state == QUEUED]
+        return queued.index(job_id) + 1 if job_id in queued else 0
+
+    def next_job(self):
+        """
+        取出优先级最高的排队任务，队列为空时等待
+        """
+        with self.condition:
+            while not self.stopped:
+                while self.heap:
+                    job = self.jobs.get(heapq.heappop(self.heap)[2])
+                    if job is not None and job.state == QUEUED:
+                        job.state = RUNNING
+                        return job
+                self.condition.wait()
+            return None
+
+    def worker_loop(self, device):
+        while True:
+            job = self.next_job()
+            if job is None:
+                return
+            self.run_job(job, device)
+
+    def run_job(self, job, device):
+        from backend.main import SubtitleRemover
+        spec = job.spec
+        job.device = device
+        job.start_time = time.time()
+        print(f'[JobScheduler] job {spec.job_id} started on {device}')
+        try:
+            # 任务绑定到工作线程的设备上
+            custom_config = dict(spec.custom_config or {})
+            custom_config['device'] = device
+            job.remover = SubtitleRemover(spec.video_path, spec.sub_area, self.gui_mode, custom_config,
+                                          job.abort_event, output_dir=spec.output_dir)
+            job.remover.run()
+            if job.abort_event.is_set():
+                job.state = CANCELLED
+            elif job.remover.isFinished:
+                job.output_path = job.remover.video_out_name
+                job.state = FINISHED
+            else:
+                job.state = FAILED
+                job.error = 'subtitle remover did not finish'
+        except Exception as e:
+            job.state = CANCELLED if job.abort_event.is_set() else FAILED
+            job.error = str(e)
+            print(f'[JobScheduler] job {spec.job_id} failed: {e}')
+        finally:
+            job.end_time = time.time()
+            if job.interrupted and job.state == CANCELLED:
+                # 调度器停止导致的中止，放回队列，保存到队列文件后重启时重新处理
+                job.state = QUEUED
+            # 输出路径已记录，释放持有帧、mask与预览图的字幕去除器
+            job.remover = None
+            with self.condition:
+                self.save_queue()
+                self.prune_jobs()
+        print(f'[JobScheduler] job {spec.job_id} {job.state}, time cost: {round(job.elapsed, 2)}s')
+
+    def prune_jobs(self):
+        """
+        只保留最近结束的job_retention个任务，避免长时间运行时已结束的任务不断累积
+        """
+        done = sorted((job for job in self.jobs.values() if job.is_done), key=lambda job: job.end_time or 0)
+        for job in done[:max(0, len(done) - self.job_retention)]:
+            del self.jobs[job.job_id]
+
+    def save_queue(self):
+        """
+        将未完成（排队中/运行中）的任务保存到队列文件
+        """
+        if not self.queue_file:
+            return
+        pending = [job.spec.to_dict() for job in self.jobs.values() if job.state in (QUEUED, RUNNING)]
+        try:
+            with open(self.queue_file, mode='w', encoding='utf-8') as f:
+                json.dump(pending, f, ensure_ascii=False, indent=2, default=str)
+        except Exception as e:
+            print(f'[JobScheduler] fail to save job queue: {e}')
+
+    def load_queue(self):
+        """
+        从队列文件恢复上次未完成的任务
+        """
+        if not self.queue_file or not os.path.exists(self.queue_file):
+            return
+        try:
+            with open(self.queue_file, mode='r', encoding='utf-8') as f:
+                pending = json.load(f)
+        except Exception as e:
+            print(f'[JobScheduler] fail to load job queue: {e}')
+            return
+        for data in pending:
+            spec = JobSpec.from_dict(data)
+            if os.path.exists(spec.video_path):
+                self.submit(spec)
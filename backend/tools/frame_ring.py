@@ -0,0 +1,318 @@
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from backend.tools.video_tools import open_video_capture
+
+# 槽位状态：写入了一帧 / 流结束
+SLOT_FRAME = 1
+SLOT_EOF = -1
+
+
+class SharedFrameRing:
+    """
+    基于共享内存的帧环形缓冲区，单生产者单消费者
+    预先分配n_slots个HxWx3的uint8槽位，free/filled两个信号量协调读写，帧数据不经过pickle
+    """
+
+    def __init__(self, frame_shape, n_slots, ctx=None):
+        ctx = ctx or multiprocessing.get_context('spawn')
+        self.frame_shape = tuple(frame_shape)
+        self.n_slots = n_slots
+        self.slot_nbytes = int(np.prod(self.frame_shape))
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slot_nbytes * n_slots)
+        self.shm_name = self.shm.name
+        # 每个槽位的状态
+        self.slot_state = ctx.Array('q', n_slots, lock=False)
+        # 空闲槽位数与已写入槽位数
+        self.free = ctx.Semaphore(n_slots)
+        self.filled = ctx.Semaphore(0)
+        # 消费者提前结束时通知生产者停止
+        self.stop_event = ctx.Event()
+        self.owner = True
+        self.index = 0
+        self.slots = self.map_slots()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['shm'], state['slots']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # 子进程只挂载已有的共享内存
+        self.shm = shared_memory.SharedMemory(name=self.shm_name)
+        self.owner = False
+        self.slots = self.map_slots()
+
+    def map_slots(self):
+        buffer = np.ndarray((self.n_slots,) + self.frame_shape, dtype=np.uint8, buffer=self.shm.buf)
+        return [buffer[i] for i in range(self.n_slots)]
+
+    def acquire_free(self, peer=None):
+        """
+        等待空闲槽位，消费者已停止时返回False
+        :param peer: 消费者进程，进程已退出时同样返回False
+        """
+        while not self.free.acquire(timeout=0.1):
+            if self.stop_event.is_set() or (peer is not None and not peer.is_alive()):
+                return False
+        return not self.stop_event.is_set()
+
+    def put(self, frame, peer=None):
+        """
+        生产者：把帧写入下一个槽位，消费者已停止或已退出时返回False
+        """
+        if frame.shape != self.frame_shape:
+            raise ValueError(f'frame shape {frame.shape} does not match ring slot shape {self.frame_shape}')
+        if not self.acquire_free(peer):
+            return False
+        slot = self.index % self.n_slots
+        np.copyto(self.slots[slot], frame)
+        self.slot_state[slot] = SLOT_FRAME
+        self.index += 1
+        self.filled.release()
+        return True
+
+    def put_eof(self, peer=None):
+        if not self.acquire_free(peer):
+            return
+        slot = self.index % self.n_slots
+        self.slot_state[slot] = SLOT_EOF
+        self.index += 1
+        self.filled.release()
+
+    def get_view(self, timeout=None, peer=None):
+        """
+        消费者：取出下一个槽位的零拷贝视图，用完后必须调用release_slot归还；流结束时返回None
+        :param peer: 生产者进程，进程已退出且没有剩余的帧时抛出RuntimeError，而不是一直等待
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.filled.acquire(timeout=timeout if peer is None else 0.1):
+            if peer is None or (deadline is not None and time.time() > deadline):
+                raise TimeoutError('timeout waiting for frame')
+            if not peer.is_alive():
+                # 进程退出前写入的帧与结束标记仍然可以读取
+                if self.filled.acquire(False):
+                    break
+                raise RuntimeError(f'producer process exited with code {peer.exitcode}')
+        slot = self.index % self.n_slots
+        self.index += 1
+        if self.slot_state[slot] == SLOT_EOF:
+            self.free.release()
+            return None
+        return self.slots[slot]
+
+    def release_slot(self):
+        self.free.release()
+
+    def close(self):
+        self.slots = []
+        try:
+            if self.owner:
+                self.shm.unlink()
+            self.shm.close()
+        except (FileNotFoundError, BufferError):
+            # 仍有视图引用共享内存时无法close，由进程退出时回收
+            pass
+
+
+def _decode_worker(ring, video_path, frame_range):
+    video_cap = None
+    try:
+        video_cap = open_video_capture(video_path, frame_range)
+        while not ring.stop_event.is_set():
+            ret, frame = video_cap.read()
+            if not ret:
+                break
+            if not ring.put(frame):
+                break
+    finally:
+        # 出错时同样写入结束标记，父进程读到结束标记后通过退出码判断是否出错
+        ring.put_eof()
+        if video_cap is not None:
+            video_cap.release()
+        ring.close()
+
+
+def _encode_worker(ring, open_writer, video_out_path, fourcc, fps, size):
+    video_writer = None
+    try:
+        video_writer = open_writer(video_out_path, fourcc, fps, size)
+        while True:
+            frame = ring.get_view()
+            if frame is None:
+                break
+            video_writer.write(frame)
+            ring.release_slot()
+    finally:
+        # 通知父进程停止写入，出错时父进程不会一直等待空闲槽位
+        ring.stop_event.set()
+        if video_writer is not None:
+            video_writer.release()
+        ring.close()
+
+
+class RingVideoCapture:
+    """
+    在独立进程中解码视频，通过共享内存环形缓冲区把帧交给当前进程，接口与cv2.VideoCapture一致
+    """
+
+    def __init__(self, video_path, frame_range=None, n_slots=16):
+        # 先读取视频属性，解码进程启动前就能确定槽位大小
+        video_cap = open_video_capture(video_path, frame_range)
+        self.props = {prop_id: video_cap.get(prop_id) for prop_id in
+                      [cv2.CAP_PROP_FRAME_COUNT, cv2.CAP_PROP_FPS, cv2.CAP_PROP_FRAME_WIDTH,
+                       cv2.CAP_PROP_FRAME_HEIGHT]}
+        self.opened = video_cap.isOpened()
+        video_cap.release()
+        frame_shape = (int(self.props[cv2.CAP_PROP_FRAME_HEIGHT]), int(self.props[cv2.CAP_PROP_FRAME_WIDTH]), 3)
+        self.ring = SharedFrameRing(frame_shape, n_slots)
+        self.holding = False
+        self.finished = False
+        self.process = multiprocessing.get_context('spawn').Process(
+            target=_decode_worker, args=(self.ring, video_path, frame_range), daemon=True)
+        self.process.start()
+
+    def isOpened(self):
+        return self.opened and not self.finished
+
+    def get(self, prop_id):
+        return self.props.get(prop_id, 0)
+
+    def read_view(self):
+        """
+        读取下一帧的零拷贝视图，视图在下一次读取前有效
+        """
+        if self.holding:
+            self.ring.release_slot()
+            self.holding = False
+        if self.finished:
+            return False, None
+        frame = self.ring.get_view(peer=self.process)
+        if frame is None:
+            self.finished = True
+            # 解码进程出错时也会写入结束标记，需要检查退出码，避免把截断的视频当作正常结束
+            self.process.join(timeout=5)
+            if self.process.exitcode:
+                raise RuntimeError(f'video decoder process exited with code {self.process.exitcode}')
+            return False, None
+        self.holding = True
+        return True, frame
+
+    def read(self):
+        """
+        读取下一帧的副本，与cv2.VideoCapture.read一样调用方可以长期持有返回的帧
+        """
+        ret, frame = self.read_view()
+        if not ret:
+            return ret, frame
+        frame = frame.copy()
+        self.ring.release_slot()
+        self.holding = False
+        return ret, frame
+
+    def release(self):
+        if self.ring is None:
+            return
+        self.ring.stop_event.set()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.ring.close()
+        self.ring = None
+        self.finished = True
+
+
+class RingVideoWriter:
+    """
+    在独立进程中编码视频，帧写入共享内存环形缓冲区后立即返回，接口与cv2.VideoWriter一致
+    open_writer为编码进程中创建视频写对象的函数，参数与cv2.VideoWriter相同，必须可以pickle
+    """
+
+    def __init__(self, video_out_path, fourcc, fps, size, n_slots=16, open_writer=cv2.VideoWriter):
+        width, height = size
+        self.ring = SharedFrameRing((height, width, 3), n_slots)
+        self.process = multiprocessing.get_context('spawn').Process(
+            target=_encode_worker, args=(self.ring, open_writer, video_out_path, fourcc, fps, size),
+            daemon=True)
+        self.process.start()
+
+    def write(self, frame):
+        if self.ring is None:
+            return
+        if not self.ring.put(frame, self.process):
+            self.process.join(timeout=5)
+            raise RuntimeError(f'video encoder process exited unexpectedly with code {self.process.exitcode}')
+
+    def release(self):
+        """
+        写入结束标记并等待编码进程写完所有帧
+        """
+        if self.ring is None:
+            return
+        self.ring.put_eof(self.process)
+        self.process.join()
+        self.ring.stop_event.set()
+        self.ring.close()
+        self.ring = None
+        if self.process.exitcode != 0:
+            raise RuntimeError(f'video encoder process exited with code {self.process.exitcode}')
+
+
+def _benchmark_once(video_path, video_out_path, n_slots, work_seconds):
+    """
+    读取并重新编码整个视频，work_seconds模拟每帧的推理耗时
+    """
+    start = time.time()
+    if n_slots > 0:
+        video_cap = RingVideoCapture(video_path, n_slots=n_slots)
+    else:
+        video_cap = cv2.VideoCapture(video_path)
+    size = (int(video_cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video_cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    fps = video_cap.get(cv2.CAP_PROP_FPS)
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    if n_slots > 0:
+        video_writer = RingVideoWriter(video_out_path, fourcc, fps, size, n_slots)
+    else:
+        video_writer = cv2.VideoWriter(video_out_path, fourcc, fps, size)
+    frame_count = 0
+    while True:
+        ret, frame = video_cap.read()
+        if not ret:
+            break
+        if work_seconds:
+            time.sleep(work_seconds)
+        video_writer.write(frame)
+        frame_count += 1
+    video_cap.release()
+    video_writer.release()
+    return frame_count, time.time() - start
+
+
+def benchmark(sizes=((1920, 1080), (3840, 2160)), frame_count=240, n_slots=16, work_seconds=0.01):
+    """
+    对比单进程读写与共享内存环形缓冲区（解码/编码各一个进程）的吞吐
+    """
+    import os
+    import tempfile
+    for width, height in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            video_path = os.path.join(tmp_dir, 'input.mp4')
+            writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 25, (width, height))
+            rng = np.random.default_rng(0)
+            base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+            for i in range(frame_count):
+                writer.write(np.roll(base, i * 8, axis=1))
+            writer.release()
+            for name, slots in [('single process', 0), (f'ring x{n_slots}', n_slots)]:
+                count, cost = _benchmark_once(video_path, os.path.join(tmp_dir, 'out.mp4'), slots, work_seconds)
+                print(f'{width}x{height} {name}: {count} frames in {cost:.2f}s, {count / cost:.1f} fps')
+
+
+if __name__ == '__main__':
+    multiprocessing.set_start_method('spawn')
+    benchmark()
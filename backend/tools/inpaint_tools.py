@@ -1,4 +1,6 @@
 import multiprocessing
+import threading
+from collections import OrderedDict
 import cv2
 import numpy as np
 
@@ -31,6 +33,27 @@ def batch_generator(data, max_batch_size):
         yield data[last_batch_start:]
 
 
+def read_frame_batches(video_cap, first_frame, n_frames, max_batch_size):
+    """
+    从视频中流式读取n_frames帧并按batch_generator相同的方式分批产出，内存中最多只保留一批帧
+    :param first_frame 已经读取的区间第一帧
+    """
+    pending = [first_frame]
+    # 对帧号区间分批，只计算每批大小，不需要预先读取所有帧
+    for batch_range in batch_generator(range(n_frames), max_batch_size):
+        batch, pending = pending, []
+        while len(batch) < len(batch_range):
+            ret, frame = video_cap.read()
+            if not ret:
+                break
+            batch.append(frame)
+        if batch:
+            yield batch
+        if len(batch) < len(batch_range):
+            # 视频提前结束
+            return
+
+
 def inference_task(batch_data):
     inpainted_frame_dict = dict()
     for data in batch_data:
@@ -72,25 +95,86 @@ def inpaint_with_multiple_masks(censored_img, mask_list):
     return inpainted_frame
 
 
-def create_mask(size, coords_list):
+class MaskCache:
+    """
+    按字节数限制容量的mask LRU缓存，缓存的mask为只读数组，由所有调用方共享
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.masks = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            mask = self.masks.get(key)
+            if mask is None:
+                self.misses += 1
+                return None
+            self.masks.move_to_end(key)
+            self.hits += 1
+            return mask
+
+    def put(self, key, mask):
+        with self.lock:
+            if key in self.masks or mask.nbytes > self.max_bytes:
+                return
+            self.masks[key] = mask
+            self.current_bytes += mask.nbytes
+            # 超出容量时淘汰最久未使用的mask
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self.masks.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.masks.clear()
+            self.current_bytes = 0
+
+
+mask_cache = MaskCache(config.MASK_CACHE_MAX_BYTES)
+
+
+def draw_mask(size, coords_list, deviation_pixel):
     mask = np.zeros(size, dtype="uint8")
     if coords_list:
         for coords in coords_list:
             xmin, xmax, ymin, ymax = coords
             # 为了避免框过小，放大10个像素
-            x1 = xmin - config.SUBTITLE_AREA_DEVIATION_PIXEL
+            x1 = xmin - deviation_pixel
             if x1 < 0:
                 x1 = 0
-            y1 = ymin - config.SUBTITLE_AREA_DEVIATION_PIXEL
+            y1 = ymin - deviation_pixel
             if y1 < 0:
                 y1 = 0
-            x2 = xmax + config.SUBTITLE_AREA_DEVIATION_PIXEL
-            y2 = ymax + config.SUBTITLE_AREA_DEVIATION_PIXEL
+            x2 = xmax + deviation_pixel
+            y2 = ymax + deviation_pixel
             cv2.rectangle(mask, (x1, y1),
                           (x2, y2), (255, 255, 255), thickness=-1)
     return mask
 
 
+def create_mask(size, coords_list, job_config=None):
+    """
+    根据文本框坐标生成mask，相同尺寸、文本框集合与像素偏差的mask只生成一次
+    注意：返回的mask为只读的共享数组，需要修改时请先copy
+    """
+    if job_config is not None:
+        deviation_pixel = job_config.subtitle_area_deviation_pixel
+    else:
+        deviation_pixel = config.SUBTITLE_AREA_DEVIATION_PIXEL
+    key = (tuple(size), frozenset(tuple(coords) for coords in coords_list or []), deviation_pixel)
+    mask = mask_cache.get(key)
+    if mask is None:
+        mask = draw_mask(size, coords_list, deviation_pixel)
+        mask.flags.writeable = False
+        mask_cache.put(key, mask)
+    return mask
+
+
 def inpaint_video(video_path, sub_list):
     index = 0
     frame_to_inpaint_list = []
@@ -0,0 +1,77 @@
+def split_uniform(frame_count, chunk_length):
+    """
+    将[1, frame_count]均匀切分为长度不超过chunk_length的区间，帧号从1开始且包含两端
+    """
+    chunk_length = max(1, int(chunk_length))
+    return [(start, min(start + chunk_length - 1, frame_count)) for start in range(1, frame_count + 1, chunk_length)]
+
+
+def is_safe_cut(frame_no, protected_intervals):
+    """
+    判断以frame_no作为新分段起始帧是否安全，即切点不能落在受保护区间（字幕区间）内部
+    """
+    for start, end in protected_intervals:
+        if start < frame_no <= end:
+            return False
+    return True
+
+
+def plan_segments(frame_count, target_length, cut_points=None, protected_intervals=None):
+    """
+    根据候选切点（场景切换帧或关键帧）将视频划分为长度接近target_length的分段
+    :param frame_count 视频总帧数
+    :param target_length 目标分段帧数
+    :param cut_points 候选切点帧号列表，切点为新分段的起始帧
+    :param protected_intervals 不允许被切开的区间列表，对STTN/ProPainter为字幕区间
+    :return list 分段列表[(起始帧号, 结束帧号)]
+    """
+    target_length = max(1, int(target_length))
+    protected_intervals = sorted(protected_intervals or [])
+    safe_points = sorted(p for p in set(cut_points or [])
+                         if 1 < p <= frame_count and is_safe_cut(p, protected_intervals))
+    segments = []
+    start = 1
+    # 剩余帧数不足1.5个目标长度时不再切分，避免产生过短的尾段
+    while frame_count - start + 1 > target_length * 3 // 2:
+        ideal = start + target_length
+        low, high = start + target_length // 2, start + target_length * 3 // 2
+        candidates = [p for p in safe_points if low <= p <= high]
+        if candidates:
+            # 优先选择离目标长度最近的场景切换点/关键帧
+            cut = min(candidates, key=lambda p: abs(p - ideal))
+        else:
+            # 附近没有可用切点时按目标长度切分，若落在字幕区间内则顺延到区间结束之后
+            cut = ideal
+            for p_start, p_end in protected_intervals:
+                if p_start < cut <= p_end:
+                    cut = p_end + 1
+            if cut > frame_count:
+                break
+        segments.append((start, cut - 1))
+        start = cut
+    if start <= frame_count:
+        segments.append((start, frame_count))
+    return segments
+
+
+def slice_sub_list(sub_list, frame_range):
+    """
+    从全局字幕帧号字典中取出分段内的部分，并将帧号转换为分段内从1开始的帧号
+    """
+    start, end = frame_range
+    return {frame_no - start + 1: boxes for frame_no, boxes in sub_list.items() if start <= frame_no <= end}
+
+
+def slice_points(points, frame_range):
+    """
+    取出分段内部的切换点（不含分段起始帧），并转换为分段内的帧号
+    """
+    start, end = frame_range
+    return [p - start + 1 for p in points if start < p <= end]
+
+
+def longest_first(segments):
+    """
+    按分段长度从长到短排序，用于进程池调度的负载均衡
+    """
+    return sorted(segments, key=lambda s: s[1] - s[0], reverse=True)
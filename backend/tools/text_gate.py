@@ -0,0 +1,148 @@
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from backend import config
+
+
+class TextPresenceGate:
+    """
+    跳过字幕检测时判断字幕区域内是否有文字的轻量级逐帧判定，代价远低于DB文本检测
+    字幕区域缩放到固定高度后做白顶帽/黑顶帽运算，只保留比结构元素窄的亮/暗细节即文字笔画，
+    大块的亮暗区域及其边缘没有响应；笔画像素占比超过阈值时认为有文字
+    """
+
+    def __init__(self, roi, threshold=None, contrast=None, band_height=48, stroke_width=7):
+        """
+        :param roi: 字幕区域(ymin, ymax, xmin, xmax)
+        :param threshold: 笔画像素占比阈值
+        :param contrast: 笔画与周围背景的最小亮度差
+        :param band_height: 判定前字幕区域缩放到的高度
+        :param stroke_width: 结构元素大小，宽于该值（缩放后）的亮暗区域不算作笔画
+        """
+        self.roi = roi
+        self.threshold = config.STTN_TEXT_GATE_THRESHOLD if threshold is None else threshold
+        self.contrast = config.STTN_TEXT_GATE_CONTRAST if contrast is None else contrast
+        self.band_height = band_height
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (stroke_width, stroke_width))
+        # 已判定的帧数与判定为有文字的帧数
+        self.checked = 0
+        self.hits = 0
+        self.seconds = 0
+
+    def score(self, frame):
+        """
+        :return 字幕区域内笔画像素的占比
+        """
+        ymin, ymax, xmin, xmax = self.roi
+        band = cv2.cvtColor(frame[ymin:ymax, xmin:xmax], cv2.COLOR_BGR2GRAY)
+        height, width = band.shape
+        if height == 0 or width == 0:
+            return 0
+        band = cv2.resize(band, (max(1, width * self.band_height // height), self.band_height),
+                          interpolation=cv2.INTER_AREA)
+        # 亮字取白顶帽，暗字（或亮字的黑色描边）取黑顶帽
+        strokes = np.maximum(cv2.morphologyEx(band, cv2.MORPH_TOPHAT, self.kernel),
+                             cv2.morphologyEx(band, cv2.MORPH_BLACKHAT, self.kernel))
+        return np.count_nonzero(strokes > self.contrast) / strokes.size
+
+    def __call__(self, frame):
+        start = time.time()
+        has_text = self.score(frame) > self.threshold
+        self.seconds += time.time() - start
+        self.checked += 1
+        self.hits += has_text
+        return has_text
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.checked if self.checked else 0
+
+    def report(self):
+        cost = self.seconds / self.checked * 1000 if self.checked else 0
+        return (f'[TextGate] {self.hits}/{self.checked} frames contain text (hit rate {self.hit_rate:.1%}), '
+                f'{cost:.2f} ms/frame')
+
+
+def split_text_runs(frames, gate, padding, max_length):
+    """
+    按文字判定把帧序列划分为需要补全的分块与原样输出的帧，输出顺序与输入相同
+    有文字的连续帧前后各扩展padding帧组成分块，间隔不超过padding的文字帧合并到同一分块中，
+    分块最多max_length帧
+    :return 产出(是否需要补全, 帧列表)的生成器
+    """
+    max_length = max(1, max_length)
+    # 最近的无文字帧，文字出现时作为分块开头的扩展帧
+    pending = deque()
+    run = []
+    in_run = False
+    # 分块中最后一个文字帧之后已经加入的帧数
+    tail = 0
+    for frame in frames:
+        if gate(frame):
+            if not in_run:
+                run = list(pending)
+                pending.clear()
+                in_run = True
+            run.append(frame)
+            tail = 0
+        elif in_run and tail < padding:
+            run.append(frame)
+            tail += 1
+        else:
+            if in_run:
+                if run:
+                    yield True, run
+                run = []
+                in_run = False
+            pending.append(frame)
+            if len(pending) > padding:
+                yield False, [pending.popleft()]
+        while len(run) >= max_length:
+            yield True, run[:max_length]
+            run = run[max_length:]
+    if run:
+        yield True, run
+    if pending:
+        yield False, list(pending)
+
+
+def make_gate_clip(frame_count, size=(1280, 720), text_every=50, text_length=30):
+    """
+    合成的测试视频：移动的渐变与色块背景，每text_every帧中前text_length帧带有底部字幕
+    :return (帧列表, 每帧是否有字幕, 字幕区域)
+    """
+    width, height = size
+    yy, xx = np.mgrid[0:height, 0:width]
+    roi = (height - 120, height - 20, width // 8, width - width // 8)
+    frames, labels = [], []
+    for i in range(frame_count):
+        frame = np.stack([(xx // 3 + i * 3) % 256, (yy // 2 + i) % 256, (xx + yy) // 6 % 256],
+                         axis=-1).astype(np.uint8)
+        # 穿过字幕区域的大色块，不应被判定为文字
+        block_x = (i * 13) % width
+        cv2.rectangle(frame, (block_x, height - 140), (block_x + 300, height - 10), (30, 200, 90), -1)
+        has_text = i % text_every < text_length
+        if has_text:
+            cv2.putText(frame, 'Subtitle line %d' % (i // text_every), (width // 4, height - 50),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 3)
+        frames.append(frame)
+        labels.append(has_text)
+    return frames, labels, roi
+
+
+if __name__ == '__main__':
+    # 在合成视频上统计判定的准确率与耗时
+    _frames, _labels, _roi = make_gate_clip(300)
+    _gate = TextPresenceGate(_roi)
+    _predictions = [_gate(frame) for frame in _frames]
+    _missed = sum(label and not prediction for label, prediction in zip(_labels, _predictions))
+    _false = sum(prediction and not label for label, prediction in zip(_labels, _predictions))
+    print(_gate.report())
+    print(f'missed {_missed}/{sum(_labels)} text frames, {_false}/{len(_labels) - sum(_labels)} false positives')
+    _gate = TextPresenceGate(_roi)
+    _runs = list(split_text_runs(_frames, _gate, config.STTN_TEXT_GATE_PADDING, config.STTN_MAX_LOAD_NUM))
+    print(f'{sum(len(f) for t, f in _runs if t)}/{len(_frames)} frames inpainted in '
+          f'{sum(1 for t, _ in _runs if t)} chunks')
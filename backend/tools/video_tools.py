@@ -0,0 +1,304 @@
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from backend import config
+
+# 中间视频格式：(文件后缀, 是否无损)
+INTERMEDIATE_FORMATS = {
+    'mp4v': ('.mp4', False),
+    'ffv1': ('.mkv', True),
+    'y4m': ('.y4m', True),
+    # 帧直接通过管道交给ffmpeg编码为最终格式
+    'pipe': ('.mp4', False),
+}
+# FFV1编码后每个像素平均占用的字节数（yuv420p原始数据为1.5字节），用于估算中间文件大小
+FFV1_BYTES_PER_PIXEL = 0.75
+# 分段定位时先退回的帧数，从更早的位置逐帧解码到起始帧
+SEEK_PREROLL_FRAMES = 30
+
+
+class FrameRangeCapture:
+    """
+    只读取视频指定帧区间的VideoCapture包装类
+    frame_range为(起始帧号, 结束帧号)，帧号从1开始且包含两端，与字幕帧号字典的约定一致
+    """
+
+    def __init__(self, video_path, frame_range=None):
+        self.cap = cv2.VideoCapture(video_path)
+        total = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) + 0.5)
+        if frame_range is None:
+            frame_range = (1, total)
+        start, end = frame_range
+        self.start = max(1, int(start))
+        self.end = min(int(end), total) if total > 0 else int(end)
+        self.length = max(0, self.end - self.start + 1)
+        self.read_count = 0
+        if self.start > 1 and self.cap.isOpened():
+            self.seek(self.start - 1)
+
+    def seek(self, frame_no):
+        """
+        定位到视频的第frame_no帧（从0开始），下一次read返回该帧
+        直接按帧号set在部分编码/封装格式下并不精确，这里先定位到更早的位置，再逐帧grab到目标帧，
+        解码位置与目标帧不一致时抛出RuntimeError，使该分段失败，而不是静默输出错位的帧
+        """
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, max(0, frame_no - SEEK_PREROLL_FRAMES))
+        position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES) + 0.5)
+        while position < frame_no:
+            if not self.cap.grab():
+                break
+            position = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES) + 0.5)
+        if position != frame_no:
+            raise RuntimeError(f'failed to seek to frame {frame_no + 1}, decoder is at frame {position + 1}')
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        if self.read_count >= self.length:
+            return False, None
+        ret, frame = self.cap.read()
+        if ret:
+            self.read_count += 1
+        return ret, frame
+
+    def get(self, prop_id):
+        if prop_id == cv2.CAP_PROP_FRAME_COUNT:
+            return self.length
+        if prop_id == cv2.CAP_PROP_POS_FRAMES:
+            return self.read_count
+        return self.cap.get(prop_id)
+
+    def set(self, prop_id, value):
+        if prop_id == cv2.CAP_PROP_POS_FRAMES:
+            self.read_count = int(value)
+            self.seek(self.start - 1 + int(value))
+            return True
+        return self.cap.set(prop_id, value)
+
+    def release(self):
+        self.cap.release()
+
+
+def open_video_capture(video_path, frame_range=None):
+    """
+    打开视频，frame_range为None时直接返回cv2.VideoCapture
+    """
+    if frame_range is None:
+        return cv2.VideoCapture(video_path)
+    return FrameRangeCapture(video_path, frame_range)
+
+
+def prefetch_frames(video_cap, queue_size=16):
+    """
+    在后台线程中读取视频帧，解码与调用方的推理重叠进行
+    :return 按顺序产出帧的生成器，生成器关闭时停止读取线程
+    """
+    frame_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+
+    def put(item):
+        while not stop_event.is_set():
+            try:
+                frame_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def reader():
+        try:
+            while not stop_event.is_set():
+                ret, frame = video_cap.read()
+                if not ret:
+                    break
+                put(frame)
+            put(None)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = frame_queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop_event.set()
+        thread.join()
+
+
+def get_keyframe_frame_no(video_path):
+    """
+    获取关键帧的帧号（从1开始），只解封装不解码
+    """
+    import av
+    keyframe_no_list = []
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        fps = float(stream.average_rate) if stream.average_rate else 0
+        start_pts = stream.start_time or 0
+        if fps <= 0:
+            return keyframe_no_list
+        for packet in container.demux(stream):
+            if packet.pts is None or not packet.is_keyframe:
+                continue
+            frame_no = int(round(float((packet.pts - start_pts) * stream.time_base) * fps)) + 1
+            if frame_no > 1:
+                keyframe_no_list.append(frame_no)
+    return sorted(set(keyframe_no_list))
+
+
+class FFmpegVideoWriter:
+    """
+    通过标准输入把BGR帧交给ffmpeg编码，接口与cv2.VideoWriter一致
+    """
+
+    def __init__(self, video_out_path, fps, size, output_args):
+        width, height = size
+        command = [config.FFMPEG_PATH, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-']
+        command += list(output_args) + [video_out_path]
+        # stderr写入临时文件而不是管道，错误信息很多时也不会因管道写满阻塞ffmpeg和write
+        self.stderr_file = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self.stderr_file)
+        self.released = False
+
+    def isOpened(self):
+        return self.process.poll() is None
+
+    def write(self, frame):
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except (BrokenPipeError, OSError):
+            self.process.wait()
+            raise RuntimeError(f'ffmpeg exited unexpectedly: {self.read_stderr()}')
+
+    def read_stderr(self):
+        self.stderr_file.seek(0)
+        return self.stderr_file.read().decode(errors='ignore')
+
+    def release(self):
+        """
+        关闭管道并等待ffmpeg写完文件
+        """
+        if self.released:
+            return
+        self.released = True
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.wait()
+        error = self.read_stderr()
+        self.stderr_file.close()
+        if self.process.returncode != 0:
+            raise RuntimeError(f'ffmpeg failed with code {self.process.returncode}: {error}')
+
+
+def get_final_video_args(use_h264):
+    """
+    最终输出视频的编码参数，与原先cv2 mp4v + 可选libx264的输出保持一致
+    """
+    if use_h264:
+        return ['-vcodec', 'libx264', '-pix_fmt', 'yuv420p']
+    return ['-vcodec', 'mpeg4', '-q:v', '2', '-pix_fmt', 'yuv420p']
+
+
+def get_merge_video_args(video_format, use_h264):
+    """
+    合并音频时视频流的编码参数：已经是最终格式的直接复制，无损中间格式只编码一次
+    """
+    if video_format == 'pipe' or (video_format == 'mp4v' and not use_h264):
+        return ['-vcodec', 'copy']
+    return get_final_video_args(use_h264)
+
+
+def open_video_writer(video_out_path, video_format, fps, size, use_h264=True):
+    """
+    按中间视频格式创建视频写对象
+    """
+    if video_format == 'mp4v':
+        return cv2.VideoWriter(video_out_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    if video_format == 'ffv1':
+        # 最终输出为yuv420p，提前转换不会增加损失，文件大小减半
+        output_args = ['-vcodec', 'ffv1', '-level', '3', '-pix_fmt', 'yuv420p']
+    elif video_format == 'y4m':
+        output_args = ['-pix_fmt', 'yuv420p', '-f', 'yuv4mpegpipe']
+    elif video_format == 'pipe':
+        output_args = get_final_video_args(use_h264)
+    else:
+        raise ValueError(f'unknown intermediate format: {video_format}')
+    return FFmpegVideoWriter(video_out_path, fps, size, output_args)
+
+
+def resolve_intermediate_format(video_format, frame_count, size, budget_mb=None):
+    """
+    确定任务使用的中间视频格式，'auto'时按磁盘预算选择：FFV1中间文件放得下时使用'ffv1'，否则使用'pipe'
+    """
+    video_format = str(video_format).strip().lower()
+    if video_format != 'auto':
+        if video_format not in INTERMEDIATE_FORMATS:
+            raise ValueError(f'unknown intermediate format: {video_format}')
+        return video_format
+    budget_mb = config.INTERMEDIATE_DISK_BUDGET_MB if budget_mb is None else budget_mb
+    if budget_mb > 0:
+        budget = budget_mb * 1024 * 1024
+    else:
+        budget = shutil.disk_usage(tempfile.gettempdir()).free * 0.8
+    estimated = frame_count * size[0] * size[1] * FFV1_BYTES_PER_PIXEL
+    return 'ffv1' if estimated <= budget else 'pipe'
+
+
+def _cpu_time():
+    # 当前进程与已结束子进程（ffmpeg）的CPU时间之和
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def benchmark(size=(1920, 1080), frame_count=300, use_h264=True):
+    """
+    对比各中间格式写入与最终编码的CPU时间、耗时和中间文件大小
+    """
+    width, height = size
+    rng = np.random.default_rng(0)
+    # 带噪声的渐变画面，接近真实视频的压缩难度
+    base = np.tile(np.linspace(0, 255, width, dtype=np.uint8)[None, :, None], (height, 1, 3))
+    base = cv2.add(base, rng.integers(0, 16, (height, width, 3), dtype=np.uint8))
+    frames = [np.roll(base, i * 4, axis=1) for i in range(16)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for video_format, (suffix, _) in INTERMEDIATE_FORMATS.items():
+            temp_path = os.path.join(tmp_dir, f'intermediate_{video_format}{suffix}')
+            cpu_start, wall_start = _cpu_time(), time.time()
+            writer = open_video_writer(temp_path, video_format, 25, size, use_h264)
+            for i in range(frame_count):
+                writer.write(frames[i % len(frames)])
+            writer.release()
+            write_cpu, write_wall = _cpu_time() - cpu_start, time.time() - wall_start
+            temp_size = os.path.getsize(temp_path)
+            cpu_start, wall_start = _cpu_time(), time.time()
+            out_path = os.path.join(tmp_dir, f'out_{video_format}.mp4')
+            subprocess.check_output([config.FFMPEG_PATH, '-y', '-loglevel', 'error', '-i', temp_path]
+                                    + get_merge_video_args(video_format, use_h264) + [out_path],
+                                    stdin=open(os.devnull))
+            merge_cpu, merge_wall = _cpu_time() - cpu_start, time.time() - wall_start
+            print(f'{width}x{height} {video_format}: write {write_wall:.2f}s (cpu {write_cpu:.2f}s), '
+                  f'merge {merge_wall:.2f}s (cpu {merge_cpu:.2f}s), '
+                  f'intermediate {temp_size / 1024 / 1024:.1f}MB')
+            os.remove(temp_path)
+            os.remove(out_path)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+@desc: 字幕去除器命令行批处理入口，适用于服务器上批量处理目录中的视频/图片
+
+示例:
+    python cli.py input_videos/ "more/*.mp4" --sub-area 800 1000 0 1920 --mode sttn --workers 2 \
+        --output-dir output_videos --summary summary.json
+"""
+import argparse
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from dataclasses import fields
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from backend import config
+from backend.job_config import JobConfig
+from backend.main import SubtitleRemover, ImageBatchRemover
+from backend.scheduler import JobScheduler, JobSpec, RUNNING, FINISHED
+from backend.tools.common_tools import is_video_or_image, is_image_file
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='批量去除视频/图片中的硬字幕')
+    parser.add_argument('inputs', nargs='+', help='视频/图片文件、目录或通配符')
+    parser.add_argument('--sub-area', nargs=4, type=int, metavar=('YMIN', 'YMAX', 'XMIN', 'XMAX'),
+                        help='字幕区域，不指定时全屏处理')
+    parser.add_argument('--mode', choices=[mode.name.lower() for mode in config.InpaintMode],
+                        help='inpaint算法，默认使用config.py中的设置')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', dest='params',
+                        help='其他算法参数，例如 --set sttn_neighbor_stride=10，可重复指定')
+    parser.add_argument('--output-dir', help='输出目录，默认与输入文件相同')
+    parser.add_argument('--workers', type=int, default=0, help='并行处理的任务数，默认每个设备一个')
+    parser.add_argument('--devices', nargs='+', help='工作设备，例如 cuda:0 cuda:1，按任务数轮流分配')
+    parser.add_argument('-r', '--recursive', action='store_true', help='递归处理子目录')
+    parser.add_argument('--force', action='store_true', help='重新处理输出已是最新的文件')
+    parser.add_argument('--summary', help='处理结果汇总JSON的保存路径，不指定时输出到标准输出（处理日志输出到标准错误）')
+    return parser.parse_args(argv)
+
+
+def collect_inputs(patterns, recursive=False):
+    """
+    展开目录与通配符，返回去重后的视频/图片文件列表，跳过已生成的去字幕文件
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            if recursive:
+                candidates = [os.path.join(root, f) for root, _, files in os.walk(pattern) for f in sorted(files)]
+            else:
+                candidates = [os.path.join(pattern, f) for f in sorted(os.listdir(pattern))]
+        elif os.path.isfile(pattern):
+            candidates = [pattern]
+        else:
+            candidates = sorted(glob.glob(pattern, recursive=recursive))
+        for path in candidates:
+            if not os.path.isfile(path) or not is_video_or_image(path):
+                continue
+            if os.path.splitext(os.path.basename(path))[0].endswith('_no_sub') or \
+                    os.path.basename(os.path.dirname(path)) == 'no_sub':
+                continue
+            path = os.path.abspath(path)
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def is_up_to_date(video_path, output_dir=None):
+    """
+    输出文件存在且不早于输入文件时认为已是最新
+    """
+    output_path = SubtitleRemover.get_output_path(video_path, output_dir)
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(video_path)
+
+
+def build_custom_config(args):
+    """
+    按JobConfig各配置项的类型解析参数，未知的配置项或无法解析的值直接报错，而不是在任务中静默使用默认值
+    """
+    field_names = {f.name for f in fields(JobConfig)}
+    items = [('mode', args.mode)] if args.mode else []
+    for item in args.params:
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f'invalid parameter "{item}", expected KEY=VALUE')
+        items.append((key.strip().lower(), value.strip()))
+    custom_config = {}
+    for key, value in items:
+        if key not in field_names:
+            raise ValueError(f'unknown parameter "{key}"')
+        try:
+            custom_config[key] = JobConfig.parse_value(key, value)
+        except (ValueError, KeyError) as e:
+            raise ValueError(f'invalid value for {key}: "{value}" ({e})')
+    return custom_config
+
+
+@contextlib.contextmanager
+def stdout_to_stderr():
+    """
+    处理期间把标准输出重定向到标准错误，标准输出只留给最后的汇总JSON
+    在文件描述符层面重定向，tqdm写入的sys.__stdout__、子进程与ffmpeg的输出同样会被重定向
+    """
+    sys.stdout.flush()
+    saved_fd = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.__stdout__.flush()
+        os.dup2(saved_fd, 1)
+        os.close(saved_fd)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        custom_config = build_custom_config(args)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    video_paths = collect_inputs(args.inputs, args.recursive)
+    if not video_paths:
+        print('No video or image found', file=sys.stderr)
+        return 2
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    # 处理日志输出到标准错误，标准输出只输出汇总JSON
+    with stdout_to_stderr():
+        # 每个任务槽位绑定一个设备，同一进程内的任务共享检测与inpaint模型
+        devices = JobScheduler.get_devices(args.devices)
+        workers = args.workers if args.workers > 0 else len(devices)
+        # 命令行任务不保存队列文件，也不生成预览图
+        scheduler = JobScheduler(devices=[devices[i % len(devices)] for i in range(workers)], max_jobs_per_device=1,
+                                 queue_file='', gui_mode=False)
+
+        results = []
+        jobs = []
+        image_paths = []
+        for video_path in video_paths:
+            if not args.force and is_up_to_date(video_path, args.output_dir):
+                print(f'[Skipped] output is up to date: {video_path}')
+                output_path = SubtitleRemover.get_output_path(video_path, args.output_dir)
+                results.append({'input': video_path, 'output': output_path, 'status': 'skipped', 'seconds': 0,
+                                'device': None, 'error': None})
+                continue
+            if is_image_file(video_path):
+                # 图片统一走批处理模式
+                image_paths.append(video_path)
+                continue
+            sub_area = tuple(args.sub_area) if args.sub_area else None
+            jobs.append(scheduler.submit(JobSpec(video_path, sub_area, custom_config, output_dir=args.output_dir)))
+
+        start_time = time.time()
+        image_remover = None
+        if image_paths:
+            # 与SubtitleRemover一致，图片不使用字幕区域
+            image_remover = ImageBatchRemover(image_paths, custom_config=custom_config, output_dir=args.output_dir)
+        if jobs or image_remover:
+            if jobs:
+                scheduler.start()
+            try:
+                # 视频在调度器的工作线程中处理，图片在当前线程中批处理
+                if image_remover is not None:
+                    image_remover.run()
+                while not all(job.is_done for job in jobs):
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                print('Interrupted, aborting running jobs...', file=sys.stderr)
+                if image_remover is not None:
+                    image_remover.abort_event.set()
+                for job in jobs:
+                    scheduler.cancel(job.job_id)
+                # 等待运行中的任务响应中止信号
+                while any(job.state == RUNNING for job in jobs):
+                    time.sleep(0.5)
+            scheduler.shutdown()
+
+        if image_remover is not None:
+            for image_path in image_paths:
+                if image_path in image_remover.outputs:
+                    status, error = FINISHED, None
+                else:
+                    status, error = 'failed', image_remover.failures.get(image_path, 'aborted')
+                # 图片按尺寸分批推理，不单独计时
+                results.append({'input': image_path, 'output': image_remover.outputs.get(image_path), 'status': status,
+                                 'seconds': None, 'device': None, 'error': error})
+        for job in jobs:
+            results.append({'input': job.spec.video_path, 'output': job.output_path, 'status': job.state,
+                            'seconds': round(job.elapsed, 2), 'device': str(job.device) if job.device else None,
+                            'error': job.error})
+    failed = [r for r in results if r['status'] not in (FINISHED, 'skipped')]
+    summary = {
+        'total': len(results),
+        'finished': sum(r['status'] == FINISHED for r in results),
+        'skipped': sum(r['status'] == 'skipped' for r in results),
+        'failed': len(failed),
+        'seconds': round(time.time() - start_time, 2),
+        'files': results,
+    }
+    summary_text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary:
+        with open(args.summary, mode='w', encoding='utf-8') as f:
+            f.write(summary_text)
+        print(f'[Finished] {summary["finished"]} finished, {summary["skipped"]} skipped, {summary["failed"]} failed, '
+              f'summary saved to {args.summary}')
+    else:
+        print(summary_text)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    multiprocessing.set_start_method("spawn")
+    sys.exit(main())
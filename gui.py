@@ -288,6 +288,14 @@ class SubtitleRemoverGUI:
                 self.set_subtitle_config(y_p, h_p, x_p, w_p)
 
                 def task():
+                    # 多张图片使用批处理模式，模型只加载一次
+                    image_paths = [path for path in self.video_paths if is_image_file(path)]
+                    if len(image_paths) > 1:
+                        self.video_paths = [path for path in self.video_paths if not is_image_file(path)]
+                        # 与SubtitleRemover处理单张图片及命令行一致，图片不使用字幕区域
+                        self.sr = backend.main.ImageBatchRemover(image_paths, gui_mode=True)
+                        self.__disable_button()
+                        self.sr.run()
                     while self.video_paths:
                         video_path = self.video_paths.pop()
                         if subtitle_area is not None:
@@ -4,7 +4,6 @@ import cv2
 import os
 import configparser
 import tempfile
-import threading
 import multiprocessing
 import numpy as np
 import time
@@ -221,7 +220,7 @@ def clear_downloads():
 # Add backend to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-import backend.main
+from backend.scheduler import JobScheduler, JobSpec, QUEUED, FINISHED, CANCELLED
 from backend.tools.common_tools import is_image_file
 
 
@@ -249,16 +248,9 @@ class SubtitleRemoverWebUI:
         self.xmax = 0
         self.ymin = 0
         self.ymax = 0
-        # 字幕提取器
-        self.sr = None
-        # 处理进度
-        self.progress = 0
-        # 状态消息
-        self.status = "就绪"
-        # 预览图像
-        self.preview_frame = None
-        # 输出文件路径
-        self.output_path = None
+        # 任务调度器，多个任务排队并按设备并发处理
+        self.scheduler = JobScheduler()
+        self.scheduler.start()
         # 字幕配置
         self.subtitle_config_file = os.path.join(os.path.dirname(__file__), 'subtitle.ini')
         # 加载默认配置
@@ -267,10 +259,6 @@ class SubtitleRemoverWebUI:
         self.first_frame = None
         # 算法参数配置
         self.algorithm_params = self.get_default_params()
-        # 新增：中止处理相关属性
-        self.abort_event = threading.Event()  # 用于通知处理线程中止
-        self.processing_thread = None  # 处理线程引用
-        self.is_processing = False  # 是否正在处理
         # 上传进度相关变量
         self.last_upload_progress = 0
         self.last_upload_update = 0
@@ -283,6 +271,7 @@ class SubtitleRemoverWebUI:
             "sttn_neighbor_stride": config_module.STTN_NEIGHBOR_STRIDE,
             "sttn_reference_length": config_module.STTN_REFERENCE_LENGTH,
             "sttn_max_load_num": config_module.STTN_MAX_LOAD_NUM,
+            "sttn_precision": config_module.STTN_PRECISION,
             "lama_super_fast": config_module.LAMA_SUPER_FAST,
             "propainter_max_load_num": config_module.PROPAINTER_MAX_LOAD_NUM
         }
@@ -446,18 +435,10 @@ class SubtitleRemoverWebUI:
         resized = cv2.resize(image, (new_width, new_height))
         return resized
 
-    def process_video(self, params, progress=gr.Progress()):
-        """处理视频并更新进度"""
+    def process_video(self, params, priority=0, progress=gr.Progress()):
+        """提交任务到队列并更新进度，依次产出(预览图, 状态, 输出文件, 任务id)"""
         self.logger.info("开始处理视频")
         try:
-            # 重置中止事件
-            self.abort_event.clear()
-
-            self.status = "处理中..."
-            self.progress = 0
-            self.output_path = None
-            self.is_processing = True  # 标记为正在处理
-
             # 添加额外检查确保视频路径是有效的字符串
             if not isinstance(self.video_path, str) or not self.video_path or not os.path.exists(self.video_path):
                 # 显示更详细的错误信息
@@ -472,12 +453,11 @@ class SubtitleRemoverWebUI:
                     error_msg += f" - 无效路径类型: {type(self.video_path)}"
                     self.logger.error(f"无效的视频路径类型: {type(self.video_path)}")
 
-                self.status = error_msg
                 self.logger.error(error_msg)
-                self.is_processing = False
-                return None, self.status
+                yield None, error_msg, None, None
+                return
 
-            # 创建字幕提取器
+            # 字幕区域
             subtitle_area = (self.ymin, self.ymax, self.xmin, self.xmax)
             self.logger.info(f"设置字幕区域: ymin={self.ymin}, ymax={self.ymax}, xmin={self.xmin}, xmax={self.xmax}")
 
@@ -488,112 +468,52 @@ class SubtitleRemoverWebUI:
                 "sttn_neighbor_stride": max(1, min(int(params["sttn_neighbor_stride"]), 800)),
                 "sttn_reference_length": max(1, min(int(params["sttn_reference_length"]), 400)),
                 "sttn_max_load_num": max(50, min(int(params["sttn_max_load_num"]), 2000)),
+                "sttn_precision": str(params["sttn_precision"]),
                 "lama_super_fast": bool(params["lama_super_fast"]),
                 "propainter_max_load_num": max(20, min(int(params["propainter_max_load_num"]), 4000))
             }
 
             self.logger.info(f"处理参数: {safe_params}")
 
-            # 创建字幕去除器
-            self.logger.info("开始创建字幕去除器")
-            self.sr = backend.main.SubtitleRemover(
-                self.video_path,
-                subtitle_area,
-                True,
-                safe_params,
-                self.abort_event,
-                output_dir=OUTPUT_DIR  # 添加输出目录参数
-            )
-
-            # 新增：传递中止事件给SubtitleRemover
-            self.sr.abort_event = self.abort_event
+            # 提交任务，每个任务拥有独立的进度对象，不再共享字幕去除器
+            job = self.scheduler.submit(JobSpec(self.video_path, subtitle_area, safe_params,
+                                                priority=int(priority or 0), output_dir=OUTPUT_DIR))
+            self.logger.info(f"任务已加入队列: {job.job_id}")
 
-            # 启动处理线程
-            def run_remover():
-                self.logger.info("启动视频处理线程")
-                try:
-                    self.sr.run()
-                    if self.abort_event.is_set():
-                        self.status = "处理已中止"
-                        self.logger.info("视频处理已中止")
-                    else:
-                        self.output_path = self.sr.video_out_name
-                        self.status = "处理完成"
-                        self.logger.info(f"视频处理完成，输出路径: {self.output_path}")
-                except Exception as e:
-                    self.status = f"处理错误: {str(e)}"
-                    self.logger.error(f"视频处理过程中发生异常: {str(e)}", exc_info=True)
-                finally:
-                    self.is_processing = False
-                    self.sr = None
-
-            # 创建线程并启动（移动到函数外部）
-            self.processing_thread = threading.Thread(target=run_remover)
-            self.processing_thread.start()
-
-            # 更新进度 (降低更新频率)
-            last_update = time.time()
-            while self.processing_thread.is_alive():
+            preview_frame = None
+            while not job.is_done:
+                if job.state == QUEUED:
+                    status = f"排队中... 队列位置: {self.scheduler.queue_position(job.job_id)}"
+                    progress(0, desc=status)
+                else:
+                    if job.preview_frame is not None:
+                        # 调整预览图大小
+                        preview_frame = self.img_resize(job.preview_frame)
+                    status = f"处理中({job.device})... {job.progress}%"
+                    progress(job.progress / 100, desc=status)
+                yield preview_frame, status, None, job.job_id
                 # 每0.5秒更新一次进度，避免过于频繁
-                if time.time() - last_update > 0.5:
-                    if self.sr:
-                        self.progress = self.sr.progress_total
-                        if self.sr.preview_frame is not None:
-                            # 调整预览图大小
-                            self.preview_frame = self.img_resize(self.sr.preview_frame)
-                            
-                        # 更新详细状态信息
-                        if hasattr(self.sr, 'current_frame') and hasattr(self.sr, 'total_frames'):
-                            self.status = f"处理中... ({self.sr.current_frame}/{self.sr.total_frames} 帧)"
-                        elif hasattr(self.sr, 'progress_text'):
-                            self.status = self.sr.progress_text
-                        else:
-                            self.status = f"处理中... {self.progress}%"
-                        
-                        progress(self.progress / 100, desc=self.status)
-                        last_update = time.time()
-                
-                # 检查是否中止
-                if self.abort_event.is_set():
-                    self.status = "正在中止处理..."
-                    progress(0, desc=self.status)
-                    self.logger.info("检测到中止信号，正在停止处理")
-                    break
-                    
-                time.sleep(0.1)
-            # 确保线程结束后再返回
-            if self.abort_event.is_set():
-                # 等待线程完全结束
-                self.processing_thread.join(timeout=2.0)
-                self.logger.info("处理已中止")
-                return self.preview_frame, "处理已中止"
+                time.sleep(0.5)
+
+            if job.state == FINISHED:
+                self.logger.info(f"视频处理完成，输出路径: {job.output_path}")
+                completion_msg = f"处理完成\n输出文件: {os.path.basename(job.output_path)}\n总耗时: {round(job.elapsed, 2)}秒"
+                yield preview_frame, completion_msg, job.output_path, job.job_id
+            elif job.state == CANCELLED:
+                self.logger.info("视频处理已中止")
+                yield preview_frame, "处理已中止", None, job.job_id
             else:
-                self.logger.info("视频处理完成")
-                completion_msg = f"处理完成\n输出文件: {os.path.basename(self.output_path)}\n总耗时: {getattr(self.sr, 'processing_time', '未知')}"
-                return self.preview_frame, completion_msg
+                self.logger.error(f"视频处理过程中发生异常: {job.error}")
+                yield preview_frame, f"处理错误: {job.error}", None, job.job_id
         except Exception as e:
-            self.status = f"错误: {str(e)}"
-            self.is_processing = False
             self.logger.error(f"处理视频时发生异常: {str(e)}", exc_info=True)
-            return None, self.status
+            yield None, f"错误: {str(e)}", None, None
 
-    def abort_processing(self):
+    def abort_processing(self, job_id):
         """中止处理过程"""
-        self.logger.info("收到中止处理请求")
-        if self.is_processing:
-            self.abort_event.set()
-            self.status = "正在中止处理..."
+        self.logger.info(f"收到中止处理请求: {job_id}")
+        if job_id and self.scheduler.cancel(job_id):
             self.logger.info("已发送中止信号")
-
-            # 尝试强制停止处理线程
-            if self.processing_thread and self.processing_thread.is_alive():
-                try:
-                    # 非阻塞方式尝试停止
-                    self.processing_thread.join(timeout=1.0)
-                except RuntimeError:
-                    pass
-
-            self.logger.info("中止请求已发送")
             return "中止请求已发送"
         else:
             self.logger.info("没有正在进行的处理")
@@ -635,6 +555,12 @@ class SubtitleRemoverWebUI:
                     value=self.algorithm_params["sttn_max_load_num"],
                     interactive=True
                 )
+                sttn_precision = gr.Dropdown(
+                    choices=["auto", "fp32", "fp16", "bf16", "int8"],
+                    value=self.algorithm_params["sttn_precision"],
+                    label="推理精度（int8仅CPU，提速但效果稍差，首次使用需校准）",
+                    interactive=True
+                )
 
             # LAMA参数
             with gr.Group(visible=False) as lama_params:
@@ -674,6 +600,7 @@ class SubtitleRemoverWebUI:
                 "sttn_neighbor_stride": sttn_neighbor_stride,
                 "sttn_reference_length": sttn_reference_length,
                 "sttn_max_load_num": sttn_max_load_num,
+                "sttn_precision": sttn_precision,
                 "lama_super_fast": lama_super_fast,
                 "propainter_max_load_num": propainter_max_load_num
             }
@@ -684,19 +611,20 @@ class SubtitleRemoverWebUI:
             sttn_neighbor_stride,
             sttn_reference_length,
             sttn_max_load_num,
+            sttn_precision,
             lama_super_fast,
             propainter_max_load_num
         ]
 
     def _process_video_wrapper(self, *args):
-        """包装函数将位置参数转换为字典格式"""
+        """包装函数将位置参数转换为字典格式，最后一个参数为任务优先级"""
         keys = [
             "mode", "sttn_skip_detection", "sttn_neighbor_stride",
-            "sttn_reference_length", "sttn_max_load_num",
+            "sttn_reference_length", "sttn_max_load_num", "sttn_precision",
             "lama_super_fast", "propainter_max_load_num"
         ]
-        params = dict(zip(keys, args))
-        return self.process_video(params)
+        params = dict(zip(keys, args[:-1]))
+        yield from self.process_video(params, args[-1])
 
     def create_file_management_tab(self):
         """创建文件管理标签页"""
@@ -1053,6 +981,12 @@ class SubtitleRemoverWebUI:
                     # 算法参数设置
                     param_components = self.create_algorithm_params_ui()
 
+                    # 任务优先级
+                    priority_slider = gr.Slider(minimum=0, maximum=10, step=1, value=0,
+                                                label="任务优先级（数值越大越先处理）", interactive=True)
+                    # 当前任务id
+                    job_state = gr.State(None)
+
                     # 处理按钮
                     process_btn = gr.Button("开始去除字幕", variant="primary")
 
@@ -1186,19 +1120,15 @@ class SubtitleRemoverWebUI:
             # 去除字幕
             process_btn.click(
                 fn=self._process_video_wrapper,
-                inputs=param_components,
-                outputs=[process_preview, output_display],
+                inputs=param_components + [priority_slider],
+                outputs=[process_preview, output_display, output_file, job_state],
                 show_progress="minimal"
-            ).then(
-                fn=lambda: self.output_path,
-                inputs=[],
-                outputs=output_file
             )
 
             # 中止按钮事件
             abort_btn.click(
                 fn=self.abort_processing,
-                inputs=[],
+                inputs=[job_state],
                 outputs=status_display
             )
 
@@ -1213,13 +1143,14 @@ class SubtitleRemoverWebUI:
                    - 使用"对齐到视频底部中央"按钮快速定位常见字幕位置
                    - 使用"重置为默认位置"恢复初始设置
                 3. **算法参数设置**: 根据视频类型选择合适的算法和参数
-                4. **开始处理**: 点击"开始去除字幕"按钮
+                4. **开始处理**: 点击"开始去除字幕"按钮，任务进入队列，按优先级和提交顺序处理
                 5. **查看结果**: 处理完成后可在下方下载处理后的文件
 
                 ### 状态信息说明
 
                 - **就绪**: 系统等待操作
                 - **加载中**: 正在加载视频文件
+                - **排队中**: 任务在队列中等待，显示队列位置
                 - **处理中**: 正在去除字幕
                 - **处理完成**: 字幕去除完成，可下载结果
                 - **处理错误**: 处理过程中发生错误
@@ -1241,6 +1172,9 @@ class SubtitleRemoverWebUI:
 
 if __name__ == "__main__":
     multiprocessing.set_start_method("spawn")
+    # 预加载常用模型，第一个任务不再需要等待模型加载
+    from backend.inpaint.model_registry import model_registry
+    model_registry.warm_up(config_module.MODEL_WARM_UP)
     webui = SubtitleRemoverWebUI()
     demo = webui.create_ui()
     demo.launch(server_name="0.0.0.0", server_port=7860)
\ No newline at end of file